@@ -20,16 +20,25 @@ provider = ProviderOpenAI(
 
 
 async def process_question(question, dir, jsonls):
-    question_id = question["question_id"]
-    sessions = question["haystack_sessions"]
-    question_str = question["question"]
-    haystack_dates = question["haystack_dates"]
-
     starter = ATRIMemoryStarter(
-        data_dir_path=f"{dir}/{question_id}",
+        data_dir_path=f"{dir}/{question['question_id']}",
         llm_provider=provider,
+        # 所有问题共享同一个嵌入缓存，相同的文本只推理一次
+        embedding_cache_path=f"{dir}/embedding_cache.db",
     )
     await starter.initialize()
+    try:
+        return await _process_question(starter, question, dir, jsonls)
+    finally:
+        # 释放共享模型的引用，写回嵌入缓存并关闭各存储的连接和线程池
+        await starter.close()
+
+
+async def _process_question(starter: ATRIMemoryStarter, question, dir, jsonls):
+    question_id = question["question_id"]
+    sessions = question["haystack_sessions"]
+    question_str = question["question"]
+    haystack_dates = question["haystack_dates"]
 
     # 会话处理保持同步，确保顺序
     answer_chat_summary = ""
@@ -115,7 +124,7 @@ async def process_question(question, dir, jsonls):
     related_res2 = ""
     for val in result_2:
         cnt += 1
-        related_res2 += f"Related {cnt}: {val.data['text']}\n"
+        related_res2 += f"Related {cnt}: {val.data.text}\n"
     system_prompt2 = (
         "You are a helpful assistant. "
         f"Related history of you and the user: {related_res2} "
@@ -126,7 +135,7 @@ async def process_question(question, dir, jsonls):
     related_res3 = ""
     for val in result_3:
         cnt += 1
-        related_res3 += f"Related {cnt}: {val.data['text']}\n"
+        related_res3 += f"Related {cnt}: {val.data.text}\n"
     system_prompt3 = (
         "You are a helpful assistant. "
         f"Related history of you and the user: {related_res3} "
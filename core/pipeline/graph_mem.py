@@ -1,7 +1,6 @@
 import numpy as np
 import uuid
 import time
-import json
 import logging
 from collections import defaultdict
 from ..provider.llm.openai_source import ProviderOpenAI
@@ -44,7 +43,7 @@ class GraphMemory:
         embedding_provider: EmbeddingProvider = None,
         vec_db: VecDB = None,
         vec_db_summary: VecDB = None,
-        graph_store: GraphStore = None,
+        graph_store: AsyncGraphStore = None,
         logger: logging.Logger = None,
     ) -> None:
         self.provider = provider
@@ -57,8 +56,8 @@ class GraphMemory:
 
         self.logger = logger or logging.getLogger("astrbot")
 
-    async def get_phase_node(self, entity_name: str) -> str | None:
-        """查找是否有对应的 Phase 节点
+    async def get_phase_node(self, entity_name: str, user_id: str = None) -> str | None:
+        """查找用户是否有对应的 Phase 节点
 
         Returns:
             节点的 id, 如果没找到, 返回 None
@@ -70,7 +69,9 @@ class GraphMemory:
         #     ):
         #         return node
         # return None
-        return self.graph_store.find_phase_node_by_name(entity_name)
+        return await self.graph_store.find_phase_node_by_name(
+            entity_name, user_id=user_id
+        )
 
     async def add_to_graph(
         self, text: str, user_id: str, group_id: str = None, username: str = None, need_update: bool = False
@@ -127,29 +128,28 @@ class GraphMemory:
             metadata=metadata,
             id=summary_id,  # doc_id
         )
-        self.graph_store.add_passage_node(
+        # 段落的全部节点和边在一个图事务中写入
+        nodes: list[BaseNode] = [
             PassageNode(id=summary_id, ts=timestamp, user_id=user_id)
-        )
+        ]
+        edges: list[BaseEdge] = []
 
-        # Add the phase nodes
+        # Add the phase nodes, 同一用户下的同名实体由 write_batch 在写入时复用已有节点
         _node_id = {}
         for entity in entities:
             entity_name = entity.name
-            entity_real_name = entity.name.replace("USER_ID", user_id)
-            if node := await self.get_phase_node(entity_real_name):
-                self.logger.info(f"Phase node already exists: {node}")
-                _node_id[entity_name] = node
-            else:
+            if entity_name not in _node_id:
                 _node_id[entity_name] = str(uuid.uuid4())
-                self.graph_store.add_phase_node(
+                nodes.append(
                     PhaseNode(
                         id=_node_id[entity_name],
                         ts=timestamp,
-                        name=entity_real_name,
+                        name=entity.name.replace("USER_ID", user_id),
                         type=entity.type,
+                        user_id=user_id,
                     )
                 )
-            self.graph_store.add_passage_edge(
+            edges.append(
                 PassageEdge(
                     source=_node_id[entity_name],
                     target=summary_id,
@@ -160,11 +160,12 @@ class GraphMemory:
                 )
             )
         # Add Edges
+        facts, fact_ids = [], []
         for relation in relations:
             fact_id = str(uuid.uuid4())
             if relation.source not in _node_id or relation.target not in _node_id:
                 continue
-            self.graph_store.add_phase_edge(
+            edges.append(
                 PhaseEdge(
                     source=_node_id[relation.source],
                     target=_node_id[relation.target],
@@ -179,32 +180,43 @@ class GraphMemory:
                 fact = relation.fact
             else:
                 fact = f"{relation.source} {relation.relation_type} {relation.target}"
-            _ = await self.vec_db.insert(
-                content=fact,
-                id=fact_id,
-                metadata={
+            facts.append(fact)
+            fact_ids.append(fact_id)
+        resolved = await self.graph_store.write_batch(nodes, edges)
+        reused = {k: v for k, v in resolved.items() if k != v}
+        if reused:
+            self.logger.info(f"Phase nodes already exist: {reused}")
+        # 同一段落的事实在一个事务中写入
+        await self.vec_db.insert_many(
+            contents=facts,
+            ids=fact_ids,
+            metadatas=[
+                {
                     "summary_id": summary_id,
                     "user_id": user_id,
                     "username": username,
-                },
-            )
-        self.graph_store.save(self.file_path)
+                }
+                for _ in facts
+            ],
+        )
+        await self.graph_store.save(self.file_path)
 
     async def check_relations(self, relations: list[Relation], user_id: str):
         """检查关系是否重复或冲突，并且做出相关更新"""
         to_be_check = [r.fact for r in relations if r.fact]
         # all_facts: list[Result] = []
         all_facts: dict[str, Result] = {}
-        for relation in relations:
-            result_facts = await self.vec_db.retrieve(
-                query=relation.fact,
-                k=3,
-                metadata_filters={
-                    "user_id": user_id,
-                },
-            )
+        # 一次批量嵌入、一次 FAISS 查询、一次文档读取
+        retrieved = await self.vec_db.retrieve_many(
+            queries=to_be_check,
+            k=3,
+            metadata_filters={
+                "user_id": user_id,
+            },
+        )
+        for result_facts in retrieved:
             for result in result_facts:
-                all_facts[result.data["doc_id"]] = result
+                all_facts[result.data.doc_id] = result
         all_facts: list[Result] = list(all_facts.values())
         if not all_facts:
             return
@@ -214,7 +226,7 @@ class GraphMemory:
             to_be_check_str += f"{idx}: {fact}\n"
         all_facts_str = ""
         for idx, fact in enumerate(all_facts):
-            all_facts_str += f"{idx}: {fact.data['text']}\n"
+            all_facts_str += f"{idx}: {fact.data.text}\n"
         # print(f"to_be_check_str: {to_be_check_str}")
         # print(f"all_facts_str: {all_facts_str}")
         prompt = REL_CHECK_PROMPT.format(
@@ -251,7 +263,7 @@ class GraphMemory:
                     f"Conflict detected: {relations[int(idx)]} with {all_facts[int(result['existing_fact_idx'])]}"
                 )
                 # re sum
-                metadata = json.loads(all_facts[existing_fact_idx].data["metadata"])
+                metadata = all_facts[existing_fact_idx].data.metadata
                 old_summary_id = metadata.get("summary_id", None)
                 old_summary = (
                     await self.vec_db_summary.document_storage.get_document_by_doc_id(
@@ -261,8 +273,8 @@ class GraphMemory:
                 llm_response_resum = await self.provider.text_chat(
                     system_prompt="You are an intelligent assistant that helps update personal memory summaries.",
                     prompt=RESUM_PROMPT.format(
-                        old_summary=old_summary["text"],
-                        conflicting_fact=all_facts[existing_fact_idx].data["text"],
+                        old_summary=old_summary.text,
+                        conflicting_fact=all_facts[existing_fact_idx].data.text,
                         new_fact=relations[idx].fact,
                     ),
                 )
@@ -272,11 +284,11 @@ class GraphMemory:
                     new_text=llm_response_resum.completion_text,
                 )
                 # delete edge and fact from store
-                self.graph_store.delete_phase_edge_by_fact_id(
-                    fact_id=all_facts[existing_fact_idx].data["doc_id"]
+                await self.graph_store.delete_phase_edge_by_fact_id(
+                    fact_id=all_facts[existing_fact_idx].data.doc_id
                 )
                 await self.vec_db.delete(
-                    doc_id=all_facts[existing_fact_idx].data["doc_id"]
+                    doc_id=all_facts[existing_fact_idx].data.doc_id
                 )
 
             elif result["result"] == 2:
@@ -287,7 +299,11 @@ class GraphMemory:
                 relations[int(idx)].fact = None
 
     async def search_graph(
-        self, query: str, num_to_retrieval: int = 5, filters: dict = None
+        self,
+        query: str,
+        num_to_retrieval: int = 5,
+        filters: dict = None,
+        ppr_method: str = "exact",
     ) -> dict:
         # --- FACT RESULTS
         results = await self.vec_db.retrieve(
@@ -301,21 +317,24 @@ class GraphMemory:
         related_node_scores = defaultdict(list[float])
 
         _node_id_name = {}
+        results = [result for result in results if result.data.doc_id != "-1"]
+        fact_nodes = await self.graph_store.get_phase_nodes_by_fact_ids(
+            [result.data.doc_id for result in results]
+        )
         for result in results:
-            if result.data["doc_id"] == "-1":
-                continue
-            for n1, n2 in self.graph_store.get_phase_nodes_by_fact_id(
-                fact_id=result.data["doc_id"]
-            ):
+            for n1, n2 in fact_nodes.get(result.data.doc_id, []):
                 related_node_scores[n1.id].append(result.similarity)
                 related_node_scores[n2.id].append(result.similarity)
                 _node_id_name[n1.id] = n1.name
                 _node_id_name[n2.id] = n2.name
 
         self.logger.info(f"Related phase entities: {str(related_node_scores)}")
+        degrees = await self.graph_store.phase_node_degrees(
+            list(related_node_scores)
+        )
         for node, scores in related_node_scores.items():
             final_related_node_score[node] = np.mean(scores)
-            cnt = self.graph_store.cnt_phase_node_edges(node)
+            cnt = degrees[node]
             self.logger.info(f"Node: {_node_id_name[node]} cnt: {cnt}")
             if cnt > 0:
                 final_related_node_score[node] /= cnt
@@ -335,9 +354,9 @@ class GraphMemory:
 
         related_passage_node_scores: dict[str, float] = {}
         for result in summary_results:
-            if result.data["doc_id"] == "-1":
+            if result.data.doc_id == "-1":
                 continue
-            related_passage_node_scores[result.data["doc_id"]] = result.similarity
+            related_passage_node_scores[result.data.doc_id] = result.similarity
 
         # 执行 PPR 算法，得到最终的文档
         # Reference: https://arxiv.org/pdf/2502.14802
@@ -351,23 +370,21 @@ class GraphMemory:
         ranked_docs = await self.run_ppr(
             personalization=personalization,
             user_id=filters.get("user_id", None),  # TODO
+            method=ppr_method,
         )
         ret = {}
-        i = 0
-        for doc_id, score in ranked_docs.items():
-            # ret[id] = self.G.nodes[id].get("summary", None)
-            doc_data = (
-                await self.vec_db_summary.document_storage.get_document_by_doc_id(
-                    doc_id
-                )
-            )
+        top_doc_ids = list(ranked_docs)[:num_to_retrieval]
+        docs = await self.vec_db_summary.document_storage.get_documents_by_doc_ids(
+            top_doc_ids
+        )
+        for doc_id in top_doc_ids:
+            doc_data = docs.get(doc_id)
+            if doc_data is None:
+                continue
             ret[doc_id] = {
-                "text": doc_data.get("text", None),
-                "score": score,
+                "text": doc_data.text,
+                "score": ranked_docs[doc_id],
             }
-            i += 1
-            if i >= num_to_retrieval:
-                break
         self.logger.info(f"Ranked passage nodes: {ret}")
         return ret
 
@@ -378,25 +395,27 @@ class GraphMemory:
         damping_factor: float = 0.5,
         max_iter: int = 100,
         tol: float = 1e-6,
+        method: str = "exact",
     ) -> dict[str, float]:
         ranked_docs = {}
 
         self.logger.info(
-            f"personalization params: {personalization}, max_iter: {max_iter}, tol: {tol}"
+            f"personalization params: {personalization}, max_iter: {max_iter}, tol: {tol}, method: {method}"
         )
 
         if not personalization:
             personalization = None
 
-        ranked_scores = self.graph_store.run_ppr(
+        ranked_scores = await self.graph_store.run_ppr(
             personalization=personalization,
             user_id=user_id,
             damping_factor=damping_factor,
             max_iter=max_iter,
             tol=tol,
+            method=method,
         )
 
-        passage_nodes = await self._get_passage_nodes()
+        passage_nodes = await self._get_passage_nodes(user_id)
 
         # print("AFTER PPR: ranked_scores", ranked_scores)
         ranked_docs = {}
@@ -414,7 +433,7 @@ class GraphMemory:
         filter = {}
         if user_id:
             filter["user_id"] = user_id
-        for node in self.graph_store.get_passage_nodes(filter=filter):
+        for node in await self.graph_store.get_passage_nodes(filter=filter):
             ret[node.id] = node
         return ret
 
@@ -471,7 +490,7 @@ class GraphMemory:
     async def get_graph(self, filter: dict = None) -> GraphResult:
         """获取图谱"""
         # return self.G
-        return self.graph_store.get_graph_networkx(filter)
+        return await self.graph_store.get_graph_networkx(filter)
 
     async def get_user_ids(self) -> list[str]:
         """获取所有用户 ID"""
@@ -9,3 +9,28 @@ class EmbeddingProvider:
         获取文本的嵌入
         """
         ...
+
+    async def get_embeddings(self, texts: list[str]) -> list[np.ndarray]:
+        """
+        批量获取文本的嵌入。默认逐条调用 get_embedding，支持批量推理的提供商应当重写该方法。
+        """
+        return [await self.get_embedding(text) for text in texts]
+
+    @abc.abstractmethod
+    async def get_dim(self) -> int:
+        """
+        获取嵌入的维度
+        """
+        ...
+
+    async def warmup(self):
+        """
+        预热模型，使模型加载的开销发生在启动阶段而不是第一次请求时
+        """
+        await self.get_embedding("warmup")
+
+    async def close(self):
+        """
+        释放提供商占用的资源
+        """
+        ...
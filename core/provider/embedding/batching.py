@@ -0,0 +1,85 @@
+import asyncio
+import numpy as np
+from . import EmbeddingProvider
+
+
+class BatchingEmbeddingProvider(EmbeddingProvider):
+    """微批处理层。
+
+    将短时间窗口内并发到达的 get_embedding 调用合并成一次 get_embeddings 调用，
+    从而让底层模型一次前向推理处理多条文本。
+    """
+
+    def __init__(
+        self,
+        provider: EmbeddingProvider,
+        max_batch_size: int = 64,
+        max_wait_ms: float = 5.0,
+    ) -> None:
+        """
+        Args:
+            provider (EmbeddingProvider): 实际执行推理的嵌入提供商
+            max_batch_size (int): 单批次最多包含的文本数量，达到后立即下发
+            max_wait_ms (float): 第一条请求到达后最多等待的毫秒数
+        """
+        self.provider = provider
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+        super().__init__()
+
+    async def get_embedding(self, text) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    async def get_embeddings(self, texts: list[str]) -> list[np.ndarray]:
+        # 调用方已经自行组好了批次，直接下发
+        return await self.provider.get_embeddings(texts)
+
+    async def get_dim(self) -> int:
+        return await self.provider.get_dim()
+
+    async def warmup(self):
+        await self.provider.warmup()
+
+    async def close(self):
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.provider.close()
+
+    def _flush(self):
+        """将当前等待中的请求作为一个批次下发"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.get_running_loop().create_task(self._run_batch(batch))
+        # 保留引用，避免任务在完成前被回收
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: list[tuple[str, asyncio.Future]]):
+        # 同一批次中的重复文本只推理一次
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            embeddings = await self.provider.get_embeddings(texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        text_embedding = dict(zip(texts, embeddings))
+        for text, future in batch:
+            if not future.done():
+                future.set_result(text_embedding[text])
@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import aiosqlite
+import numpy as np
+from loguru import logger
+from collections import OrderedDict
+from dataclasses import dataclass
+from . import EmbeddingProvider
+
+
+@dataclass
+class CacheStats:
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / total if total else 0.0
+
+
+class CachedEmbeddingProvider(EmbeddingProvider):
+    """内容寻址的嵌入缓存。
+
+    以 (model, task_type, sha256(text)) 为键，依次查询内存 LRU 和 SQLite 磁盘缓存，
+    只有都未命中的文本才会交给底层提供商推理。新计算的向量在后台批量写回磁盘，
+    不阻塞调用方。
+    """
+
+    def __init__(
+        self,
+        provider: EmbeddingProvider,
+        model: str,
+        task_type: str = "search_document",
+        db_path: str = None,
+        max_memory_items: int = 10000,
+    ) -> None:
+        """
+        Args:
+            provider (EmbeddingProvider): 底层嵌入提供商
+            model (str): 模型名称，作为缓存键的一部分
+            task_type (str): 任务类型，作为缓存键的一部分
+            db_path (str): 磁盘缓存的 SQLite 路径，为空时只使用内存缓存
+            max_memory_items (int): 内存 LRU 中最多保留的向量数量
+        """
+        self.provider = provider
+        self.model = model
+        self.task_type = task_type
+        self.db_path = db_path
+        self.max_memory_items = max_memory_items
+        self.connection = None
+        self.stats = CacheStats()
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._pending: dict[str, np.ndarray] = {}
+        """等待写回磁盘的向量"""
+        self._flush_task: asyncio.Task | None = None
+        super().__init__()
+
+    async def initialize(self):
+        """打开磁盘缓存"""
+        if not self.db_path or self.connection:
+            return
+        self.connection = await aiosqlite.connect(self.db_path)
+        await self.connection.execute("PRAGMA journal_mode=WAL")
+        await self.connection.execute("PRAGMA busy_timeout=5000")
+        # 缓存可以重新计算，WAL 下 NORMAL 只在检查点时 fsync，掉电最多丢失最近的写入
+        await self.connection.execute("PRAGMA synchronous=NORMAL")
+        await self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model TEXT NOT NULL,
+                task_type TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, task_type, text_hash)
+            ) WITHOUT ROWID
+            """
+        )
+        await self.connection.commit()
+
+    async def get_embedding(self, text) -> np.ndarray:
+        embeddings = await self.get_embeddings([text])
+        return embeddings[0]
+
+    async def get_embeddings(self, texts: list[str]) -> list[np.ndarray]:
+        hashes = [self._hash(text) for text in texts]
+        result: list[np.ndarray | None] = [None] * len(texts)
+
+        # 内存缓存
+        missing: dict[str, list[int]] = {}
+        for i, text_hash in enumerate(hashes):
+            vector = self._memory.get(text_hash)
+            if vector is not None:
+                self._memory.move_to_end(text_hash)
+                result[i] = vector
+                self.stats.memory_hits += 1
+            else:
+                missing.setdefault(text_hash, []).append(i)
+
+        # 尚未写回磁盘的向量可能已被挤出内存 LRU
+        if missing and self._pending:
+            for text_hash in [h for h in missing if h in self._pending]:
+                vector = self._pending[text_hash]
+                self._memory_put(text_hash, vector)
+                for i in missing.pop(text_hash):
+                    result[i] = vector
+                    self.stats.memory_hits += 1
+
+        # 磁盘缓存
+        if missing and self.connection:
+            for text_hash, vector in (await self._disk_get(list(missing))).items():
+                self._memory_put(text_hash, vector)
+                for i in missing.pop(text_hash):
+                    result[i] = vector
+                    self.stats.disk_hits += 1
+
+        if missing:
+            self.stats.misses += sum(len(idxs) for idxs in missing.values())
+            miss_hashes = list(missing)
+            miss_texts = [texts[missing[h][0]] for h in miss_hashes]
+            if len(miss_texts) == 1:
+                # 走单条接口，便于下层的微批处理合并并发请求
+                embeddings = [await self.provider.get_embedding(miss_texts[0])]
+            else:
+                embeddings = await self.provider.get_embeddings(miss_texts)
+            computed = {}
+            for text_hash, embedding in zip(miss_hashes, embeddings):
+                vector = np.asarray(embedding, dtype=np.float32)
+                vector.flags.writeable = False
+                computed[text_hash] = vector
+                self._memory_put(text_hash, vector)
+                for i in missing[text_hash]:
+                    result[i] = vector
+            if self.connection:
+                self._pending.update(computed)
+                if self._flush_task is None or self._flush_task.done():
+                    self._flush_task = asyncio.create_task(self._flush_pending())
+        return result
+
+    async def get_dim(self) -> int:
+        return await self.provider.get_dim()
+
+    async def warmup(self):
+        await self.provider.warmup()
+
+    async def flush(self):
+        """等待后台写回完成"""
+        while self._flush_task is not None and not self._flush_task.done():
+            await asyncio.shield(self._flush_task)
+
+    async def close(self):
+        """写回剩余的向量并关闭磁盘缓存。底层提供商可能被多个缓存共享，由其持有者负责关闭"""
+        if self.connection:
+            await self.flush()
+            await self.connection.close()
+            self.connection = None
+
+    def _hash(self, text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _memory_put(self, text_hash: str, vector: np.ndarray):
+        self._memory[text_hash] = vector
+        self._memory.move_to_end(text_hash)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    async def _disk_get(self, hashes: list[str]) -> dict[str, np.ndarray]:
+        ret = {}
+        # SQLite 对单条语句的参数数量有限制，分批查询
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start : start + 500]
+            sql = (
+                "SELECT text_hash, vector FROM embedding_cache "
+                "WHERE model = ? AND task_type = ? AND text_hash IN ({})"
+            ).format(",".join("?" * len(chunk)))
+            async with self.connection.execute(
+                sql, (self.model, self.task_type, *chunk)
+            ) as cursor:
+                for text_hash, blob in await cursor.fetchall():
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    ret[text_hash] = vector
+        return ret
+
+    async def _flush_pending(self):
+        """把待写回的向量分批写入磁盘，直到没有新的待写回向量"""
+        while self._pending:
+            # 写入完成前仍保留在 _pending 中，供查询命中
+            vectors = dict(self._pending)
+            try:
+                await self._disk_put(vectors)
+            except Exception as e:
+                # 写回失败只影响缓存命中率，不影响调用方
+                logger.warning(f"Failed to write {len(vectors)} embeddings to cache: {e}")
+            for text_hash in vectors:
+                self._pending.pop(text_hash, None)
+
+    async def _disk_put(self, vectors: dict[str, np.ndarray]):
+        await self.connection.executemany(
+            "INSERT OR REPLACE INTO embedding_cache (model, task_type, text_hash, vector) VALUES (?, ?, ?, ?)",
+            [
+                (self.model, self.task_type, text_hash, vector.tobytes())
+                for text_hash, vector in vectors.items()
+            ],
+        )
+        await self.connection.commit()
@@ -0,0 +1,36 @@
+"""Matryoshka 嵌入的维度截断，不依赖 nomic，可供存储层和迁移工具使用"""
+
+import numpy as np
+
+MATRYOSHKA_DIMS = (768, 512, 256, 128, 64)
+"""nomic-embed-text-v1.5 支持的 Matryoshka 输出维度"""
+
+
+def check_matryoshka_dim(old_dim: int, new_dim: int):
+    """检查能否从 old_dim 截断到 new_dim
+
+    Raises:
+        ValueError: 如果 new_dim 不是支持的维度，或不小于 old_dim
+    """
+    if new_dim not in MATRYOSHKA_DIMS:
+        raise ValueError(f"不支持的输出维度: {new_dim}, 可选: {MATRYOSHKA_DIMS}")
+    if new_dim >= old_dim:
+        raise ValueError(f"只能截断到更低的维度, 当前: {old_dim}, 目标: {new_dim}")
+
+
+def truncate_embeddings(vectors: np.ndarray, dim: int) -> np.ndarray:
+    """按 nomic-embed-text-v1.5 的做法截断嵌入: 对完整嵌入做 layer_norm，截断后 L2 归一化
+
+    layer_norm 与缩放无关，截断后又会重新归一化，因此只需要减去每行的均值。
+
+    Args:
+        vectors (np.ndarray): 完整维度的嵌入矩阵
+        dim (int): 目标维度
+    Returns:
+        np.ndarray: 截断并归一化后的 float32 矩阵
+    """
+    vectors = np.asarray(vectors, dtype="float32")
+    centered = vectors - vectors.mean(axis=1, keepdims=True)
+    truncated = np.ascontiguousarray(centered[:, :dim], dtype="float32")
+    norms = np.linalg.norm(truncated, axis=1, keepdims=True)
+    return truncated / np.maximum(norms, 1e-12)
@@ -1,21 +1,133 @@
+import asyncio
+import multiprocessing
 import numpy as np
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
 from . import EmbeddingProvider
+from .matryoshka import MATRYOSHKA_DIMS
 from nomic import embed
 
+EXECUTOR_MODES = ("inline", "thread", "process")
+
+
+def _embed_texts(
+    texts: list[str], model: str, task_type: str, dimensionality: int
+) -> list[list[float]]:
+    """执行本地推理。定义在模块级别，以便在进程池中被序列化调用"""
+    output = embed.text(
+        texts=texts,
+        model=model,
+        task_type=task_type,
+        dimensionality=dimensionality,
+        inference_mode="local",
+    )
+    return output["embeddings"]
+
+
+def _preload_model(model: str, dimensionality: int):
+    """进程池 worker 的初始化函数，提前加载模型"""
+    _embed_texts(["warmup"], model, "search_document", dimensionality)
+
 
 class NomicEmbeddingProvider(EmbeddingProvider):
-    def __init__(self, model: str = "nomic-embed-text-v1.5") -> None:
+    def __init__(
+        self,
+        model: str = "nomic-embed-text-v1.5",
+        task_type: str = "search_document",
+        dimensionality: int = 768,
+        executor: str = "thread",
+        max_workers: int = 1,
+        max_queue_size: int = 32,
+        timeout: float = 30.0,
+    ) -> None:
+        """
+        Args:
+            model (str): 模型名称
+            task_type (str): nomic 的任务类型
+            dimensionality (int): 输出维度，Matryoshka 模型可以截断到更低的维度以缩小索引
+            executor (str): 推理的执行方式。inline 直接在事件循环中执行(会阻塞事件循环)，
+                thread 在线程池中执行，process 在预加载了模型的独立进程池中执行
+            max_workers (int): 线程池/进程池的 worker 数量
+            max_queue_size (int): 同时排队和执行中的推理请求上限，超出的请求会等待
+            timeout (float): 单次调用的超时时间(秒)，包括排队时间
+        """
+        if executor not in EXECUTOR_MODES:
+            raise ValueError(f"不支持的执行方式: {executor}, 可选: {EXECUTOR_MODES}")
+        if dimensionality not in MATRYOSHKA_DIMS:
+            raise ValueError(
+                f"不支持的输出维度: {dimensionality}, 可选: {MATRYOSHKA_DIMS}"
+            )
         self.model = model
+        self.dimensionality = dimensionality
+        self.task_type = task_type
+        self.executor = executor
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._queue_slots = asyncio.Semaphore(max_queue_size)
+        self._executor: Executor | None = None
+        if executor == "thread":
+            self._executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="atri-embed"
+            )
+        elif executor == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_preload_model,
+                initargs=(model, dimensionality),
+            )
         super().__init__()
 
     async def get_embedding(self, text):
-        output = embed.text(
-            texts=[text],
-            model=self.model,
-            task_type="search_document",
-            inference_mode="local",
-        )
-        return np.array(output["embeddings"][0])
+        embeddings = await self.get_embeddings([text])
+        return embeddings[0]
+
+    async def get_embeddings(self, texts: list[str]) -> list[np.ndarray]:
+        if not texts:
+            return []
+        embeddings = await self._infer(list(texts))
+        return [np.array(embedding) for embedding in embeddings]
+
+    async def _infer(self, texts: list[str]) -> list[list[float]]:
+        if self._executor is None:
+            return _embed_texts(texts, self.model, self.task_type, self.dimensionality)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        # 排队时间同样计入超时
+        await asyncio.wait_for(self._queue_slots.acquire(), timeout=self.timeout)
+        try:
+            cf = self._executor.submit(
+                _embed_texts, texts, self.model, self.task_type, self.dimensionality
+            )
+        except BaseException:
+            self._queue_slots.release()
+            raise
+        # 推理真正结束后才释放名额，超时的调用不会让排队深度超过上限
+        cf.add_done_callback(lambda _: self._release_slot(loop))
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(cf), timeout=max(deadline - loop.time(), 0)
+            )
+        except asyncio.TimeoutError:
+            cf.cancel()
+            raise
+
+    async def warmup(self):
+        if isinstance(self._executor, ProcessPoolExecutor):
+            # 每个 worker 进程在初始化时都会加载模型，这里让进程池启动全部 worker
+            await asyncio.gather(
+                *[self._infer(["warmup"]) for _ in range(self.max_workers)]
+            )
+        else:
+            await self._infer(["warmup"])
+
+    def _release_slot(self, loop: asyncio.AbstractEventLoop):
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(self._queue_slots.release)
 
     async def get_dim(self):
-        return 768
+        return self.dimensionality
+
+    async def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
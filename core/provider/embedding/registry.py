@@ -0,0 +1,102 @@
+import asyncio
+from dataclasses import dataclass
+from loguru import logger
+from . import EmbeddingProvider
+from .batching import BatchingEmbeddingProvider
+from .nomic_embed import NomicEmbeddingProvider
+
+
+@dataclass
+class _RegistryEntry:
+    key: tuple
+    provider: EmbeddingProvider
+    ready: asyncio.Future
+    refcount: int = 0
+
+
+class EmbeddingModelRegistry:
+    """进程内共享的嵌入模型注册表。
+
+    相同配置的模型在整个进程中只加载一次，由所有 ATRIMemoryStarter 和 VecDB 共享。
+    通过引用计数管理生命周期，最后一个使用者释放后才会关闭模型。
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[tuple, _RegistryEntry] = {}
+
+    async def acquire(
+        self,
+        model: str = "nomic-embed-text-v1.5",
+        dimensionality: int = 768,
+        executor: str = "thread",
+        timeout: float = 30.0,
+    ) -> EmbeddingProvider:
+        """获取一个共享的、已经完成预热的嵌入提供商
+
+        Args:
+            model (str): 模型名称
+            dimensionality (int): 输出维度
+            executor (str): 推理的执行方式
+            timeout (float): 单次调用的超时时间(秒)
+        Returns:
+            EmbeddingProvider: 带有微批处理层的嵌入提供商
+        """
+        # 超时时间保存在提供商中，不同的超时时间不能共享同一个提供商
+        key = (model, dimensionality, executor, timeout)
+        entry = self._entries.get(key)
+        if entry is None:
+            provider = BatchingEmbeddingProvider(
+                NomicEmbeddingProvider(
+                    model=model,
+                    dimensionality=dimensionality,
+                    executor=executor,
+                    timeout=timeout,
+                )
+            )
+            entry = _RegistryEntry(
+                key=key,
+                provider=provider,
+                ready=asyncio.get_running_loop().create_future(),
+            )
+            self._entries[key] = entry
+            asyncio.get_running_loop().create_task(self._warmup(entry))
+        entry.refcount += 1
+        try:
+            # 并发初始化的实例等待同一次预热
+            await asyncio.shield(entry.ready)
+        except BaseException:
+            await self.release(entry.provider)
+            raise
+        return entry.provider
+
+    async def release(self, provider: EmbeddingProvider):
+        """释放对嵌入提供商的引用，引用计数归零时关闭模型"""
+        for key, entry in list(self._entries.items()):
+            if entry.provider is not provider:
+                continue
+            entry.refcount -= 1
+            if entry.refcount <= 0:
+                del self._entries[key]
+                await provider.close()
+                logger.info(f"Embedding model {key} released.")
+            return
+
+    async def _warmup(self, entry: _RegistryEntry):
+        try:
+            await entry.provider.warmup()
+        except Exception as e:
+            logger.error(f"Embedding model {entry.key} warmup failed: {e}")
+            # 条目移除后 release 找不到该提供商，需要在这里关闭已经创建的执行器
+            self._entries.pop(entry.key, None)
+            try:
+                await entry.provider.close()
+            except Exception as close_error:
+                logger.error(f"Embedding model {entry.key} close failed: {close_error}")
+            entry.ready.set_exception(e)
+            return
+        logger.info(f"Embedding model {entry.key} loaded.")
+        entry.ready.set_result(None)
+
+
+model_registry = EmbeddingModelRegistry()
+"""进程级的全局模型注册表"""
@@ -1,11 +1,12 @@
 import os
 import logging
 from .provider.llm.openai_source import ProviderOpenAI
-from .provider.embedding.nomic_embed import NomicEmbeddingProvider
+from .provider.embedding.cache import CachedEmbeddingProvider
+from .provider.embedding.registry import model_registry
 from .storage.vec_db import VecDB
 from .storage.documents.document_storage import DocumentStorage
 from .storage.embedding.embedding_storage import EmbeddingStorage
-from .storage.graph.kuzu_impl import KuzuGraphStore
+from .storage.graph.kuzu_async import AsyncKuzuGraphStore
 from .pipeline.graph_mem import GraphMemory
 from .pipeline.summarize import Summarize
 
@@ -15,9 +16,37 @@ from loguru import logger
 
 
 class ATRIMemoryStarter:
-    def __init__(self, data_dir_path: str, llm_provider: ProviderOpenAI):
+    def __init__(
+        self,
+        data_dir_path: str,
+        llm_provider: ProviderOpenAI,
+        embedding_executor: str = "thread",
+        embedding_timeout: float = 30.0,
+        embedding_cache_path: str = None,
+        embedding_dim: int = 768,
+        mmap_index: bool = False,
+    ):
+        """
+        Args:
+            data_dir_path (str): 数据目录
+            llm_provider (ProviderOpenAI): LLM 提供商
+            embedding_executor (str): 嵌入推理的执行方式，可选 inline / thread / process
+            embedding_timeout (float): 单次嵌入调用的超时时间(秒)
+            embedding_cache_path (str): 嵌入缓存的 SQLite 路径，默认位于数据目录下。多个实例可以共享同一个缓存文件
+            embedding_dim (int): 嵌入维度，可选 768 / 512 / 256 / 128 / 64。修改后需要使用 core.util.migrate_index 迁移已有索引
+            mmap_index (bool): 以只读内存映射方式加载向量索引，新写入在检查点时合并。
+                faiss 只映射 IVF 索引的倒排表，flat / HNSW 索引开启后每次检查点都要重新读写整个索引文件，仅建议 IVF 索引开启
+        """
         self.data_dir_path = data_dir_path
         self.llm_provider = llm_provider
+        self.embedding_executor = embedding_executor
+        self.embedding_timeout = embedding_timeout
+        self.embedding_model_name = "nomic-embed-text-v1.5"
+        self.embedding_dim = embedding_dim
+        self.mmap_index = mmap_index
+        self.embedding_cache_path = embedding_cache_path or os.path.join(
+            self.data_dir_path, "embedding_cache.db"
+        )
 
         if not os.path.exists(self.data_dir_path):
             os.makedirs(self.data_dir_path)
@@ -36,23 +65,40 @@ class ATRIMemoryStarter:
 
         self.mem_graph_path = os.path.join(self.data_dir_path, "mem_graph")
 
-        self.embedding_model = NomicEmbeddingProvider()
+        # 进程内共享同一个已预热的模型，模型加载只发生在启动阶段
+        self.shared_embedding_model = await model_registry.acquire(
+            model=self.embedding_model_name,
+            dimensionality=self.embedding_dim,
+            executor=self.embedding_executor,
+            timeout=self.embedding_timeout,
+        )
+        # 缓存命中的文本不再推理；未命中的单条请求由共享模型的微批处理层合并后推理
+        self.embedding_model = CachedEmbeddingProvider(
+            self.shared_embedding_model,
+            # 不同维度的向量不能互相复用
+            model=f"{self.embedding_model_name}@{self.embedding_dim}",
+            db_path=self.embedding_cache_path,
+        )
+        await self.embedding_model.initialize()
         self.vec_dim = await self.embedding_model.get_dim()
 
         # FACT VEC DB
         self.fact_docs_store = DocumentStorage(self.fact_db_path)
-        self.fact_vec_store = EmbeddingStorage(self.vec_dim, self.embedding_db_path)
+        self.fact_vec_store = EmbeddingStorage(
+            self.vec_dim, self.embedding_db_path, mmap=self.mmap_index
+        )
         await self.fact_docs_store.initialize()
         self.fact_vec_db = VecDB(
             document_storage=self.fact_docs_store,
             embedding_storage=self.fact_vec_store,
             embedding_provider=self.embedding_model,
         )
+        await self.fact_vec_db.initialize()
 
         # SUMMARY VEC DB
         self.summary_docs_store = DocumentStorage(self.summary_db_path)
         self.summary_vec_store = EmbeddingStorage(
-            self.vec_dim, self.summary_embedding_db_path
+            self.vec_dim, self.summary_embedding_db_path, mmap=self.mmap_index
         )
         await self.summary_docs_store.initialize()
         self.summary_vec_db = VecDB(
@@ -60,9 +106,10 @@ class ATRIMemoryStarter:
             embedding_storage=self.summary_vec_store,
             embedding_provider=self.embedding_model,
         )
+        await self.summary_vec_db.initialize()
 
-        # graph store
-        self.kuzu_graph_store = KuzuGraphStore(
+        # graph store, 图查询在独立的线程池中执行，不阻塞事件循环
+        self.kuzu_graph_store = AsyncKuzuGraphStore(
             db_path=self.mem_graph_path,
         )
 
@@ -78,3 +125,11 @@ class ATRIMemoryStarter:
             logger=logger
         )
         logger.info("Graph memory initialized successfully.")
+
+    async def close(self):
+        """关闭存储并释放嵌入模型占用的资源"""
+        await self.fact_vec_db.close()
+        await self.summary_vec_db.close()
+        await self.kuzu_graph_store.close()
+        await self.embedding_model.close()
+        await model_registry.release(self.shared_embedding_model)
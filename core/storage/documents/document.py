@@ -0,0 +1,69 @@
+import json
+import sqlite3
+
+DOCUMENT_COLUMNS = "id, doc_id, text, metadata, created_at, updated_at"
+"""构造 Document 时查询的列，顺序与 Document 的构造参数一致"""
+_FIELDS = ("id", "doc_id", "text", "metadata", "created_at", "updated_at")
+
+
+class Document:
+    """documents 表中的一行。metadata 在第一次访问时才解析，并且只解析一次"""
+
+    __slots__ = (
+        "id",
+        "doc_id",
+        "text",
+        "metadata_json",
+        "created_at",
+        "updated_at",
+        "_metadata",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        doc_id: str,
+        text: str,
+        metadata_json: str | None,
+        created_at: str | None = None,
+        updated_at: str | None = None,
+    ):
+        self.id = id
+        self.doc_id = doc_id
+        self.text = text
+        self.metadata_json = metadata_json
+        """数据库中原始的 metadata JSON"""
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self._metadata = None
+
+    @property
+    def metadata(self) -> dict:
+        if self._metadata is None:
+            self._metadata = json.loads(self.metadata_json) if self.metadata_json else {}
+        return self._metadata
+
+    # 兼容以 dict 方式访问文档的调用方，其中 metadata 为解析后的 dict
+    def __getitem__(self, key: str):
+        if key not in _FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self) -> str:
+        return f"Document(id={self.id}, doc_id={self.doc_id!r}, text={self.text!r})"
+
+
+def document_row_factory(cursor: sqlite3.Cursor, row: tuple) -> Document:
+    """以 DOCUMENT_COLUMNS 查询时使用的行工厂，在数据库线程中直接构造 Document"""
+    return Document(*row)
+
+
+def scored_document_row_factory(cursor: sqlite3.Cursor, row: tuple) -> tuple:
+    """以 DOCUMENT_COLUMNS 加一个分数列查询时使用的行工厂"""
+    return Document(*row[:-1]), row[-1]
@@ -1,12 +1,62 @@
 import aiosqlite
+import asyncio
 import os
+import pathlib
+from contextlib import asynccontextmanager
 from loguru import logger
+from .document import (
+    DOCUMENT_COLUMNS,
+    Document,
+    document_row_factory,
+    scored_document_row_factory,
+)
+from .filter_planner import INDEXABLE_KEY, FilterPlanner, column_name
+
+SCHEMA_VERSION = 1
+"""数据库结构版本，记录在 PRAGMA user_version 中"""
 
 
 class DocumentStorage:
-    def __init__(self, db_path: str):
+    def __init__(
+        self,
+        db_path: str,
+        read_pool_size: int = 4,
+        mmap_size: int = 256 * 1024 * 1024,
+        cache_size_kb: int = 16 * 1024,
+        busy_timeout_ms: int = 5000,
+        filter_index_threshold: int = 100,
+        explain_queries: bool = False,
+        fts_tokenizer: str = "trigram",
+    ):
+        """
+        Args:
+            db_path (str): 数据库路径
+            read_pool_size (int): 只读连接的数量。写入只使用 self.connection，查询使用只读连接，
+                WAL 模式下查询不会被写入和提交阻塞
+            mmap_size (int): 每个连接内存映射数据库文件的最大字节数
+            cache_size_kb (int): 每个连接的页缓存大小(KiB)
+            busy_timeout_ms (int): 等待数据库锁的最长时间(毫秒)
+            filter_index_threshold (int): 一个 metadata 键被用作过滤条件多少次后，在线为其添加生成列和索引。为 0 时不自动添加
+            explain_queries (bool): 在 debug 日志中输出 get_documents 的 EXPLAIN QUERY PLAN
+            fts_tokenizer (str): 全文索引的 FTS5 分词器，例如 trigram、unicode61。
+                trigram 按字符切分，适用于没有空格的中文和日文，但无法匹配少于 3 个字符的词。修改后启动时重建全文索引
+        """
         self.db_path = db_path
+        self.read_pool_size = read_pool_size
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self.busy_timeout_ms = busy_timeout_ms
+        self.filter_planner = FilterPlanner(filter_index_threshold)
+        self.explain_queries = explain_queries
+        self.fts_tokenizer = fts_tokenizer
         self.connection = None
+        """唯一的写连接"""
+        self._readers: list[aiosqlite.Connection] = []
+        self._reader_pool: asyncio.Queue | None = None
+        # 多条语句组成的写入需要独占写连接，避免被其他协程的提交拆开
+        self._write_lock = asyncio.Lock()
+        self._tasks: set[asyncio.Task] = set()
+        """后台为热点过滤键建立索引的任务"""
         self.sqlite_init_path = os.path.join(
             os.path.dirname(__file__), "sqlite_init.sql"
         )
@@ -19,15 +69,151 @@ class DocumentStorage:
                 with open(self.sqlite_init_path, "r", encoding="utf-8") as f:
                     sql_script = f.read()
                 await cursor.executescript(sql_script)
+                await cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
             await self.connection.commit()
         else:
             await self.connect()
+            await self.migrate()
+        self.filter_planner.load_columns(await self._generated_columns())
+        await self._ensure_fts()
+        await self._open_readers()
+
+    async def migrate(self):
+        """将旧版本的数据库升级到当前结构"""
+        async with self.connection.execute("PRAGMA user_version") as cursor:
+            version = (await cursor.fetchone())[0]
+        if version < 1:
+            await self._create_doc_id_index()
+        if version < SCHEMA_VERSION:
+            await self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            await self.connection.commit()
+            logger.info(f"Migrated {self.db_path} from schema {version} to {SCHEMA_VERSION}")
+
+    async def _ensure_fts(self):
+        """创建由触发器与 documents 保持同步的 FTS5 全文索引。分词器与配置不一致时重建"""
+        tokenize = "tokenize='{}'".format(self.fts_tokenizer.replace("'", "''"))
+        async with self.connection.execute(
+            "SELECT sql FROM sqlite_master WHERE name = 'documents_fts'"
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row and tokenize in row[0]:
+            return
+        async with self._write_lock:
+            await self.connection.executescript(
+                f"""
+                DROP TABLE IF EXISTS documents_fts;
+                CREATE VIRTUAL TABLE documents_fts USING fts5(
+                    text, content='documents', content_rowid='id', {tokenize}
+                );
+                CREATE TRIGGER IF NOT EXISTS documents_fts_ai AFTER INSERT ON documents BEGIN
+                    INSERT INTO documents_fts(rowid, text) VALUES (new.id, new.text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS documents_fts_ad AFTER DELETE ON documents BEGIN
+                    INSERT INTO documents_fts(documents_fts, rowid, text)
+                    VALUES ('delete', old.id, old.text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS documents_fts_au AFTER UPDATE OF text ON documents BEGIN
+                    INSERT INTO documents_fts(documents_fts, rowid, text)
+                    VALUES ('delete', old.id, old.text);
+                    INSERT INTO documents_fts(rowid, text) VALUES (new.id, new.text);
+                END;
+                INSERT INTO documents_fts(documents_fts) VALUES ('rebuild');
+                """
+            )
+            await self.connection.commit()
+        logger.info(f"Built full-text index of {self.db_path} with {tokenize}")
+
+    async def _generated_columns(self) -> set[str]:
+        async with self.connection.execute("PRAGMA table_xinfo(documents)") as cursor:
+            # hidden 为 2 或 3 的是生成列
+            return {row[1] for row in await cursor.fetchall() if row[6] in (2, 3)}
+
+    async def create_filter_columns(self, keys: list[str]):
+        """为 metadata 键添加生成列和索引，之后以这些键过滤时直接使用索引
+
+        SQLite 不能为非空表添加 STORED 生成列，这里添加的是 VIRTUAL 列，值保存在索引中。
+
+        Args:
+            keys (list[str]): metadata 键
+        Raises:
+            ValueError: 如果键不是合法的标识符
+        """
+        for key in keys:
+            if not INDEXABLE_KEY.match(key):
+                raise ValueError(f"metadata 键 {key!r} 不是合法的标识符，无法建立索引")
+        async with self._write_lock:
+            existing = await self._generated_columns()
+            for key in keys:
+                column = column_name(key)
+                if column not in existing:
+                    await self.connection.execute(
+                        f'ALTER TABLE documents ADD COLUMN "{column}" '
+                        f"GENERATED ALWAYS AS (json_extract(metadata, '$.{key}')) VIRTUAL"
+                    )
+                await self.connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS "idx_documents_{column}" '
+                    f'ON documents("{column}")'
+                )
+                await self.connection.commit()
+                self.filter_planner.mark_indexed(key)
+                logger.info(f"Indexed metadata key {key} of {self.db_path} as column {column}")
+
+    async def _create_doc_id_index(self):
+        """为 doc_id 建立唯一索引。已有重复的 doc_id 时退化为普通索引"""
+        async with self.connection.execute(
+            "SELECT doc_id FROM documents GROUP BY doc_id HAVING COUNT(*) > 1 LIMIT 1"
+        ) as cursor:
+            duplicate = await cursor.fetchone()
+        if duplicate:
+            logger.warning(
+                f"{self.db_path} 中存在重复的 doc_id (例如 {duplicate[0]})，doc_id 索引将不是唯一索引"
+            )
+            await self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_documents_doc_id ON documents(doc_id)"
+            )
+        else:
+            await self.connection.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_documents_doc_id ON documents(doc_id)"
+            )
 
     async def connect(self):
         """Connect to the SQLite database."""
         self.connection = await aiosqlite.connect(self.db_path)
+        # WAL 模式下读写互不阻塞；NORMAL 在 WAL 模式下只在检查点时 fsync，掉电最多丢失最近的提交
+        await self.connection.execute("PRAGMA journal_mode=WAL")
+        await self.connection.execute("PRAGMA synchronous=NORMAL")
+        await self._apply_connection_pragmas(self.connection)
 
-    async def get_documents(self, metadata_filters: dict, ids: list = None):
+    async def _apply_connection_pragmas(self, connection: aiosqlite.Connection):
+        await connection.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        await connection.execute(f"PRAGMA mmap_size={self.mmap_size}")
+        await connection.execute(f"PRAGMA cache_size=-{self.cache_size_kb}")
+
+    async def _open_readers(self):
+        """打开只读连接池。只读连接在结构初始化之后打开，避免看到旧的结构"""
+        uri = pathlib.Path(os.path.abspath(self.db_path)).as_uri() + "?mode=ro"
+        self._reader_pool = asyncio.Queue()
+        for _ in range(self.read_pool_size):
+            reader = await aiosqlite.connect(uri, uri=True)
+            await self._apply_connection_pragmas(reader)
+            self._readers.append(reader)
+            self._reader_pool.put_nowait(reader)
+
+    @asynccontextmanager
+    async def _read_connection(self):
+        """从连接池中借用一个只读连接，没有连接池时使用写连接"""
+        if not self._readers:
+            yield self.connection
+            return
+        reader = await self._reader_pool.get()
+        try:
+            yield reader
+        finally:
+            self._reader_pool.put_nowait(reader)
+
+    async def get_documents(
+        self, metadata_filters: dict, ids: list = None
+    ) -> list[Document]:
         """Retrieve documents by metadata filters and ids.
 
         Args:
@@ -36,43 +222,178 @@ class DocumentStorage:
         Returns:
             list: The list of document IDs(primary key, not doc_id) that match the filters.
         """
-        # metadata filter -> SQL WHERE clause
-        where_clauses = []
-        values = []
-        for key, val in metadata_filters.items():
-            where_clauses.append(f"json_extract(metadata, '$.{key}') = ?")
-            values.append(val)
+        where_clauses, values = await self._filter_clauses(metadata_filters)
         if ids is not None and len(ids) > 0:
             ids = [str(i) for i in ids if i != -1]
             where_clauses.append("id IN ({})".format(",".join("?" * len(ids))))
             values.extend(ids)
         where_sql = " AND ".join(where_clauses) or "1=1"
 
-        result = []
-        async with self.connection.cursor() as cursor:
-            sql = "SELECT * FROM documents WHERE " + where_sql
+        async with (
+            self._read_connection() as connection,
+            connection.cursor() as cursor,
+        ):
+            sql = f"SELECT {DOCUMENT_COLUMNS} FROM documents WHERE " + where_sql
             logger.debug(f"DocDB Query SQL -> {sql} (values: {values})")
+            if self.explain_queries:
+                await cursor.execute("EXPLAIN QUERY PLAN " + sql, values)
+                plan = [row[3] for row in await cursor.fetchall()]
+                logger.debug(f"DocDB Query Plan -> {plan}")
+            cursor.row_factory = document_row_factory
             await cursor.execute(sql, values)
-            for row in await cursor.fetchall():
-                result.append(await self.tuple_to_dict(row))
-        return result
+            return await cursor.fetchall()
+
+    async def search_fts(
+        self, query: str, k: int, metadata_filters: dict = None
+    ) -> list[tuple[Document, float]]:
+        """Full-text search over document texts, ranked by BM25.
+
+        Args:
+            query (str): The query. Whitespace separated terms are matched as phrases and OR-ed.
+            k (int): The maximum number of documents to return.
+            metadata_filters (dict): The metadata filters to apply.
+
+        Returns:
+            list: (document, bm25 score) tuples. A lower score is a better match.
+        """
+        match = self._fts_query(query)
+        if not match:
+            return []
+        where_clauses, values = await self._filter_clauses(metadata_filters or {})
+        prefixed_columns = ", ".join(
+            f"documents.{column}" for column in DOCUMENT_COLUMNS.split(", ")
+        )
+        sql = (
+            f"SELECT {prefixed_columns}, bm25(documents_fts) AS score FROM documents_fts "
+            "JOIN documents ON documents.id = documents_fts.rowid "
+            "WHERE documents_fts MATCH ?"
+            + "".join(f" AND {clause}" for clause in where_clauses)
+            + " ORDER BY score LIMIT ?"
+        )
+        async with (
+            self._read_connection() as connection,
+            connection.cursor() as cursor,
+        ):
+            cursor.row_factory = scored_document_row_factory
+            await cursor.execute(sql, [match, *values, k])
+            return await cursor.fetchall()
+
+    def _fts_query(self, query: str) -> str:
+        """将查询转换为 FTS5 表达式，每个词作为短语匹配，避免用户输入被解析为 FTS5 语法"""
+        terms = query.split()
+        if self.fts_tokenizer.split()[0] == "trigram":
+            # trigram 分词器无法匹配少于 3 个字符的短语
+            terms = [term for term in terms if len(term) >= 3]
+        return " OR ".join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+    async def _filter_clauses(self, metadata_filters: dict) -> tuple[list[str], list]:
+        """metadata filter -> SQL WHERE clause，同时记录过滤键的使用情况
+
+        热点键在后台建立索引，建好之前仍使用 json_extract 过滤，查询不等待全表扫描的建索引过程。
+        """
+        for key in self.filter_planner.record(metadata_filters):
+            task = asyncio.get_running_loop().create_task(self._index_filter_key(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        where_clauses = []
+        values = []
+        for key, val in metadata_filters.items():
+            where_clauses.append(self.filter_planner.where_clause(key))
+            values.append(val)
+        return where_clauses, values
+
+    async def _index_filter_key(self, key: str):
+        try:
+            await self.create_filter_columns([key])
+        except Exception as e:
+            self.filter_planner.mark_failed(key)
+            logger.error(f"Failed to index metadata key {key}: {e}")
 
-    async def get_document_by_doc_id(self, doc_id: str):
+    async def get_document_by_doc_id(self, doc_id: str) -> Document | None:
         """Retrieve a document by its doc_id.
 
         Args:
             doc_id (str): The doc_id of the document to retrieve.
 
         Returns:
-            dict: The document data.
+            Document: The document, or None if it does not exist.
         """
-        async with self.connection.cursor() as cursor:
-            await cursor.execute("SELECT * FROM documents WHERE doc_id = ?", (doc_id,))
-            row = await cursor.fetchone()
-            if row:
-                return await self.tuple_to_dict(row)
-            else:
-                return None
+        async with (
+            self._read_connection() as connection,
+            connection.cursor() as cursor,
+        ):
+            cursor.row_factory = document_row_factory
+            await cursor.execute(
+                f"SELECT {DOCUMENT_COLUMNS} FROM documents WHERE doc_id = ?", (doc_id,)
+            )
+            return await cursor.fetchone()
+
+    async def get_documents_by_doc_ids(
+        self, doc_ids: list[str]
+    ) -> dict[str, Document]:
+        """Retrieve documents by their doc_ids in batches.
+
+        Args:
+            doc_ids (list[str]): The doc_ids of the documents to retrieve.
+
+        Returns:
+            dict: doc_id -> document. Missing doc_ids are omitted.
+        """
+        result = {}
+        doc_ids = list(dict.fromkeys(doc_ids))
+        # 不超过 SQLite 的参数数量上限
+        for start in range(0, len(doc_ids), 500):
+            chunk = doc_ids[start : start + 500]
+            async with (
+                self._read_connection() as connection,
+                connection.cursor() as cursor,
+            ):
+                cursor.row_factory = document_row_factory
+                await cursor.execute(
+                    "SELECT {} FROM documents WHERE doc_id IN ({})".format(
+                        DOCUMENT_COLUMNS, ",".join("?" * len(chunk))
+                    ),
+                    chunk,
+                )
+                for doc in await cursor.fetchall():
+                    result[doc.doc_id] = doc
+        return result
+
+    async def insert_documents(
+        self, doc_ids: list[str], texts: list[str], metadatas: list[str]
+    ) -> dict[str, int]:
+        """Insert documents in a single transaction.
+
+        Args:
+            doc_ids (list[str]): The doc_ids of the documents.
+            texts (list[str]): The texts of the documents.
+            metadatas (list[str]): The JSON encoded metadata of the documents.
+
+        Returns:
+            dict: doc_id -> id(primary key).
+        """
+        result = {}
+        rows = list(zip(doc_ids, texts, metadatas))
+        async with self._write_lock:
+            try:
+                # 第一条 INSERT 隐式开启事务，全部写入后只提交一次
+                for start in range(0, len(rows), 300):
+                    chunk = rows[start : start + 300]
+                    sql = (
+                        "INSERT INTO documents (doc_id, text, metadata) VALUES "
+                        + ",".join(["(?, ?, ?)"] * len(chunk))
+                        + " RETURNING id, doc_id"
+                    )
+                    async with self.connection.execute(
+                        sql, [value for row in chunk for value in row]
+                    ) as cursor:
+                        for id, doc_id in await cursor.fetchall():
+                            result[doc_id] = id
+                await self.connection.commit()
+            except Exception:
+                await self.connection.rollback()
+                raise
+        return result
 
     async def update_document_by_doc_id(self, doc_id: str, new_text: str):
         """Retrieve a document by its doc_id.
@@ -81,44 +402,70 @@ class DocumentStorage:
             doc_id (str): The doc_id.
             new_text (str): The new text to update the document with.
         """
-        async with self.connection.cursor() as cursor:
+        # 与 insert_documents 共用写连接，持锁避免提交到其他写入尚未完成的事务
+        async with self._write_lock, self.connection.cursor() as cursor:
             await cursor.execute(
                 "UPDATE documents SET text = ? WHERE doc_id = ?", (new_text, doc_id)
             )
             await self.connection.commit()
             logger.debug(f"Updated document with doc_id {doc_id}.")
 
-    async def get_user_ids(self) -> list[str]:
-        """Retrieve all user IDs from the documents table.
+    async def delete_documents_by_doc_id(self, doc_id: str) -> list[int]:
+        """Delete the documents with the given doc_id.
+
+        Args:
+            doc_id (str): The doc_id.
 
         Returns:
-            list: A list of user IDs.
+            list[int]: The ids(primary key) of the deleted documents.
         """
-        async with self.connection.cursor() as cursor:
-            await cursor.execute("SELECT DISTINCT user_id FROM documents")
-            rows = await cursor.fetchall()
-            return [row[0] for row in rows]
+        async with self._write_lock:
+            async with self.connection.execute(
+                "DELETE FROM documents WHERE doc_id = ? RETURNING id", (doc_id,)
+            ) as cursor:
+                ids = [row[0] for row in await cursor.fetchall()]
+            await self.connection.commit()
+        return ids
 
-    async def tuple_to_dict(self, row):
-        """Convert a tuple to a dictionary.
+    async def get_metadata_values(self, keys: list[str]) -> list[tuple]:
+        """Retrieve the given metadata values of every document.
 
         Args:
-            row (tuple): The row to convert.
+            keys (list[str]): The metadata keys.
 
         Returns:
-            dict: The converted dictionary.
+            list: A list of (id, value_1, value_2, ...) tuples.
         """
-        return {
-            "id": row[0],
-            "doc_id": row[1],
-            "text": row[2],
-            "metadata": row[3],
-            "created_at": row[4],
-            "updated_at": row[5],
-        }
+        columns = ", ".join(f"json_extract(metadata, '$.{key}')" for key in keys)
+        async with (
+            self._read_connection() as connection,
+            connection.cursor() as cursor,
+        ):
+            await cursor.execute(f"SELECT id, {columns} FROM documents")
+            return await cursor.fetchall()
+
+    async def get_user_ids(self) -> list[str]:
+        """Retrieve all user IDs from the documents table.
+
+        Returns:
+            list: A list of user IDs.
+        """
+        async with (
+            self._read_connection() as connection,
+            connection.cursor() as cursor,
+        ):
+            await cursor.execute("SELECT DISTINCT user_id FROM documents")
+            rows = await cursor.fetchall()
+            return [row[0] for row in rows]
 
     async def close(self):
         """Close the connection to the SQLite database."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        for reader in self._readers:
+            await reader.close()
+        self._readers = []
+        self._reader_pool = None
         if self.connection:
             await self.connection.close()
             self.connection = None
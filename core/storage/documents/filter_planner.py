@@ -0,0 +1,78 @@
+import re
+from collections import Counter
+
+INDEXABLE_KEY = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+"""只有合法标识符的 metadata 键才会生成列，避免拼接进 DDL 时产生注入"""
+
+LEGACY_COLUMNS = ("user_id", "group_id")
+"""sqlite_init.sql 中与 metadata 键同名的生成列"""
+
+
+def column_name(key: str) -> str:
+    """metadata 键对应的生成列名"""
+    return key if key in LEGACY_COLUMNS else f"meta_{key}"
+
+
+class FilterPlanner:
+    """记录 metadata 过滤键的使用次数，并把过滤条件改写到已建立索引的生成列上。
+
+    使用次数达到阈值的键会被报告为热点键，由 DocumentStorage 为其添加生成列和索引。
+    """
+
+    def __init__(self, threshold: int = 100) -> None:
+        """
+        Args:
+            threshold (int): 一个键被查询多少次后为其建立索引。为 0 时不自动建立
+        """
+        self.threshold = threshold
+        self.usage: Counter[str] = Counter()
+        self.columns: dict[str, str] = {}
+        """metadata 键 -> 已建立索引的生成列"""
+        self._pending: set[str] = set()
+
+    def load_columns(self, generated_columns: set[str]):
+        """根据数据库中已有的生成列恢复键到列的映射
+
+        Args:
+            generated_columns (set[str]): documents 表中全部生成列的列名
+        """
+        self.columns = {}
+        for column in generated_columns:
+            if column in LEGACY_COLUMNS:
+                self.columns[column] = column
+            elif column.startswith("meta_"):
+                self.columns[column[len("meta_") :]] = column
+
+    def record(self, keys) -> list[str]:
+        """记录一次查询用到的过滤键
+
+        Returns:
+            list[str]: 本次刚达到阈值、需要建立索引的键
+        """
+        hot = []
+        for key in keys:
+            self.usage[key] += 1
+            if (
+                self.threshold
+                and self.usage[key] >= self.threshold
+                and key not in self.columns
+                and key not in self._pending
+                and INDEXABLE_KEY.match(key)
+            ):
+                self._pending.add(key)
+                hot.append(key)
+        return hot
+
+    def mark_indexed(self, key: str):
+        self._pending.discard(key)
+        self.columns[key] = column_name(key)
+
+    def mark_failed(self, key: str):
+        self._pending.discard(key)
+
+    def where_clause(self, key: str) -> str:
+        """单个过滤键的 WHERE 条件，已建立索引的键使用生成列"""
+        column = self.columns.get(key)
+        if column:
+            return f'"{column}" = ?'
+        return f"json_extract(metadata, '$.{key}') = ?"
@@ -14,4 +14,5 @@ ALTER TABLE documents
 ADD COLUMN user_id TEXT GENERATED ALWAYS AS (json_extract(metadata, '$.user_id')) STORED;
 
 CREATE INDEX idx_documents_user_id ON documents(user_id);
-CREATE INDEX idx_documents_group_id ON documents(group_id);
\ No newline at end of file
+CREATE INDEX idx_documents_group_id ON documents(group_id);
+CREATE UNIQUE INDEX idx_documents_doc_id ON documents(doc_id);
@@ -1,19 +1,145 @@
+import asyncio
 import faiss
 import os
+import json
+import struct
+import zlib
 import numpy as np
+from dataclasses import dataclass
+from loguru import logger
+from .index_factory import (
+    MMAP_IO_FLAGS,
+    TRAINED_INDEX_TYPES,
+    apply_search_params,
+    build_index,
+    detect_index_type,
+    search_parameters,
+    to_id_map2,
+    upgrade_id_map_file,
+)
+from ...provider.embedding.matryoshka import check_matryoshka_dim, truncate_embeddings
+
+WAL_OP_INSERT = 1
+WAL_OP_DELETE = 2
+_WAL_HEADER = struct.Struct("<BqII")
+"""op, id, 向量维度(删除记录为 0), payload 的 crc32"""
+
+
+@dataclass
+class CompactionStats:
+    removed_vectors: int
+    """从索引中物理移除的向量数量"""
+    bytes_before: int
+    """压缩前的索引文件大小"""
+    bytes_after: int
+    """压缩后的索引文件大小"""
+
+    @property
+    def reclaimed_bytes(self) -> int:
+        return self.bytes_before - self.bytes_after
 
 
 class EmbeddingStorage:
-    def __init__(self, dimention: int, path: str = None):
+    def __init__(
+        self,
+        dimention: int,
+        path: str = None,
+        checkpoint_interval: float = 5.0,
+        checkpoint_threshold: int = 1000,
+        fsync: bool = False,
+        index_type: str = "flat",
+        promote_to: str | None = "hnsw",
+        promote_threshold: int = 100000,
+        nprobe: int = 16,
+        ef_search: int = 64,
+        exact_search_threshold: int = 20000,
+        compaction_ratio: float = 0.2,
+        mmap: bool = False,
+    ):
+        """
+        Args:
+            dimention (int): 向量维度
+            path (str): 索引路径
+            checkpoint_interval (float): 最后一次写入后多少秒将预写日志合并进索引文件
+            checkpoint_threshold (int): 预写日志累计多少条记录后立即合并
+            fsync (bool): 每次写入预写日志后是否 fsync
+            index_type (str): 新建索引的类型，可选 flat / hnsw / ivf_flat / ivf_pq。
+                IVF 类索引需要训练数据，会先以 flat 索引开始，向量数达到 promote_threshold 后再升级
+            promote_to (str | None): flat 索引增长到 promote_threshold 后在后台升级到的类型，为 None 时不升级
+            promote_threshold (int): 触发升级的向量数量
+            nprobe (int): IVF 查询时访问的聚类数
+            ef_search (int): HNSW 查询时的搜索宽度
+            exact_search_threshold (int): 带 ID 过滤的查询中，候选 ID 不超过该数量时直接精确计算距离
+            compaction_ratio (float): 已删除向量占比超过该值时在后台重建索引
+            mmap (bool): 以只读内存映射方式加载索引文件，启动时不读取整个索引。
+                映射的索引不可写，新写入进入内存中的增量索引，检查点时合并进索引文件后重新映射
+        """
         self.dimention = dimention
         self.path = path
+        self.meta_path = f"{path}.meta.json" if path else None
+        self.wal_path = f"{path}.wal" if path else None
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_threshold = checkpoint_threshold
+        self.fsync = fsync
+        if index_type in TRAINED_INDEX_TYPES:
+            promote_to = index_type
+        self.promote_to = promote_to
+        self.promote_threshold = promote_threshold
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.exact_search_threshold = exact_search_threshold
+        self.compaction_ratio = compaction_ratio
+        self.mmap = mmap
         self.index = None
+        # 映射模式下的增量索引，为 None 时 self.index 可直接写入
+        self._delta = None
+        self._delta_ids: set[int] = set()
+        # self.index 每次被写入或替换时递增，用于判断能否将刚写入的索引文件重新映射
+        self._index_version = 0
         if path and os.path.exists(path):
-            self.index = faiss.read_index(path)
+            if mmap:
+                upgrade_id_map_file(path)
+                self.index = faiss.read_index(path, MMAP_IO_FLAGS)
+                self._delta = build_index("flat", dimention)
+            else:
+                self.index = to_id_map2(faiss.read_index(path))
+            if self.index.d != dimention:
+                raise ValueError(
+                    f"索引 {path} 的维度为 {self.index.d}, 与配置的维度 {dimention} 不一致。"
+                    f"降维请先使用 `python -m core.util.migrate_index {path} --dim {dimention}` 迁移索引"
+                )
         else:
-            base_index = faiss.IndexFlatL2(dimention)
-            self.index = faiss.IndexIDMap(base_index)
-        self.storage = {}
+            self.index = build_index(
+                "hnsw" if index_type == "hnsw" else "flat", dimention
+            )
+        self.index_type = detect_index_type(self.index)
+        apply_search_params(self.index, self.nprobe, self.ef_search)
+        self._ids = set(faiss.vector_to_array(self.index.id_map).tolist())
+        # 已删除但仍在索引中的向量，查询时排除，压缩时物理移除
+        self._tombstones: set[int] = set()
+        meta = self._load_meta()
+        if meta:
+            self._tombstones = set(meta.get("tombstones", [])) & self._ids
+            self._ids -= self._tombstones
+        self.last_compaction: CompactionStats | None = None
+
+        self._wal = None
+        self._wal_records = 0
+        self._checkpoint_lock = asyncio.Lock()
+        self._checkpoint_timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self._rebuild_task: asyncio.Task | None = None
+        self._rebuild_inserts: list[tuple[int, np.ndarray]] | None = None
+        if path:
+            # 重放上一次检查点之后的写入
+            for wal_path in (self.wal_path + ".old", self.wal_path):
+                self._wal_records += self._replay_wal(wal_path)
+            self._wal = open(self.wal_path, "ab")
+
+    @property
+    def ntotal(self) -> int:
+        """未删除的向量数量"""
+        return len(self._ids)
 
     async def insert(self, vector: np.ndarray, id: int):
         """插入向量
@@ -28,27 +154,541 @@ class EmbeddingStorage:
             raise ValueError(
                 f"向量维度不匹配, 期望: {self.dimention}, 实际: {vector.shape[0]}"
             )
-        self.index.add_with_ids(vector.reshape(1, -1), np.array([id]))
-        self.storage[id] = vector
-        await self.save_index()
+        vector = np.ascontiguousarray(vector, dtype="float32")
+        self._apply_insert(vector, id)
+        self._append_wal(WAL_OP_INSERT, id, vector)
+        self._schedule_checkpoint()
+        self._maybe_promote()
+
+    async def insert_many(self, vectors: np.ndarray, ids: np.ndarray):
+        """批量插入向量，只调用一次 add_with_ids，预写日志也只写入一次
 
-    async def search(self, vector: np.ndarray, k: int) -> tuple:
+        Args:
+            vectors (np.ndarray): 要插入的向量矩阵
+            ids (np.ndarray): 向量的 ID
+        Raises:
+            ValueError: 如果向量的维度与存储的维度不匹配，或向量与 ID 的数量不一致
+        """
+        vectors = np.ascontiguousarray(vectors, dtype="float32").reshape(
+            len(vectors), -1
+        )
+        ids = np.asarray(ids, dtype="int64")
+        if vectors.shape[1] != self.dimention:
+            raise ValueError(
+                f"向量维度不匹配, 期望: {self.dimention}, 实际: {vectors.shape[1]}"
+            )
+        if len(vectors) != len(ids):
+            raise ValueError(f"向量数量 {len(vectors)} 与 ID 数量 {len(ids)} 不一致")
+        if len(ids) == 0:
+            return
+        self._apply_inserts(vectors, ids)
+        self._write_wal(
+            [
+                self._wal_record(WAL_OP_INSERT, id, vector)
+                for id, vector in zip(ids.tolist(), vectors)
+            ]
+        )
+        self._schedule_checkpoint()
+        self._maybe_promote()
+
+    async def delete(self, ids: list[int]):
+        """删除向量。向量先被标记为已删除，已删除的比例超过阈值后在后台压缩
+
+        Args:
+            ids (list[int]): 要删除的向量 ID
+        """
+        for id in ids:
+            if id in self._ids:
+                self._apply_delete(id)
+                self._append_wal(WAL_OP_DELETE, id)
+        self._schedule_checkpoint()
+        self._maybe_compact()
+
+    async def search(self, vector: np.ndarray, k: int, ids: np.ndarray = None) -> tuple:
         """搜索最相似的向量
 
         Args:
             vector (np.ndarray): 查询向量
             k (int): 返回的最相似向量的数量
+            ids (np.ndarray): 只在这些 ID 中搜索。为 None 时搜索全部向量
         Returns:
-            tuple: (距离, 索引)
+            tuple: (距离, 索引)。不足 k 个时用 -1 填充
         """
         faiss.normalize_L2(vector)
-        distances, indices = self.index.search(vector, k)
+        if ids is None:
+            if not self._tombstones:
+                return self._search_all(vector, k)
+            tombstones = faiss.IDSelectorBatch(
+                np.fromiter(self._tombstones, dtype="int64", count=len(self._tombstones))
+            )
+            sel = faiss.IDSelectorNot(tombstones)
+            return self._search_all(vector, k, sel)
+        # 候选集中排除已删除的向量
+        ids = np.array([i for i in ids if i in self._ids], dtype="int64")
+        if len(ids) <= self.exact_search_threshold:
+            return self._exact_search(vector, k, ids)
+        sel = faiss.IDSelectorBatch(ids)
+        return self._search_all(vector, k, sel)
+
+    def _search_all(
+        self, vector: np.ndarray, k: int, sel: faiss.IDSelector = None
+    ) -> tuple:
+        """在索引与增量索引中分别查询并合并结果"""
+        results = [self._search_index(self.index, vector, k, sel)]
+        if self._delta is not None and self._delta.ntotal:
+            results.append(self._search_index(self._delta, vector, k, sel))
+        if len(results) == 1:
+            return results[0]
+        distances = np.concatenate([r[0] for r in results], axis=1)
+        indices = np.concatenate([r[1] for r in results], axis=1)
+        distances[indices < 0] = np.finfo("float32").max
+        order = np.argsort(distances, axis=1, kind="stable")[:, :k]
+        return (
+            np.take_along_axis(distances, order, axis=1),
+            np.take_along_axis(indices, order, axis=1),
+        )
+
+    def _search_index(
+        self, index: faiss.Index, vector: np.ndarray, k: int, sel: faiss.IDSelector
+    ) -> tuple:
+        if sel is None:
+            return index.search(vector, k)
+        params = search_parameters(index, sel, self.nprobe, self.ef_search)
+        return index.search(vector, k, params=params)
+
+    def _reconstruct(self, ids: np.ndarray) -> np.ndarray:
+        """按 ID 取出向量，ID 可能位于索引或增量索引中"""
+        if not self._delta_ids:
+            return self.index.reconstruct_batch(ids)
+        in_delta = np.fromiter(
+            (i in self._delta_ids for i in ids.tolist()), dtype=bool, count=len(ids)
+        )
+        vectors = np.empty((len(ids), self.dimention), dtype="float32")
+        if in_delta.any():
+            vectors[in_delta] = self._delta.reconstruct_batch(ids[in_delta])
+        if not in_delta.all():
+            vectors[~in_delta] = self.index.reconstruct_batch(ids[~in_delta])
+        return vectors
+
+    def _exact_search(self, vector: np.ndarray, k: int, ids: np.ndarray) -> tuple:
+        """候选集较小时按 ID 取出向量精确计算，代价只与候选集大小有关"""
+        distances = np.full((len(vector), k), np.finfo("float32").max, dtype="float32")
+        indices = np.full((len(vector), k), -1, dtype="int64")
+        if len(ids) == 0:
+            return distances, indices
+        candidates = self._reconstruct(ids)
+        # 与 IndexFlatL2 一致，返回平方 L2 距离
+        all_distances = (
+            (vector**2).sum(axis=1, keepdims=True)
+            + (candidates**2).sum(axis=1)[None, :]
+            - 2 * vector @ candidates.T
+        )
+        n = min(k, len(ids))
+        top = np.argpartition(all_distances, n - 1, axis=1)[:, :n]
+        for row in range(len(vector)):
+            order = top[row][np.argsort(all_distances[row, top[row]])]
+            distances[row, :n] = np.maximum(all_distances[row, order], 0)
+            indices[row, :n] = ids[order]
         return distances, indices
 
+    def export_vectors(self) -> tuple[np.ndarray, np.ndarray]:
+        """导出索引中的全部未删除向量
+
+        Returns:
+            tuple: (ID 数组, 向量矩阵)
+        """
+        ids, vectors = self._export_index(self.index)
+        if self._delta is not None and self._delta.ntotal:
+            delta_ids, delta_vectors = self._export_index(self._delta)
+            ids = np.concatenate([ids, delta_ids])
+            vectors = np.concatenate([vectors, delta_vectors])
+        if self._tombstones:
+            alive = ~np.isin(ids, list(self._tombstones))
+            ids, vectors = ids[alive], vectors[alive]
+        return ids, vectors
+
+    def _export_index(self, index: faiss.Index) -> tuple[np.ndarray, np.ndarray]:
+        """导出单个索引中的全部向量，包括已删除的向量"""
+        ids = faiss.vector_to_array(index.id_map).astype("int64")
+        if index.ntotal == 0:
+            return ids, np.empty((0, index.d), dtype="float32")
+        return ids, index.index.reconstruct_n(0, index.ntotal)
+
+    async def migrate_dim(self, new_dim: int):
+        """将索引中的向量截断到更低的 Matryoshka 维度
+
+        与 nomic-embed-text-v1.5 直接以低维推理的做法相同: 对完整向量做 layer_norm 后截断，再重新归一化。
+
+        Args:
+            new_dim (int): 新的维度
+        Raises:
+            ValueError: 如果新维度不是支持的 Matryoshka 维度，或不小于当前维度
+        """
+        check_matryoshka_dim(self.index.d, new_dim)
+        ids, vectors = self.export_vectors()
+        vectors = truncate_embeddings(vectors, new_dim)
+        if self.index_type in TRAINED_INDEX_TYPES and len(ids):
+            self.index = build_index(self.index_type, new_dim, train_vectors=vectors)
+        else:
+            self.index = build_index(
+                "hnsw" if self.index_type == "hnsw" else "flat", new_dim
+            )
+        apply_search_params(self.index, self.nprobe, self.ef_search)
+        if len(ids):
+            self.index.add_with_ids(vectors, ids)
+        self.dimention = new_dim
+        self._delta = None
+        self._delta_ids = set()
+        self._index_version += 1
+        self._ids = set(ids.tolist())
+        self._tombstones = set()
+        await self.save_index()
+
     async def save_index(self):
-        """保存索引
+        """立即将索引写入磁盘"""
+        await self.checkpoint(force=True)
+
+    async def checkpoint(self, force: bool = False):
+        """将当前索引写入磁盘并清空预写日志
+
+        索引先在事件循环中序列化，再在线程中落盘。落盘期间的新写入会进入新的预写日志，不会丢失。
+        映射模式下只把增量索引合并进索引文件，合并后重新映射。
 
         Args:
-            path (str): 保存索引的路径
+            force (bool): 即使预写日志为空也写入索引
+        """
+        async with self._checkpoint_lock:
+            await self._checkpoint(force)
+
+    async def _checkpoint(self, force: bool = False):
+        """checkpoint 的实现，调用方需要持有 _checkpoint_lock"""
+        if self._checkpoint_timer is not None:
+            self._checkpoint_timer.cancel()
+            self._checkpoint_timer = None
+        if not self.path:
+            return
+        if not force and not self._wal_records and os.path.exists(self.path):
+            return
+        if self._delta is not None:
+            await self._checkpoint_mapped()
+            return
+        data = faiss.serialize_index(self.index)
+        version = self._index_version
+        meta = self._checkpoint_meta()
+        self._rotate_wal()
+        await asyncio.to_thread(self._write_checkpoint, data, meta)
+        os.remove(self.wal_path + ".old")
+        logger.debug(f"Checkpointed {self.path}: {meta}")
+        if self.mmap:
+            await self._remap(version)
+
+    async def _checkpoint_mapped(self):
+        """将增量索引合并进索引文件。合并在线程中读取完整索引进行，期间查询仍使用映射的索引"""
+        ids, vectors = self._export_index(self._delta)
+        meta = self._checkpoint_meta()
+        self._rotate_wal()
+        if not len(ids):
+            # 只有删除，索引文件不变
+            await asyncio.to_thread(self._write_meta, meta)
+            os.remove(self.wal_path + ".old")
+            return
+        merged = await asyncio.to_thread(self._write_merged_checkpoint, ids, vectors)
+        # 先释放旧的映射再替换文件
+        self.index = merged
+        self._delta.remove_ids(faiss.IDSelectorBatch(ids))
+        self._delta_ids -= set(ids.tolist())
+        await asyncio.to_thread(self._replace_checkpoint, meta)
+        os.remove(self.wal_path + ".old")
+        logger.debug(f"Checkpointed {self.path}: {meta}")
+        await self._remap(self._index_version)
+
+    async def _remap(self, version: int):
+        """以内存映射方式重新加载刚写入的索引文件，释放内存中的完整索引
+
+        Args:
+            version (int): 写入文件时 self.index 的版本。之后内存中的索引又被写入时放弃映射
+        """
+        index = await asyncio.to_thread(self._read_mapped)
+        if self._delta is None:
+            if self._index_version != version:
+                return
+            self._delta = build_index("flat", self.dimention)
+            self._delta_ids = set()
+        self.index = index
+
+    def _read_mapped(self) -> faiss.Index:
+        index = faiss.read_index(self.path, MMAP_IO_FLAGS)
+        apply_search_params(index, self.nprobe, self.ef_search)
+        return index
+
+    def _checkpoint_meta(self) -> dict:
+        return {
+            "dim": self.index.d,
+            "ntotal": self._physical_total(),
+            "index_type": self.index_type,
+            "tombstones": sorted(self._tombstones),
+        }
+
+    def _rotate_wal(self):
+        """轮换预写日志，之后的写入追加到新文件"""
+        self._wal.close()
+        os.replace(self.wal_path, self.wal_path + ".old")
+        self._wal = open(self.wal_path, "ab")
+        self._wal_records = 0
+
+    async def promote(self, index_type: str):
+        """在后台将索引重建为指定类型，重建完成前旧索引继续提供查询
+
+        Args:
+            index_type (str): 目标索引类型
+        """
+        await self._rebuild(index_type)
+        logger.info(
+            f"Promoted {self.path} to {index_type} index with {self.index.ntotal} vectors"
+        )
+
+    async def compact(self) -> CompactionStats:
+        """重建索引，物理移除已删除的向量
+
+        Returns:
+            CompactionStats: 压缩的统计信息
+        """
+        bytes_before = self._index_file_size()
+        removed = await self._rebuild(self.index_type)
+        stats = CompactionStats(
+            removed_vectors=removed,
+            bytes_before=bytes_before,
+            bytes_after=self._index_file_size(),
+        )
+        self.last_compaction = stats
+        logger.info(
+            f"Compacted {self.path}: removed {stats.removed_vectors} vectors, "
+            f"reclaimed {stats.reclaimed_bytes} bytes"
+        )
+        return stats
+
+    async def _rebuild(self, index_type: str) -> int:
+        """在线程中重建索引并替换当前索引
+
+        构建期间检查点照常进行；替换索引与随后的检查点在 _checkpoint_lock 内完成，
+        不会与正在合并增量索引的检查点交错。
+
+        Returns:
+            int: 重建时丢弃的已删除向量数量
+        """
+        tombstones = set(self._tombstones)
+        ids, vectors = self.export_vectors()
+        # 记录重建期间的插入，重建完成后补到新索引上；期间的删除仍保留在 _tombstones 中
+        self._rebuild_inserts = []
+        try:
+            new_index = await asyncio.to_thread(
+                self._build_promoted_index, index_type, ids, vectors
+            )
+            async with self._checkpoint_lock:
+                # 等待锁期间的插入同样记录在 _rebuild_inserts 中
+                for id, vector in self._rebuild_inserts:
+                    new_index.add_with_ids(
+                        vector.reshape(1, -1), np.array([id], dtype="int64")
+                    )
+                self._rebuild_inserts = None
+                self.index = new_index
+                self.index_type = index_type
+                self._delta = None
+                self._delta_ids = set()
+                self._index_version += 1
+                self._tombstones -= tombstones
+                await self._checkpoint(force=True)
+        finally:
+            self._rebuild_inserts = None
+        return len(tombstones)
+
+    def _build_promoted_index(
+        self, index_type: str, ids: np.ndarray, vectors: np.ndarray
+    ) -> faiss.Index:
+        index = build_index(index_type, self.dimention, train_vectors=vectors)
+        apply_search_params(index, self.nprobe, self.ef_search)
+        if len(ids):
+            index.add_with_ids(vectors, ids)
+        return index
+
+    def _maybe_promote(self):
+        if (
+            self.promote_to
+            and self.promote_to != self.index_type
+            and self.index_type == "flat"
+            and len(self._ids) >= self.promote_threshold
+        ):
+            self._start_rebuild(self.promote(self.promote_to))
+
+    def _maybe_compact(self):
+        total = self._physical_total()
+        if total and len(self._tombstones) / total > self.compaction_ratio:
+            self._start_rebuild(self.compact())
+
+    def _start_rebuild(self, coro):
+        if self._rebuild_task is not None:
+            coro.close()
+            return
+        self._rebuild_task = asyncio.get_running_loop().create_task(coro)
+        self._rebuild_task.add_done_callback(self._on_rebuild_done)
+
+    def _on_rebuild_done(self, task: asyncio.Task):
+        self._rebuild_task = None
+        if not task.cancelled() and task.exception():
+            logger.error(f"Failed to rebuild {self.path}: {task.exception()}")
+
+    def _physical_total(self) -> int:
+        """索引中的向量数量，包括已删除的向量"""
+        total = self.index.ntotal
+        if self._delta is not None:
+            total += self._delta.ntotal
+        return total
+
+    def _index_file_size(self) -> int:
+        if self.path and os.path.exists(self.path):
+            return os.path.getsize(self.path)
+        return 0
+
+    def _load_meta(self) -> dict:
+        if self.meta_path and os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        return {}
+
+    async def close(self):
+        """合并预写日志并关闭"""
+        if self._rebuild_task is not None:
+            await asyncio.gather(self._rebuild_task, return_exceptions=True)
+        await self.checkpoint()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._wal:
+            self._wal.close()
+            self._wal = None
+
+    def _write_checkpoint(self, data: np.ndarray, meta: dict):
+        with open(self.path + ".tmp", "wb") as f:
+            f.write(data.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self._replace_checkpoint(meta)
+
+    def _write_merged_checkpoint(
+        self, ids: np.ndarray, vectors: np.ndarray
+    ) -> faiss.Index:
+        """读取完整的索引文件，合并增量向量后写入临时文件
+
+        Returns:
+            faiss.Index: 合并后的内存索引
+        """
+        index = faiss.read_index(self.path)
+        apply_search_params(index, self.nprobe, self.ef_search)
+        if len(ids):
+            index.add_with_ids(vectors, ids)
+        faiss.write_index(index, self.path + ".tmp")
+        with open(self.path + ".tmp", "rb+") as f:
+            os.fsync(f.fileno())
+        return index
+
+    def _replace_checkpoint(self, meta: dict):
+        os.replace(self.path + ".tmp", self.path)
+        self._write_meta(meta)
+
+    def _write_meta(self, meta: dict):
+        with open(self.meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(self.meta_path + ".tmp", self.meta_path)
+
+    def _schedule_checkpoint(self):
+        """写入量达到阈值时立即合并，否则在写入停止一段时间后合并"""
+        if not self.path:
+            return
+        if self._wal_records >= self.checkpoint_threshold:
+            self._start_checkpoint()
+            return
+        if self._checkpoint_timer is not None:
+            self._checkpoint_timer.cancel()
+        self._checkpoint_timer = asyncio.get_running_loop().call_later(
+            self.checkpoint_interval, self._start_checkpoint
+        )
+
+    def _start_checkpoint(self):
+        task = asyncio.get_running_loop().create_task(self.checkpoint())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _apply_insert(self, vector: np.ndarray, id: int):
+        self._apply_inserts(vector.reshape(1, -1), np.array([id], dtype="int64"))
+
+    def _apply_inserts(self, vectors: np.ndarray, ids: np.ndarray):
+        if self._delta is not None:
+            self._delta.add_with_ids(vectors, ids)
+            self._delta_ids.update(ids.tolist())
+        else:
+            self.index.add_with_ids(vectors, ids)
+            self._index_version += 1
+        self._ids.update(ids.tolist())
+        if self._rebuild_inserts is not None:
+            self._rebuild_inserts.extend(zip(ids.tolist(), vectors))
+
+    def _apply_delete(self, id: int):
+        self._ids.discard(id)
+        self._tombstones.add(id)
+
+    def _append_wal(self, op: int, id: int, vector: np.ndarray = None):
+        self._write_wal([self._wal_record(op, id, vector)])
+
+    def _wal_record(self, op: int, id: int, vector: np.ndarray = None) -> bytes:
+        payload = vector.tobytes() if vector is not None else b""
+        dim = vector.shape[0] if vector is not None else 0
+        return _WAL_HEADER.pack(op, id, dim, zlib.crc32(payload)) + payload
+
+    def _write_wal(self, records: list[bytes]):
+        if not self._wal:
+            return
+        self._wal.write(b"".join(records))
+        self._wal.flush()
+        if self.fsync:
+            os.fsync(self._wal.fileno())
+        self._wal_records += len(records)
+
+    def _replay_wal(self, wal_path: str) -> int:
+        """将预写日志重放到索引上。重放是幂等的，已经包含在检查点中的记录会被跳过
+
+        Returns:
+            int: 重放的记录数
         """
-        faiss.write_index(self.index, self.path)
+        if not os.path.exists(wal_path):
+            return 0
+        with open(wal_path, "rb") as f:
+            data = f.read()
+        offset = 0
+        replayed = 0
+        while offset + _WAL_HEADER.size <= len(data):
+            op, id, dim, crc = _WAL_HEADER.unpack_from(data, offset)
+            end = offset + _WAL_HEADER.size + dim * 4
+            payload = data[offset + _WAL_HEADER.size : end]
+            if end > len(data) or zlib.crc32(payload) != crc:
+                # 崩溃时写了一半的记录
+                break
+            if (
+                op == WAL_OP_INSERT
+                and id not in self._ids
+                and id not in self._tombstones
+            ):
+                if dim != self.dimention:
+                    raise ValueError(
+                        f"预写日志 {wal_path} 中的向量维度 {dim} 与索引维度 {self.dimention} 不一致"
+                    )
+                self._apply_insert(np.frombuffer(payload, dtype="float32"), id)
+            elif op == WAL_OP_DELETE and id in self._ids:
+                self._apply_delete(id)
+            offset = end
+            replayed += 1
+        if offset < len(data):
+            logger.warning(f"预写日志 {wal_path} 末尾有 {len(data) - offset} 字节损坏，已忽略")
+            with open(wal_path, "r+b") as f:
+                f.truncate(offset)
+        if replayed:
+            logger.info(f"Replayed {replayed} records from {wal_path}")
+        return replayed
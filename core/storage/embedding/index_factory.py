@@ -0,0 +1,140 @@
+import math
+import os
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+TRAINED_INDEX_TYPES = ("ivf_flat", "ivf_pq")
+"""需要先训练才能写入的索引类型"""
+MMAP_IO_FLAGS = (
+    faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+)
+"""以只读内存映射方式加载索引的标志。IO_FLAG_MMAP_IFC 只在较新的 faiss 中提供"""
+
+
+def build_index(
+    index_type: str,
+    dimention: int,
+    train_vectors: np.ndarray = None,
+    hnsw_m: int = 32,
+    ef_construction: int = 80,
+    nlist: int = None,
+    pq_m: int = None,
+) -> faiss.Index:
+    """构建一个空的、以外部 ID 寻址的 FAISS 索引
+
+    Args:
+        index_type (str): 索引类型，可选 flat / hnsw / ivf_flat / ivf_pq
+        dimention (int): 向量维度
+        train_vectors (np.ndarray): 训练向量，IVF 类索引必须提供
+        hnsw_m (int): HNSW 每个节点的邻居数
+        ef_construction (int): HNSW 构建时的搜索宽度
+        nlist (int): IVF 的聚类中心数量，默认根据训练集大小推算
+        pq_m (int): PQ 的子空间数量，默认为维度的 1/8
+    Returns:
+        faiss.Index: IndexIDMap2 包装后的索引
+    Raises:
+        ValueError: 如果索引类型不支持，或需要训练但未提供训练向量
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"不支持的索引类型: {index_type}, 可选: {INDEX_TYPES}")
+    if index_type == "flat":
+        base_index = faiss.IndexFlatL2(dimention)
+    elif index_type == "hnsw":
+        base_index = faiss.IndexHNSWFlat(dimention, hnsw_m)
+        base_index.hnsw.efConstruction = ef_construction
+    else:
+        if train_vectors is None or len(train_vectors) == 0:
+            raise ValueError(f"{index_type} 索引需要训练向量")
+        n = len(train_vectors)
+        # 每个聚类中心至少需要约 39 个训练点
+        nlist = nlist or max(1, min(int(4 * math.sqrt(n)), n // 39))
+        quantizer = faiss.IndexFlatL2(dimention)
+        if index_type == "ivf_flat":
+            base_index = faiss.IndexIVFFlat(quantizer, dimention, nlist)
+        else:
+            pq_m = pq_m or max(1, dimention // 8)
+            # 每个子空间的码本需要至少 2^nbits 个训练点
+            nbits = 8 if n >= 256 else max(1, int(math.log2(n)))
+            base_index = faiss.IndexIVFPQ(quantizer, dimention, nlist, pq_m, nbits)
+        base_index.train(np.ascontiguousarray(train_vectors, dtype="float32"))
+        # 保留 ID -> 倒排位置的映射，以支持按 ID 重建向量
+        base_index.make_direct_map()
+    return faiss.IndexIDMap2(base_index)
+
+
+def to_id_map2(index: faiss.Index) -> faiss.Index:
+    """将 IndexIDMap 转换为支持按外部 ID 重建向量的 IndexIDMap2
+
+    两者的序列化格式只有类型标识不同，这里直接替换标识后反序列化，避免重建底层索引。
+    """
+    if isinstance(index, faiss.IndexIDMap2) or not isinstance(index, faiss.IndexIDMap):
+        return index
+    data = faiss.serialize_index(index)
+    assert bytes(data[:4]) == b"IxMp"
+    data[:4] = np.frombuffer(b"IxM2", dtype="uint8")
+    return faiss.deserialize_index(data)
+
+
+def upgrade_id_map_file(path: str) -> bool:
+    """将磁盘上的 IndexIDMap 索引文件原地升级为 IndexIDMap2
+
+    只修改文件头的类型标识，不读取索引内容，供内存映射加载前使用。
+
+    Returns:
+        bool: 是否修改了文件
+    """
+    with open(path, "r+b") as f:
+        if f.read(4) != b"IxMp":
+            return False
+        f.seek(0)
+        f.write(b"IxM2")
+        f.flush()
+        os.fsync(f.fileno())
+    return True
+
+
+def search_parameters(
+    index: faiss.Index, sel: faiss.IDSelector, nprobe: int = 16, ef_search: int = 64
+) -> faiss.SearchParameters:
+    """构造带有 ID 过滤器的查询参数
+
+    Args:
+        index (faiss.Index): 索引
+        sel (faiss.IDSelector): ID 过滤器，作用于外部 ID
+        nprobe (int): IVF 查询时访问的聚类数
+        ef_search (int): HNSW 查询时的搜索宽度
+    """
+    base_index = faiss.downcast_index(index.index)
+    if isinstance(base_index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=ef_search)
+    if isinstance(base_index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=sel, nprobe=min(nprobe, base_index.nlist))
+    return faiss.SearchParameters(sel=sel)
+
+
+def detect_index_type(index: faiss.Index) -> str:
+    """根据索引结构判断索引类型"""
+    base_index = faiss.downcast_index(index.index)
+    if isinstance(base_index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base_index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(base_index, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    return "flat"
+
+
+def apply_search_params(index: faiss.Index, nprobe: int = 16, ef_search: int = 64):
+    """设置索引的查询参数
+
+    Args:
+        index (faiss.Index): 索引
+        nprobe (int): IVF 查询时访问的聚类数
+        ef_search (int): HNSW 查询时的搜索宽度
+    """
+    base_index = faiss.downcast_index(index.index)
+    if isinstance(base_index, faiss.IndexHNSW):
+        base_index.hnsw.efSearch = ef_search
+    elif isinstance(base_index, faiss.IndexIVF):
+        base_index.nprobe = min(nprobe, base_index.nlist)
@@ -28,6 +28,8 @@ class PhaseNode(BaseNode):
 
     name: str
     type: str
+    user_id: str = None
+    """所属用户，不同用户的同名实体是不同的节点。旧数据中可能为空"""
 
 
 @dataclass
@@ -81,7 +83,11 @@ class GraphStore(Protocol):
     def add_phase_node(self, node: PhaseNode) -> None: ...
     def add_passage_edge(self, edge: PassageEdge) -> None: ...
     def add_phase_edge(self, edge: PhaseEdge) -> None: ...
-    def find_phase_node_by_name(self, name: str) -> str | None: ...
+    def find_phase_node_by_name(self, name: str, user_id: str = None) -> str | None: ...
+    def upsert_phase_nodes(self, nodes: list[PhaseNode]) -> list[str]: ...
+    def write_batch(
+        self, nodes: list[BaseNode], edges: list[BaseEdge]
+    ) -> dict[str, str]: ...
     def get_passage_nodes(self, filter: dict = {}) -> Iterable[PassageNode]: ...
     def get_phase_nodes(self, filter: dict = {}) -> Iterable[PhaseNode]: ...
     def get_passage_edges(self, filter: dict = {}) -> Iterable[PassageEdge]: ...
@@ -89,8 +95,12 @@ class GraphStore(Protocol):
     def get_phase_nodes_by_fact_id(
         self, fact_id: str
     ) -> Iterable[tuple[PhaseNode, PhaseNode]]: ...
+    def get_phase_nodes_by_fact_ids(
+        self, fact_ids: list[str]
+    ) -> dict[str, list[tuple[PhaseNode, PhaseNode]]]: ...
     def delete_phase_edge_by_fact_id(self, fact_id: str) -> None: ...
     def cnt_phase_node_edges(self, node_id: str) -> int: ...
+    def phase_node_degrees(self, node_ids: list[str]) -> dict[str, int]: ...
     def save(self, path: str) -> None: ...
     def load(self, path: str) -> None: ...
     def run_ppr(
@@ -100,6 +110,9 @@ class GraphStore(Protocol):
         damping_factor: float = 0.5,
         max_iter: int = 100,
         tol: float = 1e-6,
+        method: str = "exact",
+        epsilon: float = 1e-4,
+        max_pushes: int = 10000,
     ) -> dict[str, float]:
         """运行 Personalize PageRank 算法。
 
@@ -108,9 +121,56 @@ class GraphStore(Protocol):
             damping_factor (float): 阻尼因子，通常设置为 0.5。
             max_iter (int): 最大迭代次数。
             tol (float): 收敛容忍度，表示当 PageRank 分数的变化小于该值时停止迭代。
+            method (str): exact 在整张图上迭代；push 为只访问种子节点附近的局部近似。
+            epsilon (float): push 模式下的残差阈值。
+            max_pushes (int): push 模式下推送次数的上限。
         """
         ...
 
     def get_graph_networkx(self, filter: dict = None) -> GraphResult:
         """获取图的 NetworkX 表示"""
         ...
+
+
+class AsyncGraphStore(Protocol):
+    """GraphStore 的异步版本，查询不阻塞事件循环。读取方法返回列表而不是迭代器"""
+
+    async def add_passage_node(self, node: PassageNode) -> None: ...
+    async def add_phase_node(self, node: PhaseNode) -> None: ...
+    async def add_passage_edge(self, edge: PassageEdge) -> None: ...
+    async def add_phase_edge(self, edge: PhaseEdge) -> None: ...
+    async def find_phase_node_by_name(
+        self, name: str, user_id: str = None
+    ) -> str | None: ...
+    async def upsert_phase_nodes(self, nodes: list[PhaseNode]) -> list[str]: ...
+    async def write_batch(
+        self, nodes: list[BaseNode], edges: list[BaseEdge]
+    ) -> dict[str, str]: ...
+    async def get_passage_nodes(self, filter: dict = {}) -> list[PassageNode]: ...
+    async def get_phase_nodes(self, filter: dict = {}) -> list[PhaseNode]: ...
+    async def get_passage_edges(self, filter: dict = {}) -> list[PassageEdge]: ...
+    async def get_phase_edges(self, filter: dict = {}) -> list[PhaseEdge]: ...
+    async def get_phase_nodes_by_fact_id(
+        self, fact_id: str
+    ) -> list[tuple[PhaseNode, PhaseNode]]: ...
+    async def get_phase_nodes_by_fact_ids(
+        self, fact_ids: list[str]
+    ) -> dict[str, list[tuple[PhaseNode, PhaseNode]]]: ...
+    async def delete_phase_edge_by_fact_id(self, fact_id: str) -> None: ...
+    async def cnt_phase_node_edges(self, node_id: str) -> int: ...
+    async def phase_node_degrees(self, node_ids: list[str]) -> dict[str, int]: ...
+    async def save(self, path: str) -> None: ...
+    async def load(self, path: str) -> None: ...
+    async def run_ppr(
+        self,
+        personalization: dict[str, float],
+        user_id: str,
+        damping_factor: float = 0.5,
+        max_iter: int = 100,
+        tol: float = 1e-6,
+        method: str = "exact",
+        epsilon: float = 1e-4,
+        max_pushes: int = 10000,
+    ) -> dict[str, float]: ...
+    async def get_graph_networkx(self, filter: dict = None) -> GraphResult: ...
+    async def close(self) -> None: ...
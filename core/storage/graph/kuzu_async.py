@@ -0,0 +1,137 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from .base import *  # noqa
+from .kuzu_impl import KuzuGraphStore
+
+
+class AsyncKuzuGraphStore(AsyncGraphStore):
+    """KuzuGraphStore 的异步版本，图查询不再阻塞事件循环
+
+    读操作在读线程池中并发执行，每个读线程持有共享 Database 上的一个独立连接；
+    写操作全部交给只有一个线程的写执行器，按提交顺序串行执行。
+    """
+
+    def __init__(self, db_path: str, read_workers: int = 4):
+        """
+        Args:
+            db_path (str): Kuzu 数据库路径
+            read_workers (int): 读线程(连接)的数量
+        """
+        self.store = KuzuGraphStore(db_path)
+        """同步的图存储，持有写连接与内存中的索引"""
+        self._reader = ThreadPoolExecutor(
+            max_workers=read_workers,
+            thread_name_prefix="kuzu-read",
+            initializer=self.store.open_thread_connection,
+        )
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kuzu-write")
+
+    async def _read(self, func: Callable, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._reader, functools.partial(func, *args, **kwargs)
+        )
+
+    async def _write(self, func: Callable, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._writer, functools.partial(func, *args, **kwargs)
+        )
+
+    async def add_passage_node(self, node: PassageNode) -> None:
+        await self._write(self.store.add_passage_node, node)
+
+    async def add_phase_node(self, node: PhaseNode) -> None:
+        await self._write(self.store.add_phase_node, node)
+
+    async def add_passage_edge(self, edge: PassageEdge) -> None:
+        await self._write(self.store.add_passage_edge, edge)
+
+    async def add_phase_edge(self, edge: PhaseEdge) -> None:
+        await self._write(self.store.add_phase_edge, edge)
+
+    async def find_phase_node_by_name(
+        self, name: str, user_id: str = None
+    ) -> str | None:
+        # 只查询内存中的名称索引，不需要切换线程
+        return self.store.find_phase_node_by_name(name, user_id=user_id)
+
+    async def upsert_phase_nodes(self, nodes: list[PhaseNode]) -> list[str]:
+        return await self._write(self.store.upsert_phase_nodes, nodes)
+
+    async def write_batch(
+        self, nodes: list[BaseNode], edges: list[BaseEdge]
+    ) -> dict[str, str]:
+        return await self._write(self.store.write_batch, nodes, edges)
+
+    async def get_passage_nodes(self, filter: dict = {}) -> list[PassageNode]:
+        return await self._read(lambda: list(self.store.get_passage_nodes(filter)))
+
+    async def get_phase_nodes(self, filter: dict = {}) -> list[PhaseNode]:
+        return await self._read(lambda: list(self.store.get_phase_nodes(filter)))
+
+    async def get_passage_edges(self, filter: dict = {}) -> list[PassageEdge]:
+        return await self._read(lambda: list(self.store.get_passage_edges(filter)))
+
+    async def get_phase_edges(self, filter: dict = {}) -> list[PhaseEdge]:
+        return await self._read(lambda: list(self.store.get_phase_edges(filter)))
+
+    async def get_phase_nodes_by_fact_id(
+        self, fact_id: str
+    ) -> list[tuple[PhaseNode, PhaseNode]]:
+        return await self._read(
+            lambda: list(self.store.get_phase_nodes_by_fact_id(fact_id))
+        )
+
+    async def get_phase_nodes_by_fact_ids(
+        self, fact_ids: list[str]
+    ) -> dict[str, list[tuple[PhaseNode, PhaseNode]]]:
+        return await self._read(self.store.get_phase_nodes_by_fact_ids, fact_ids)
+
+    async def delete_phase_edge_by_fact_id(self, fact_id: str) -> None:
+        await self._write(self.store.delete_phase_edge_by_fact_id, fact_id)
+
+    async def cnt_phase_node_edges(self, node_id: str) -> int:
+        return await self._read(self.store.cnt_phase_node_edges, node_id)
+
+    async def phase_node_degrees(self, node_ids: list[str]) -> dict[str, int]:
+        return await self._read(self.store.phase_node_degrees, node_ids)
+
+    async def save(self, path: str) -> None:
+        await self._write(self.store.save, path)
+
+    async def load(self, path: str) -> None:
+        await self._write(self.store.load, path)
+
+    async def run_ppr(
+        self,
+        personalization: dict[str, float],
+        user_id: str,
+        damping_factor: float = 0.5,
+        max_iter: int = 100,
+        tol: float = 1e-6,
+        method: str = "exact",
+        epsilon: float = 1e-4,
+        max_pushes: int = 10000,
+    ) -> dict[str, float]:
+        return await self._read(
+            self.store.run_ppr,
+            personalization,
+            user_id,
+            damping_factor=damping_factor,
+            max_iter=max_iter,
+            tol=tol,
+            method=method,
+            epsilon=epsilon,
+            max_pushes=max_pushes,
+        )
+
+    async def get_graph_networkx(self, filter: dict = {}) -> GraphResult:
+        return await self._read(self.store.get_graph_networkx, filter)
+
+    async def close(self) -> None:
+        """等待已提交的读写完成并关闭线程池"""
+        await asyncio.to_thread(self._writer.shutdown, wait=True)
+        await asyncio.to_thread(self._reader.shutdown, wait=True)
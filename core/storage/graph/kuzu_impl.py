@@ -1,5 +1,8 @@
+import threading
+from dataclasses import replace
 from typing import Iterable
 from .base import *  # noqa
+from .ppr import PPR_METHODS, PPRGraph, push_ppr
 import kuzu
 import networkx as nx
 
@@ -8,8 +11,29 @@ class KuzuGraphStore(GraphStore):
     def __init__(self, db_path: str):
         self.db_path = db_path
         self.db = kuzu.Database(db_path)
-        self.conn = kuzu.Connection(self.db)
+        self._write_conn = kuzu.Connection(self.db)
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        """写入数据库与更新内存中的索引、PPR 图时持有，保证其他线程看到的缓存与已提交的数据一致"""
         self._init_schema()
+        self._ppr_graphs: dict[str, PPRGraph] = {}
+        """user_id -> 该用户的 PPR 图，首次查询时从数据库加载，之后随写入增量更新"""
+        self._fact_index: dict[str, list[tuple[str, str]]] = {}
+        """fact_id -> 该概念的概念关系边的 (源节点 ID, 目标节点 ID)。
+        Kuzu 不能为边的属性建索引，按 fact_id 查找边需要扫描全部边，因此在内存中维护这个映射"""
+        self._load_fact_index()
+        self._name_index: dict[tuple[str | None, str], str] = {}
+        """(user_id, 实体名称) -> 概念节点 ID"""
+        self._load_name_index()
+
+    @property
+    def conn(self) -> kuzu.Connection:
+        """当前线程的连接。调用过 open_thread_connection 的线程使用自己的连接，其他线程使用写连接"""
+        return getattr(self._local, "conn", None) or self._write_conn
+
+    def open_thread_connection(self):
+        """为当前线程打开一个独立的连接，供多个线程并发读取同一个数据库"""
+        self._local.conn = kuzu.Connection(self.db)
 
     def _init_schema(self):
         """初始化数据库模式"""
@@ -19,9 +43,45 @@ class KuzuGraphStore(GraphStore):
                 "CREATE NODE TABLE IF NOT EXISTS PassageNode(id STRING, ts TIMESTAMP, user_id STRING, PRIMARY KEY(id));"
                 "CREATE REL TABLE IF NOT EXISTS PassageEdge(FROM PhaseNode TO PassageNode, ts TIMESTAMP, relation_type STRING, summary_id STRING, user_id STRING);"
                 "CREATE REL TABLE IF NOT EXISTS PhaseEdge(FROM PhaseNode TO PhaseNode, ts TIMESTAMP, relation_type STRING, fact_id STRING, user_id STRING);"
+                # 旧版本的 PhaseNode 没有 user_id
+                "ALTER TABLE PhaseNode ADD IF NOT EXISTS user_id STRING;"
             )
         )
 
+    def _load_fact_index(self):
+        """启动时从数据库中读取全部概念关系边，构建 fact_id 索引"""
+        result = self.conn.execute(
+            """
+            MATCH (a:PhaseNode)-[e:PhaseEdge]->(b:PhaseNode)
+            WHERE e.fact_id IS NOT NULL
+            RETURN e.fact_id, a.id, b.id;
+            """
+        )
+        while result.has_next():
+            fact_id, source, target = result.get_next()
+            self._fact_index.setdefault(fact_id, []).append((source, target))
+
+    def _load_name_index(self):
+        """启动时从数据库中读取全部概念节点，构建按用户划分的名称索引
+
+        旧数据中的概念节点没有 user_id，按连接到它的段落关联边的用户登记，
+        这些节点仍然只被已经使用它的用户找到。
+        """
+        result = self.conn.execute("MATCH (n:PhaseNode) RETURN n.id, n.name, n.user_id;")
+        while result.has_next():
+            node_id, name, user_id = result.get_next()
+            self._name_index.setdefault((user_id, name), node_id)
+        result = self.conn.execute(
+            """
+            MATCH (n:PhaseNode)-[e:PassageEdge]->(:PassageNode)
+            WHERE n.user_id IS NULL
+            RETURN DISTINCT n.id, n.name, e.user_id;
+            """
+        )
+        while result.has_next():
+            node_id, name, user_id = result.get_next()
+            self._name_index.setdefault((user_id, name), node_id)
+
     def add_passage_node(self, node: PassageNode) -> None:
         """添加记忆节点
 
@@ -40,8 +100,88 @@ class KuzuGraphStore(GraphStore):
         Args:
             node (PhaseNode): 概念节点对象
         """
-        query = "MERGE (:PhaseNode {id: $id, ts: to_timestamp($ts), name: $name, type: $type});"
-        params = {"id": node.id, "ts": node.ts, "name": node.name, "type": node.type}
+        query = "MERGE (:PhaseNode {id: $id, ts: to_timestamp($ts), name: $name, type: $type, user_id: $user_id});"
+        params = {
+            "id": node.id,
+            "ts": node.ts,
+            "name": node.name,
+            "type": node.type,
+            "user_id": node.user_id,
+        }
+        with self._lock:
+            self.conn.execute(query, params)
+            self._name_index.setdefault((node.user_id, node.name), node.id)
+
+    def upsert_phase_nodes(self, nodes: list[PhaseNode]) -> list[str]:
+        """批量写入概念节点，同一用户下已存在同名节点时复用已有节点
+
+        Args:
+            nodes (list[PhaseNode]): 概念节点，ID 只在需要新建节点时使用
+        Returns:
+            list[str]: 与 nodes 一一对应的概念节点 ID
+        """
+        with self._lock:
+            return self._upsert_phase_nodes(nodes)
+
+    def _resolve_phase_nodes(
+        self, nodes: list[PhaseNode]
+    ) -> tuple[list[str], dict[tuple[str | None, str], PhaseNode]]:
+        """按 (user_id, 名称) 解析概念节点，调用方需要持有 _lock
+
+        Returns:
+            tuple: 与 nodes 一一对应的概念节点 ID；需要新建的节点，同一批中的同名节点只新建第一个
+        """
+        ret = []
+        new_nodes = {}
+        for node in nodes:
+            key = (node.user_id, node.name)
+            node_id = self._name_index.get(key)
+            if node_id is None:
+                new_nodes.setdefault(key, node)
+                node_id = new_nodes[key].id
+            ret.append(node_id)
+        return ret, new_nodes
+
+    def _upsert_phase_nodes(self, nodes: list[PhaseNode]) -> list[str]:
+        ret, new_nodes = self._resolve_phase_nodes(nodes)
+        if new_nodes:
+            self._merge_phase_nodes(list(new_nodes.values()))
+            for key, node in new_nodes.items():
+                self._name_index[key] = node.id
+        return ret
+
+    def _merge_passage_nodes(self, nodes: list[PassageNode]):
+        query = """
+            UNWIND $nodes AS n
+            MERGE (p:PassageNode {id: n.id})
+            ON CREATE SET p.ts = to_timestamp(n.ts), p.user_id = n.user_id;
+        """
+        params = {
+            "nodes": [
+                {"id": node.id, "ts": node.ts, "user_id": node.user_id}
+                for node in nodes
+            ]
+        }
+        self.conn.execute(query, params)
+
+    def _merge_phase_nodes(self, nodes: list[PhaseNode]):
+        query = """
+            UNWIND $nodes AS n
+            MERGE (p:PhaseNode {id: n.id})
+            ON CREATE SET p.ts = to_timestamp(n.ts), p.name = n.name, p.type = n.type, p.user_id = n.user_id;
+        """
+        params = {
+            "nodes": [
+                {
+                    "id": node.id,
+                    "ts": node.ts,
+                    "name": node.name,
+                    "type": node.type,
+                    "user_id": node.user_id,
+                }
+                for node in nodes
+            ]
+        }
         self.conn.execute(query, params)
 
     def add_passage_edge(self, edge: PassageEdge) -> None:
@@ -50,6 +190,89 @@ class KuzuGraphStore(GraphStore):
         Args:
             edge (PassageEdge): 记忆关联边(段落关联边)对象
         """
+        with self._lock:
+            self._write_passage_edge(edge)
+            self._index_edge(edge)
+
+    def add_phase_edge(self, edge: PhaseEdge) -> None:
+        """添加概念关系边(实体关系边)
+
+        Args:
+            edge (PhaseEdge): 概念关系边(实体关系边)对象
+        """
+        with self._lock:
+            self._write_phase_edge(edge)
+            self._index_edge(edge)
+
+    def write_batch(
+        self, nodes: list[BaseNode], edges: list[BaseEdge]
+    ) -> dict[str, str]:
+        """在一个事务中写入一批节点和边，要么全部写入，要么全部不写入
+
+        概念节点与 upsert_phase_nodes 一样按 (user_id, 名称) 解析：同一用户下已存在同名节点时复用已有节点，
+        边的端点随之改写。解析与写入在同一把锁内完成，并发写入同名实体不会产生重复节点。
+        节点以 UNWIND 按 ID 合并，已存在的节点保持不变；边在同一事务中逐条写入。
+        内存中的 fact_id 索引、名称索引和 PPR 图在事务提交之后才更新。
+
+        Args:
+            nodes (list[BaseNode]): PassageNode 或 PhaseNode
+            edges (list[BaseEdge]): PassageEdge 或 PhaseEdge，端点需要已存在或在 nodes 中
+        Returns:
+            dict[str, str]: nodes 中概念节点的 ID -> 实际写入或复用的概念节点 ID
+        Raises:
+            TypeError: 如果节点或边的类型不支持
+        """
+        passage_nodes = [node for node in nodes if isinstance(node, PassageNode)]
+        phase_nodes = [node for node in nodes if isinstance(node, PhaseNode)]
+        if len(passage_nodes) + len(phase_nodes) != len(nodes):
+            raise TypeError("nodes 只能包含 PassageNode 或 PhaseNode")
+        if not all(isinstance(edge, (PassageEdge, PhaseEdge)) for edge in edges):
+            raise TypeError("edges 只能包含 PassageEdge 或 PhaseEdge")
+        with self._lock:
+            return self._write_batch(passage_nodes, phase_nodes, edges)
+
+    def _write_batch(
+        self,
+        passage_nodes: list[PassageNode],
+        phase_nodes: list[PhaseNode],
+        edges: list[BaseEdge],
+    ) -> dict[str, str]:
+        node_ids, new_nodes = self._resolve_phase_nodes(phase_nodes)
+        remap = {node.id: node_id for node, node_id in zip(phase_nodes, node_ids)}
+        edges = [
+            replace(
+                edge,
+                source=remap.get(edge.source, edge.source),
+                target=remap.get(edge.target, edge.target),
+            )
+            if edge.source in remap or edge.target in remap
+            else edge
+            for edge in edges
+        ]
+        self.conn.execute("BEGIN TRANSACTION;")
+        try:
+            if passage_nodes:
+                self._merge_passage_nodes(passage_nodes)
+            if new_nodes:
+                self._merge_phase_nodes(list(new_nodes.values()))
+            # Kuzu 中 UNWIND 后按主键 MATCH 两个端点会退化为哈希连接，逐条写入反而更快
+            for edge in edges:
+                if isinstance(edge, PassageEdge):
+                    self._write_passage_edge(edge)
+                else:
+                    self._write_phase_edge(edge)
+            self.conn.execute("COMMIT;")
+        except Exception:
+            self.conn.execute("ROLLBACK;")
+            raise
+
+        for key, node in new_nodes.items():
+            self._name_index[key] = node.id
+        for edge in edges:
+            self._index_edge(edge)
+        return remap
+
+    def _write_passage_edge(self, edge: PassageEdge):
         query = """
             MATCH (a:PhaseNode), (b:PassageNode)
             WHERE a.id = $source AND b.id = $target
@@ -65,12 +288,7 @@ class KuzuGraphStore(GraphStore):
         }
         self.conn.execute(query, params)
 
-    def add_phase_edge(self, edge: PhaseEdge) -> None:
-        """添加概念关系边(实体关系边)
-
-        Args:
-            edge (PhaseEdge): 概念关系边(实体关系边)对象
-        """
+    def _write_phase_edge(self, edge: PhaseEdge):
         query = """
             MATCH (a:PhaseNode), (b:PhaseNode)
             WHERE a.id = $source AND b.id = $target
@@ -86,18 +304,33 @@ class KuzuGraphStore(GraphStore):
         }
         self.conn.execute(query, params)
 
-    def find_phase_node_by_name(self, name: str) -> str | None:
-        """根据名称查找概念节点(实体节点)
+    def _index_edge(self, edge: PassageEdge | PhaseEdge):
+        """将已写入数据库的边同步到 fact_id 索引和已加载的 PPR 图"""
+        graph = self._ppr_graphs.get(edge.user_id)
+        if isinstance(edge, PassageEdge):
+            if graph:
+                graph.add_edge(
+                    edge.source,
+                    edge.target,
+                    key=(edge.source, edge.target, edge.summary_id),
+                )
+            return
+        if edge.fact_id is not None:
+            pairs = self._fact_index.setdefault(edge.fact_id, [])
+            # 与 MERGE 一样，相同的边不重复记录
+            if (edge.source, edge.target) not in pairs:
+                pairs.append((edge.source, edge.target))
+        if graph:
+            graph.add_edge(edge.source, edge.target, fact_id=edge.fact_id)
+
+    def find_phase_node_by_name(self, name: str, user_id: str = None) -> str | None:
+        """根据名称查找用户的概念节点(实体节点)，只查询内存中的名称索引
 
         Args:
             name (str): 概念节点(实体节点)名称
+            user_id (str): 用户 ID
         """
-        query = "MATCH (n:PhaseNode) WHERE n.name = $name RETURN n.id;"
-        params = {"name": name}
-        result = self.conn.execute(query, params)
-        if result.has_next():
-            return result.get_next()[0]
-        return None
+        return self._name_index.get((user_id, name))
 
     def _build_where_clause(
         self, filter: dict, node_alias: str = "n"
@@ -147,11 +380,11 @@ class KuzuGraphStore(GraphStore):
             Iterable[PhaseNode]: 概念节点(实体节点)的迭代器
         """
         where_clause, params = self._build_where_clause(filter)
-        query = f"MATCH (n:PhaseNode) {where_clause} RETURN n.id, n.ts, n.name, n.type;"
+        query = f"MATCH (n:PhaseNode) {where_clause} RETURN n.id, n.ts, n.name, n.type, n.user_id;"
         result = self.conn.execute(query, params)
         while result.has_next():
-            id_val, ts, name, type_val = result.get_next()
-            yield PhaseNode(id=id_val, ts=ts, name=name, type=type_val)
+            id_val, ts, name, type_val, user_id = result.get_next()
+            yield PhaseNode(id=id_val, ts=ts, name=name, type=type_val, user_id=user_id)
 
     def get_passage_edges(self, filter: dict = {}) -> Iterable[PassageEdge]:
         """根据过滤器获取记忆关联边(段落关联边)
@@ -215,20 +448,40 @@ class KuzuGraphStore(GraphStore):
         Returns:
             Iterable[tuple[PhaseNode, PhaseNode]]: 概念节点(实体节点)元组的迭代器, 其中每对概念节点都由这个概念 id 对应的概念关联起来
         """
-        query = """
-            MATCH (a:PhaseNode)-[e:PhaseEdge]->(b:PhaseNode)
-            WHERE e.fact_id = $fact_id
-            RETURN a, b;
+        yield from self.get_phase_nodes_by_fact_ids([fact_id]).get(fact_id, [])
+
+    def get_phase_nodes_by_fact_ids(
+        self, fact_ids: list[str]
+    ) -> dict[str, list[tuple[PhaseNode, PhaseNode]]]:
+        """批量获取多个概念关联的概念节点(实体节点)
+
+        边的端点从 fact_id 索引中得到，之后只按节点 ID 查询一次数据库。
+
+        Args:
+            fact_ids (list[str]): 概念 id 列表
+        Returns:
+            dict[str, list[tuple[PhaseNode, PhaseNode]]]: 概念 id -> 由该概念关联的概念节点对。没有边的概念不在结果中
         """
-        params = {"fact_id": fact_id}
-        result = self.conn.execute(query, params)
+        pairs = {
+            fact_id: self._fact_index[fact_id]
+            for fact_id in fact_ids
+            if self._fact_index.get(fact_id)
+        }
+        node_ids = {node_id for pair in pairs.values() for edge in pair for node_id in edge}
+        if not node_ids:
+            return {}
+        nodes = {}
+        query = "MATCH (n:PhaseNode) WHERE n.id IN $ids RETURN n.id, n.ts, n.name, n.type, n.user_id;"
+        result = self.conn.execute(query, {"ids": list(node_ids)})
         while result.has_next():
-            a, b = result.get_next()
-            a.pop("_id")
-            a.pop("_label")
-            b.pop("_id")
-            b.pop("_label")
-            yield (PhaseNode(**a), PhaseNode(**b))
+            id_val, ts, name, type_val, user_id = result.get_next()
+            nodes[id_val] = PhaseNode(
+                id=id_val, ts=ts, name=name, type=type_val, user_id=user_id
+            )
+        return {
+            fact_id: [(nodes[source], nodes[target]) for source, target in edges]
+            for fact_id, edges in pairs.items()
+        }
 
     def delete_phase_edge_by_fact_id(self, fact_id: str):
         """根据概念 id 删除概念关系边(实体关系边)
@@ -238,11 +491,18 @@ class KuzuGraphStore(GraphStore):
         """
         query = """
             MATCH (a:PhaseNode)-[e:PhaseEdge]->(b:PhaseNode)
-            WHERE e.fact_id = $fact_id
+            WHERE a.id = $source AND b.id = $target AND e.fact_id = $fact_id
             DELETE e;
         """
-        params = {"fact_id": fact_id}
-        self.conn.execute(query, params)
+        with self._lock:
+            # 通过 fact_id 索引定位到边的端点，只访问源节点的出边
+            for source, target in self._fact_index.get(fact_id, []):
+                params = {"source": source, "target": target, "fact_id": fact_id}
+                self.conn.execute(query, params)
+            self._fact_index.pop(fact_id, None)
+            for graph in self._ppr_graphs.values():
+                if graph.remove_fact(fact_id):
+                    break
 
     def cnt_phase_node_edges(self, node_id: str) -> int:
         """统计概念节点(实体节点)的边数
@@ -252,16 +512,30 @@ class KuzuGraphStore(GraphStore):
         Returns:
             int: 概念节点(实体节点)的边数
         """
+        return self.phase_node_degrees([node_id])[node_id]
+
+    def phase_node_degrees(self, node_ids: list[str]) -> dict[str, int]:
+        """批量统计概念节点(实体节点)的边数，只查询一次数据库
+
+        Args:
+            node_ids (list[str]): 概念节点(实体节点) id 列表
+        Returns:
+            dict[str, int]: 节点 id -> 出边与入边的总数，自环只计一次
+        """
+        ret = {node_id: 0 for node_id in node_ids}
+        if not ret:
+            return ret
         query = """
-            MATCH (a:PhaseNode)-[e:PhaseEdge]->(b:PhaseNode)
-            WHERE a.id = $node_id OR b.id = $node_id
-            RETURN COUNT(e);
+            MATCH (a:PhaseNode)-[e:PhaseEdge]-(b:PhaseNode)
+            WHERE a.id IN $node_ids
+            RETURN a.id, COUNT(DISTINCT e);
         """
-        params = {"node_id": node_id}
+        params = {"node_ids": list(ret)}
         result = self.conn.execute(query, params)
-        if result.has_next():
-            return result.get_next()[0]
-        return 0
+        while result.has_next():
+            node_id, cnt = result.get_next()
+            ret[node_id] = cnt
+        return ret
 
     def save(self, path: str) -> None:
         # Kuzu automatically persists to disk; left for interface compatibility
@@ -278,44 +552,102 @@ class KuzuGraphStore(GraphStore):
         damping_factor=0.5,
         max_iter=100,
         tol=0.000001,
+        method="exact",
+        epsilon=1e-4,
+        max_pushes=10000,
     ):
         """运行 PPR 算法
 
+        exact: 每个用户的图以 CSR 稀疏矩阵缓存在内存中，首次查询时从数据库加载，之后随边的增删增量更新。
+        push: 前向推送近似，只读取种子节点附近的邻接表。用户的图已缓存时从缓存读取，否则按需查询数据库。
+
         Args:
             personalization (dict): 节点的个性化分数，键为节点 ID，值为分数
             user_id (str): 用户 ID
             damping_factor (float): 阻尼因子，通常设置为 0.5
             max_iter (int): 最大迭代次数
             tol (float): 收敛容忍度，表示当 PageRank 分数的变化小于该值时停止迭代
+            method (str): exact 或 push
+            epsilon (float): push 模式下节点的残差不超过 epsilon * 出度时不再推送
+            max_pushes (int): push 模式下推送次数的上限
+        Returns:
+            dict[str, float]: 节点 ID -> PPR 分数，按分数降序排列
+        Raises:
+            ValueError: 如果 method 不支持
         """
-        query = """
-        MATCH (u) -[e]-> (v)
-        WHERE e.user_id = $user_id
-        RETURN u, e, v;
-        """
-        params = {"user_id": user_id}
-        result = self.conn.execute(query, params)
-        G = result.get_as_networkx()
-        nodes = list(G.nodes(data=True))
-        new_personalization = {}
-        for node_id, data in nodes:
-            id = data.get("id")
-            new_personalization[node_id] = personalization.get(id, 0.0)
-        # print("Graph Metadata:", G.nodes(data=True), G.edges(data=True))
-        # print("Personalization:", new_personalization)
-        ranked_scores: dict[str, float] = nx.pagerank(
-            G,
-            alpha=damping_factor,
-            personalization=new_personalization,
+        if method not in PPR_METHODS:
+            raise ValueError(f"不支持的 PPR 方法: {method}, 可选: {PPR_METHODS}")
+        # 只在获取快照时持有锁，幂迭代和推送在锁外进行，多个查询可以并发计算，写入也不必等待
+        # 在锁内加载，避免加载期间提交的边既不在查询结果中、也没有同步到图上
+        with self._lock:
+            graph = self._ppr_graphs.get(user_id)
+            if graph is None and method == "exact":
+                graph = self._load_ppr_graph(user_id)
+                self._ppr_graphs[user_id] = graph
+            snapshot = graph.snapshot() if graph is not None else None
+        if method == "push":
+            if snapshot is not None:
+                out_neighbors = snapshot.out_neighbors
+            else:
+                out_neighbors = lambda ids: self._fetch_out_neighbors(user_id, ids)  # noqa: E731
+            return push_ppr(
+                personalization,
+                out_neighbors,
+                damping_factor=damping_factor,
+                epsilon=epsilon,
+                max_pushes=max_pushes,
+            )
+        return snapshot.run(
+            personalization,
+            damping_factor=damping_factor,
             max_iter=max_iter,
             tol=tol,
         )
-        # ranked_scores = dict
-        m = {}
-        for k, v in ranked_scores.items():
-            m[G.nodes[k]["id"]] = v
-        m = dict(sorted(m.items(), key=lambda item: item[1], reverse=True))
-        return m
+
+    def _fetch_out_neighbors(
+        self, user_id: str, node_ids: list[str]
+    ) -> dict[str, list[str]]:
+        """从数据库中批量读取用户的边中节点的出边目标"""
+        ret = {node_id: [] for node_id in node_ids}
+        result = self.conn.execute(
+            """
+            MATCH (a:PhaseNode)-[e]->(b)
+            WHERE a.id IN $ids AND e.user_id = $user_id
+            RETURN a.id, b.id;
+            """,
+            {"ids": node_ids, "user_id": user_id},
+        )
+        while result.has_next():
+            source, target = result.get_next()
+            ret[source].append(target)
+        return ret
+
+    def _load_ppr_graph(self, user_id: str) -> PPRGraph:
+        """从数据库中读取用户的全部边，构建 PPR 图"""
+        graph = PPRGraph()
+        result = self.conn.execute(
+            """
+            MATCH (a:PhaseNode)-[e:PhaseEdge]->(b:PhaseNode)
+            WHERE e.user_id = $user_id
+            RETURN a.id, b.id, e.fact_id;
+            """,
+            {"user_id": user_id},
+        )
+        while result.has_next():
+            source, target, fact_id = result.get_next()
+            graph.add_edge(source, target, fact_id=fact_id)
+        result = self.conn.execute(
+            """
+            MATCH (a:PhaseNode)-[e:PassageEdge]->(b:PassageNode)
+            WHERE e.user_id = $user_id
+            RETURN a.id, b.id, e.summary_id;
+            """,
+            {"user_id": user_id},
+        )
+        while result.has_next():
+            source, target, summary_id = result.get_next()
+            graph.add_edge(source, target, key=(source, target, summary_id))
+        return graph
 
     def get_graph_networkx(self, filter: dict = {}) -> GraphResult:
         """获取图结构, 可以根据过滤器获取
@@ -0,0 +1,289 @@
+import numpy as np
+import scipy.sparse as sp
+from typing import Callable
+from loguru import logger
+
+PPR_METHODS = ("exact", "push")
+"""exact 为在整张图上幂迭代；push 为只访问种子节点附近的前向推送近似"""
+
+
+class PPRGraph:
+    """单个用户的有向多重图，以 CSR 邻接矩阵保存，用于 Personalized PageRank
+
+    计算结果与在同一张图上调用 nx.pagerank 一致: 平行边按条数加权，没有出边的节点的分数按个性化分布重新分配。
+    写入不会立即修改矩阵，而是先记录为增量，下一次查询时一次性合并进 CSR 矩阵。
+    """
+
+    def __init__(self):
+        self.node_index: dict[str, int] = {}
+        """节点 ID -> 矩阵行号"""
+        self.node_ids: list[str] = []
+        """矩阵行号 -> 节点 ID"""
+        self._matrix = sp.csr_matrix((0, 0), dtype=np.float64)
+        self._pending_rows: list[int] = []
+        self._pending_cols: list[int] = []
+        self._pending_data: list[float] = []
+        self._fact_edges: dict[str, list[tuple[int, int]]] = {}
+        """fact_id -> 该概念对应的边"""
+        self._edge_keys: set[tuple] = set()
+        """已经存在的段落关联边，与 Kuzu 的 MERGE 一样不重复添加"""
+        self._transition = None
+
+    @property
+    def num_edges(self) -> int:
+        return int(self._flush().sum())
+
+    def add_edge(self, source: str, target: str, fact_id: str = None, key: tuple = None):
+        """添加一条边
+
+        Args:
+            source (str): 源节点 ID
+            target (str): 目标节点 ID
+            fact_id (str): 概念关系边的概念 ID，用于之后按概念删除
+            key (tuple): 边的唯一标识，已存在相同标识的边时忽略
+        """
+        if key is not None:
+            if key in self._edge_keys:
+                return
+            self._edge_keys.add(key)
+        edge = (self._node(source), self._node(target))
+        if fact_id is not None:
+            self._fact_edges.setdefault(fact_id, []).append(edge)
+        self._update(*edge, 1.0)
+
+    def remove_fact(self, fact_id: str) -> bool:
+        """删除一个概念对应的全部边
+
+        Returns:
+            bool: 图中是否有该概念的边
+        """
+        edges = self._fact_edges.pop(fact_id, None)
+        if edges is None:
+            return False
+        for edge in edges:
+            self._update(*edge, -1.0)
+        return True
+
+    def run(
+        self,
+        personalization: dict[str, float] | None,
+        damping_factor: float = 0.5,
+        max_iter: int = 100,
+        tol: float = 1e-6,
+    ) -> dict[str, float]:
+        """运行幂迭代，参数与返回值见 PPRSnapshot.run"""
+        return self.snapshot().run(personalization, damping_factor, max_iter, tol)
+
+    def out_neighbors(self, node_ids: list[str]) -> dict[str, list[str]]:
+        """批量读取节点的出边目标，平行边重复出现"""
+        return self.snapshot().out_neighbors(node_ids)
+
+    def snapshot(self) -> "PPRSnapshot":
+        """合并增量并返回当前图的只读视图
+
+        视图只引用不再被修改的矩阵，之后对图的写入不影响它，
+        因此调用方只需要在获取视图时与写入互斥，计算可以在锁外并发进行。
+        """
+        transition, dangling, active = self._get_transition()
+        return PPRSnapshot(
+            self._flush(), transition, dangling, active, self.node_index, self.node_ids
+        )
+
+    def _node(self, node_id: str) -> int:
+        row = self.node_index.get(node_id)
+        if row is None:
+            row = len(self.node_ids)
+            self.node_index[node_id] = row
+            self.node_ids.append(node_id)
+        return row
+
+    def _update(self, row: int, col: int, weight: float):
+        self._pending_rows.append(row)
+        self._pending_cols.append(col)
+        self._pending_data.append(weight)
+        self._transition = None
+
+    def _flush(self) -> sp.csr_matrix:
+        """将增量合并进邻接矩阵"""
+        n = len(self.node_ids)
+        if self._matrix.shape != (n, n):
+            # 不原地 resize，已经交给快照的矩阵保持不变
+            matrix = self._matrix
+            indptr = np.concatenate(
+                [matrix.indptr, np.full(n - matrix.shape[0], matrix.indptr[-1])]
+            )
+            self._matrix = sp.csr_matrix(
+                (matrix.data, matrix.indices, indptr), shape=(n, n)
+            )
+        if self._pending_data:
+            delta = sp.csr_matrix(
+                (self._pending_data, (self._pending_rows, self._pending_cols)),
+                shape=(n, n),
+            )
+            self._matrix = (self._matrix + delta).tocsr()
+            self._matrix.eliminate_zeros()
+            self._pending_rows, self._pending_cols, self._pending_data = [], [], []
+        return self._matrix
+
+    def _get_transition(self) -> tuple[sp.csr_matrix, np.ndarray, np.ndarray]:
+        """转置后的转移矩阵、没有出边的节点、至少有一条边的节点"""
+        if self._transition is None:
+            matrix = self._flush()
+            out_degree = np.asarray(matrix.sum(axis=1)).ravel()
+            in_degree = np.asarray(matrix.sum(axis=0)).ravel()
+            dangling = out_degree == 0
+            inv = np.divide(
+                1.0, out_degree, out=np.zeros_like(out_degree), where=~dangling
+            )
+            transition = (sp.diags(inv) @ matrix).T.tocsr()
+            self._transition = (transition, dangling, (out_degree + in_degree) > 0)
+        return self._transition
+
+
+class PPRSnapshot:
+    """PPRGraph 在某一时刻的只读视图"""
+
+    def __init__(
+        self,
+        matrix: sp.csr_matrix,
+        transition: sp.csr_matrix,
+        dangling: np.ndarray,
+        active: np.ndarray,
+        node_index: dict[str, int],
+        node_ids: list[str],
+    ):
+        self.matrix = matrix
+        self.transition = transition
+        self.dangling = dangling
+        self.active = active
+        # 图之后新增的节点只会追加到 node_index / node_ids 中，行号不小于 n 的节点不属于这个视图
+        self.n = matrix.shape[0]
+        self.node_index = node_index
+        self.node_ids = node_ids
+
+    def _row(self, node_id: str) -> int | None:
+        row = self.node_index.get(node_id)
+        if row is None or row >= self.n:
+            return None
+        return row
+
+    def run(
+        self,
+        personalization: dict[str, float] | None,
+        damping_factor: float = 0.5,
+        max_iter: int = 100,
+        tol: float = 1e-6,
+    ) -> dict[str, float]:
+        """运行幂迭代
+
+        Args:
+            personalization (dict[str, float]): 节点 ID -> 个性化分数。为空或全部为 0 时使用均匀分布
+            damping_factor (float): 阻尼因子
+            max_iter (int): 最大迭代次数
+            tol (float): 收敛容忍度
+        Returns:
+            dict[str, float]: 节点 ID -> PPR 分数，按分数降序排列。只包含至少有一条边的节点
+        """
+        transition, dangling, active = self.transition, self.dangling, self.active
+        n = int(active.sum())
+        if n == 0:
+            return {}
+        p = np.zeros(self.n)
+        for node_id, score in (personalization or {}).items():
+            row = self._row(node_id)
+            if row is not None and active[row]:
+                p[row] = score
+        if p.sum() == 0:
+            p[active] = 1.0
+        p /= p.sum()
+
+        x = np.where(active, 1.0 / n, 0.0)
+        for _ in range(max_iter):
+            x_last = x
+            x = damping_factor * (transition @ x_last + x_last[dangling].sum() * p) + (
+                1 - damping_factor
+            ) * p
+            if np.abs(x - x_last).sum() < n * tol:
+                break
+        else:
+            logger.warning(f"PPR did not converge in {max_iter} iterations")
+
+        rows = np.flatnonzero(active)
+        order = rows[np.argsort(-x[rows], kind="stable")]
+        return {self.node_ids[row]: float(x[row]) for row in order}
+
+    def out_neighbors(self, node_ids: list[str]) -> dict[str, list[str]]:
+        """批量读取节点的出边目标，平行边重复出现"""
+        matrix = self.matrix
+        ret = {}
+        for node_id in node_ids:
+            row = self._row(node_id)
+            if row is None:
+                ret[node_id] = []
+                continue
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            cols = np.repeat(matrix.indices[start:end], matrix.data[start:end].astype(int))
+            ret[node_id] = [self.node_ids[col] for col in cols]
+        return ret
+
+
+def push_ppr(
+    personalization: dict[str, float] | None,
+    out_neighbors: Callable[[list[str]], dict[str, list[str]]],
+    damping_factor: float = 0.5,
+    epsilon: float = 1e-4,
+    max_pushes: int = 10000,
+) -> dict[str, float]:
+    """以前向推送(Andersen-Chung-Lang)近似计算 PPR，只访问残差足够大的节点及其邻居
+
+    与 PPRGraph.run 的语义一致，没有出边的节点的残差按个性化分布回到种子节点。
+    每一轮把所有需要推送的节点的邻接表一次性读出，读取次数与推送的轮数而不是节点数相关。
+
+    Args:
+        personalization (dict[str, float]): 种子节点 ID -> 个性化分数
+        out_neighbors (Callable): 批量读取节点的出边目标，平行边重复出现
+        damping_factor (float): 阻尼因子
+        epsilon (float): 节点的残差不超过 epsilon * 出度时不再推送，越小越精确
+        max_pushes (int): 推送次数的上限，达到后返回当前的估计
+    Returns:
+        dict[str, float]: 节点 ID -> 近似的 PPR 分数，按分数降序排列。只包含被推送过的节点
+    """
+    # 种子分数来自 FAISS 的相似度(np.float32)，转换为 float 使结果与 exact 模式一样可以序列化为 JSON
+    seeds = {k: float(v) for k, v in (personalization or {}).items() if v > 0}
+    total = sum(seeds.values())
+    if not total:
+        return {}
+    seeds = {k: v / total for k, v in seeds.items()}
+
+    estimate: dict[str, float] = {}
+    residual: dict[str, float] = dict(seeds)
+    adjacency: dict[str, list[str]] = {}
+    pushes = 0
+    while pushes < max_pushes:
+        # 出度至少为 1，残差不超过 epsilon 的节点一定不需要推送，不必读取邻接表
+        unknown = [u for u, r in residual.items() if r > epsilon and u not in adjacency]
+        if unknown:
+            adjacency.update(out_neighbors(unknown))
+        active = [
+            u
+            for u, r in residual.items()
+            if r > epsilon * max(len(adjacency.get(u, ())), 1)
+        ]
+        if not active:
+            break
+        for u in active:
+            r = residual.pop(u, 0.0)
+            estimate[u] = estimate.get(u, 0.0) + (1 - damping_factor) * r
+            targets = adjacency.get(u)
+            if targets:
+                share = damping_factor * r / len(targets)
+                for v in targets:
+                    residual[v] = residual.get(v, 0.0) + share
+            else:
+                for v, weight in seeds.items():
+                    residual[v] = residual.get(v, 0.0) + damping_factor * r * weight
+            pushes += 1
+            if pushes >= max_pushes:
+                logger.debug(f"Push PPR stopped at work budget {max_pushes}")
+                break
+    return dict(sorted(estimate.items(), key=lambda item: item[1], reverse=True))
@@ -0,0 +1,68 @@
+import numpy as np
+
+
+class MetadataIdIndex:
+    """metadata 取值到文档 ID 集合的内存索引。
+
+    用于把 user_id / group_id 等高频过滤条件直接转换为 FAISS 的候选 ID 集合，
+    使每个租户都能拿到精确的 top-k，而不是在全局 top-k 中再做过滤。
+    """
+
+    def __init__(self, keys: tuple[str, ...] = ("user_id", "group_id")) -> None:
+        """
+        Args:
+            keys (tuple[str, ...]): 需要建立索引的 metadata 键
+        """
+        self.keys = tuple(keys)
+        self._postings: dict[str, dict[object, set[int]]] = {k: {} for k in self.keys}
+        self._doc_values: dict[int, tuple] = {}
+
+    def add(self, id: int, metadata: dict):
+        """登记一个文档的 metadata
+
+        Args:
+            id (int): 文档 ID(主键, 而不是 doc_id)
+            metadata (dict): 文档的 metadata
+        """
+        values = tuple(metadata.get(key) for key in self.keys)
+        self._doc_values[id] = values
+        for key, val in zip(self.keys, values):
+            if val is not None:
+                self._postings[key].setdefault(val, set()).add(id)
+
+    def remove(self, id: int):
+        """移除一个文档"""
+        values = self._doc_values.pop(id, None)
+        if values is None:
+            return
+        for key, val in zip(self.keys, values):
+            ids = self._postings[key].get(val)
+            if ids is None:
+                continue
+            ids.discard(id)
+            if not ids:
+                del self._postings[key][val]
+
+    def can_resolve(self, filters: dict) -> bool:
+        """过滤条件是否全部由索引覆盖"""
+        return bool(filters) and all(key in self._postings for key in filters)
+
+    def lookup(self, filters: dict) -> np.ndarray | None:
+        """根据过滤条件获取候选文档 ID
+
+        Args:
+            filters (dict): metadata 过滤条件，各条件之间为 AND 关系
+        Returns:
+            np.ndarray | None: 满足条件的 ID。存在索引未覆盖的键时返回 None
+        """
+        if not self.can_resolve(filters):
+            return None
+        # 从最小的集合开始求交集
+        id_sets = sorted(
+            (self._postings[key].get(val, set()) for key, val in filters.items()),
+            key=len,
+        )
+        result = set(id_sets[0])
+        for ids in id_sets[1:]:
+            result &= ids
+        return np.fromiter(result, dtype="int64", count=len(result))
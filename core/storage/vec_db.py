@@ -1,17 +1,60 @@
+import asyncio
+import math
 import uuid
 import json
 import numpy as np
+from .documents.document import Document
 from .documents.document_storage import DocumentStorage
 from .embedding.embedding_storage import EmbeddingStorage
+from .metadata_index import MetadataIdIndex
 from ..provider.embedding import EmbeddingProvider
+from collections import OrderedDict
 from dataclasses import dataclass
 from loguru import logger
 
 
-@dataclass
+RETRIEVAL_MODES = ("vector", "bm25", "hybrid")
+MIN_SELECTIVITY = 1e-3
+"""估计 fetch_k 时选择率的下限"""
+
+
+@dataclass(slots=True)
 class Result:
     similarity: float
-    data: dict
+    data: Document
+
+
+@dataclass
+class FilterStats:
+    """某个过滤条件(通常对应一个租户)在检索后过滤路径上的统计"""
+
+    queries: int = 0
+    expansions: int = 0
+    """扩大 fetch_k 重新检索的总次数"""
+    fetched: int = 0
+    """每次检索最终使用的 fetch_k 之和"""
+    results: int = 0
+    """返回的结果总数"""
+    selectivity: float | None = None
+    """FAISS 候选中满足过滤条件的比例的指数滑动平均"""
+
+    def observe(self, matched: int, fetched: int, alpha: float = 0.2):
+        if fetched == 0:
+            return
+        ratio = matched / fetched
+        if self.selectivity is None:
+            self.selectivity = ratio
+        else:
+            self.selectivity = alpha * ratio + (1 - alpha) * self.selectivity
+
+    def estimate_fetch_k(self, k: int, fetch_k: int) -> int:
+        """根据选择率估计拿到 k 条结果需要的候选数量，没有估计时返回默认值
+
+        选择率为 0 时按 MIN_SELECTIVITY 估计，没有匹配的过滤条件直接从上限开始，不再每次逐步扩大
+        """
+        if self.selectivity is None:
+            return fetch_k
+        return max(fetch_k, math.ceil(k / max(self.selectivity, MIN_SELECTIVITY)))
 
 
 def uuid_to_int(uuid_str: str) -> int:
@@ -31,10 +74,55 @@ class VecDB:
         document_storage: DocumentStorage,
         embedding_storage: EmbeddingStorage,
         embedding_provider: EmbeddingProvider,
+        indexed_filter_keys: tuple[str, ...] = ("user_id", "group_id"),
+        max_fetch_k: int = 2000,
+        fetch_k_growth: float = 4.0,
+        rrf_k: int = 60,
+        lexical_short_circuit: bool = True,
+        max_filter_stats: int = 1024,
     ):
+        """
+        Args:
+            indexed_filter_keys (tuple[str, ...]): 在内存中维护 ID 集合的 metadata 键，
+                只包含这些键的过滤条件会直接下推到 FAISS
+            max_fetch_k (int): 过滤条件无法下推时，逐步扩大候选数量的上限
+            fetch_k_growth (float): 过滤后不足 k 条时候选数量的扩大倍数
+            rrf_k (int): hybrid 模式中倒数排名融合(RRF)的平滑常数
+            lexical_short_circuit (bool): hybrid 模式中全文检索的前 k 条都包含完整的查询时，
+                直接返回全文检索的结果，不再计算查询的嵌入
+            max_filter_stats (int): 最多保留多少个过滤条件的统计，超出时淘汰最久未使用的
+        """
         self.document_storage = document_storage
         self.embedding_storage = embedding_storage
         self.embedding_provider = embedding_provider
+        self.metadata_index = MetadataIdIndex(indexed_filter_keys)
+        self._metadata_index_loaded = False
+        self._metadata_index_lock = asyncio.Lock()
+        self.max_fetch_k = max_fetch_k
+        self.fetch_k_growth = fetch_k_growth
+        self.filter_stats: OrderedDict[str, FilterStats] = OrderedDict()
+        """过滤条件 -> 检索后过滤的统计，键为过滤条件的 JSON，按最近使用排序"""
+        self.max_filter_stats = max_filter_stats
+        self.rrf_k = rrf_k
+        self.lexical_short_circuit = lexical_short_circuit
+
+    async def initialize(self):
+        """从 SQLite 构建 metadata 索引，避免首次带过滤条件的检索承担加载开销"""
+        await self._ensure_metadata_index()
+
+    async def _ensure_metadata_index(self):
+        """从 SQLite 加载 metadata 索引，未调用 initialize 时在首次使用时加载"""
+        if self._metadata_index_loaded:
+            return
+        async with self._metadata_index_lock:
+            if self._metadata_index_loaded:
+                return
+            keys = self.metadata_index.keys
+            for row in await self.document_storage.get_metadata_values(list(keys)):
+                self.metadata_index.add(
+                    row[0], {k: v for k, v in zip(keys, row[1:]) if v is not None}
+                )
+            self._metadata_index_loaded = True
 
     async def insert(
         self,
@@ -45,27 +133,58 @@ class VecDB:
         """
         插入一条文本和其对应向量，自动生成 ID 并保持一致性。
         """
-        metadata = metadata or {}
-        str_id = id or str(uuid.uuid4())  # 使用 UUID 作为原始 ID
+        return (await self.insert_many([content], [metadata], [id]))[0]
+
+    async def insert_many(
+        self,
+        contents: list[str],
+        metadatas: list[dict] = None,
+        ids: list[str] = None,
+    ) -> list[int]:
+        """
+        批量插入文本和其对应向量。文本在一个事务中写入，向量一次性写入 FAISS。
+
+        Args:
+            contents (list[str]): 文本
+            metadatas (list[dict]): 与 contents 一一对应的元数据
+            ids (list[str]): 与 contents 一一对应的 doc_id，为 None 的项自动生成
+        Returns:
+            list[int]: 与 contents 一一对应的整数 ID
+        Raises:
+            ValueError: 如果 metadatas 或 ids 的长度与 contents 不一致
+        """
+        metadatas = metadatas or [None] * len(contents)
+        ids = ids or [None] * len(contents)
+        if len(metadatas) != len(contents) or len(ids) != len(contents):
+            raise ValueError("metadatas 和 ids 的长度必须与 contents 一致")
+        if not contents:
+            return []
+        metadatas = [metadata or {} for metadata in metadatas]
+        # 使用 UUID 作为原始 ID
+        str_ids = [id or str(uuid.uuid4()) for id in ids]
 
         # 获取向量
-        vector = await self.embedding_provider.get_embedding(content)
-        vector = np.array(vector, dtype=np.float32)
-        async with self.document_storage.connection.cursor() as cursor:
-            await cursor.execute(
-                "INSERT INTO documents (doc_id, text, metadata) VALUES (?, ?, ?)",
-                (str_id, content, json.dumps(metadata)),
-            )
-            await self.document_storage.connection.commit()
-            result = await self.document_storage.get_document_by_doc_id(str_id)
-            int_id = result["id"]
+        embeddings = await self.embedding_provider.get_embeddings(contents)
+        vectors = np.array(embeddings, dtype=np.float32)
+        id_map = await self.document_storage.insert_documents(
+            str_ids, contents, [json.dumps(metadata) for metadata in metadatas]
+        )
+        int_ids = [id_map[str_id] for str_id in str_ids]
 
         # 插入向量到 FAISS
-        await self.embedding_storage.insert(vector, int_id)
-        return int_id
+        await self.embedding_storage.insert_many(vectors, np.array(int_ids))
+        await self._ensure_metadata_index()
+        for int_id, metadata in zip(int_ids, metadatas):
+            self.metadata_index.add(int_id, metadata)
+        return int_ids
 
     async def retrieve(
-        self, query: str, k: int = 5, fetch_k: int = 20, metadata_filters: dict = None
+        self,
+        query: str,
+        k: int = 5,
+        fetch_k: int = 20,
+        metadata_filters: dict = None,
+        mode: str = "vector",
     ) -> list[Result]:
         """
         搜索最相似的文档。
@@ -73,52 +192,205 @@ class VecDB:
         Args:
             query (str): 查询文本
             k (int): 返回的最相似文档的数量
-            fetch_k (int): 在根据 metadata 过滤前从 FAISS 中获取的数量
+            fetch_k (int): 过滤条件无法下推时，在根据 metadata 过滤前从 FAISS 中获取的初始数量。
+                过滤后不足 k 条时按 fetch_k_growth 倍扩大后重新检索，直到 max_fetch_k
             metadata_filters (dict): 元数据过滤器
+            mode (str): 检索方式。vector 为向量检索；bm25 为全文检索，不计算嵌入；
+                hybrid 以 RRF 融合两者的排名，此时 similarity 为融合后的分数
 
         Returns:
             List[Result]: 查询结果
+        Raises:
+            ValueError: 如果检索方式不支持
         """
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"不支持的检索方式: {mode}, 可选: {RETRIEVAL_MODES}")
+        if mode == "bm25":
+            lexical = await self.document_storage.search_fts(query, k, metadata_filters)
+            return self._lexical_results(lexical)
+        if mode == "hybrid":
+            return await self._retrieve_hybrid(query, k, fetch_k, metadata_filters)
         embedding = await self.embedding_provider.get_embedding(query)
-        scores, indices = await self.embedding_storage.search(
-            vector=np.array([embedding]).astype("float32"),
-            k=k if not metadata_filters else fetch_k,
+        vectors = np.array([embedding]).astype("float32")
+        results = await self._search(vectors, k, fetch_k, metadata_filters)
+        return results[0]
+
+    async def _retrieve_hybrid(
+        self, query: str, k: int, fetch_k: int, metadata_filters: dict
+    ) -> list[Result]:
+        candidates = max(k, fetch_k)
+        lexical = await self.document_storage.search_fts(
+            query, candidates, metadata_filters
         )
-        # TODO: rerank
-        if len(indices[0]) == 0 or indices[0][0] == -1:
+        if self.lexical_short_circuit and self._lexically_confident(query, lexical, k):
+            logger.debug(f"Lexical short circuit for query: {query}")
+            return self._lexical_results(lexical[:k])
+        embedding = await self.embedding_provider.get_embedding(query)
+        vectors = np.array([embedding]).astype("float32")
+        semantic = (await self._search(vectors, candidates, fetch_k, metadata_filters))[0]
+
+        # 倒数排名融合
+        fused: dict[int, float] = {}
+        docs: dict[int, Document] = {}
+        ranked_lists = ([doc for doc, _ in lexical], [r.data for r in semantic])
+        for ranked in ranked_lists:
+            for rank, doc in enumerate(ranked):
+                fused[doc.id] = fused.get(doc.id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+                docs[doc.id] = doc
+        order = sorted(fused, key=fused.get, reverse=True)[:k]
+        return [Result(similarity=fused[id], data=docs[id]) for id in order]
+
+    def _lexically_confident(
+        self, query: str, lexical: list[tuple[Document, float]], k: int
+    ) -> bool:
+        """全文检索的前 k 条都包含完整的查询时，认为查询是精确的名称，向量检索不会带来更好的结果"""
+        needle = query.strip().lower()
+        return (
+            bool(needle)
+            and len(lexical) >= k
+            and all(needle in doc.text.lower() for doc, _ in lexical[:k])
+        )
+
+    def _lexical_results(self, lexical: list[tuple[Document, float]]) -> list[Result]:
+        # bm25 分数越小越相关，转换为 [0, 1) 内越大越相关的相似度
+        return [
+            Result(similarity=-score / (1 - score), data=doc) for doc, score in lexical
+        ]
+
+    async def retrieve_many(
+        self,
+        queries: list[str],
+        k: int = 5,
+        fetch_k: int = 20,
+        metadata_filters: dict = None,
+    ) -> list[list[Result]]:
+        """
+        批量搜索多条查询，嵌入、FAISS 查询与文档读取各只进行一次。
+
+        Args:
+            queries (list[str]): 查询文本
+            k (int): 每条查询返回的最相似文档的数量
+            fetch_k (int): 过滤条件无法下推时，在根据 metadata 过滤前从 FAISS 中获取的初始数量。
+                过滤后不足 k 条时按 fetch_k_growth 倍扩大后重新检索，直到 max_fetch_k
+            metadata_filters (dict): 元数据过滤器，作用于所有查询
+
+        Returns:
+            list[list[Result]]: 与 queries 一一对应的查询结果
+        """
+        if not queries:
             return []
+        embeddings = await self.embedding_provider.get_embeddings(queries)
+        vectors = np.array(embeddings).astype("float32")
+        return await self._search(vectors, k, fetch_k, metadata_filters)
+
+    async def _search(
+        self, vectors: np.ndarray, k: int, fetch_k: int, metadata_filters: dict
+    ) -> list[list[Result]]:
+        """以查询向量矩阵搜索，返回每一行对应的结果"""
+        candidate_ids = None
+        if metadata_filters:
+            await self._ensure_metadata_index()
+            candidate_ids = self.metadata_index.lookup(metadata_filters)
+            if candidate_ids is None:
+                return await self._search_post_filter(
+                    vectors, k, fetch_k, metadata_filters
+                )
+        if candidate_ids is not None:
+            # 过滤条件下推到 FAISS，直接得到该租户内的 top-k
+            if len(candidate_ids) == 0:
+                return [[] for _ in range(len(vectors))]
+            scores, indices = await self.embedding_storage.search(
+                vector=vectors, k=k, ids=candidate_ids
+            )
+        else:
+            scores, indices = await self.embedding_storage.search(vector=vectors, k=k)
+        return [r[:k] for r in await self._collect(scores, indices, metadata_filters)]
+
+    async def _search_post_filter(
+        self, vectors: np.ndarray, k: int, fetch_k: int, metadata_filters: dict
+    ) -> list[list[Result]]:
+        """先从 FAISS 取候选再按 metadata 过滤。不足 k 条的查询以更大的 fetch_k 重新检索"""
+        filter_key = json.dumps(metadata_filters, sort_keys=True, ensure_ascii=False)
+        stats = self._filter_stats(filter_key)
+        # 候选数量超过向量总数后再扩大也不会有新的结果
+        limit = max(min(self.max_fetch_k, self.embedding_storage.ntotal), 1)
+        fetch_k = min(stats.estimate_fetch_k(k, fetch_k), limit)
+        initial_fetch_k = fetch_k
+        results: list[list[Result]] = [[] for _ in range(len(vectors))]
+        pending = np.arange(len(vectors))
+        expansions = 0
+        while True:
+            scores, indices = await self.embedding_storage.search(
+                vector=vectors[pending], k=fetch_k
+            )
+            rows = await self._collect(scores, indices, metadata_filters)
+            stats.observe(sum(len(r) for r in rows), int((indices != -1).sum()))
+            for row, row_results in zip(pending, rows):
+                results[row] = row_results[:k]
+            pending = pending[[len(r) < k for r in rows]]
+            if len(pending) == 0 or fetch_k >= limit:
+                break
+            fetch_k = min(math.ceil(fetch_k * self.fetch_k_growth), limit)
+            expansions += 1
+        stats.queries += len(vectors)
+        stats.expansions += expansions
+        stats.fetched += fetch_k * len(vectors)
+        stats.results += sum(len(r) for r in results)
+        if expansions:
+            logger.debug(
+                f"Post-filter retrieval of {filter_key} expanded {expansions} times: "
+                f"fetch_k {initial_fetch_k} -> {fetch_k}"
+            )
+        return results
+
+    def _filter_stats(self, filter_key: str) -> FilterStats:
+        """获取过滤条件的统计，超出数量上限时淘汰最久未使用的"""
+        stats = self.filter_stats.get(filter_key)
+        if stats is None:
+            stats = self.filter_stats[filter_key] = FilterStats()
+            while len(self.filter_stats) > self.max_filter_stats:
+                self.filter_stats.popitem(last=False)
+        else:
+            self.filter_stats.move_to_end(filter_key)
+        return stats
+
+    async def _collect(
+        self, scores: np.ndarray, indices: np.ndarray, metadata_filters: dict
+    ) -> list[list[Result]]:
+        """读取 FAISS 结果对应的文档，返回每一行满足过滤条件的全部结果"""
+        # TODO: rerank
+        hit_ids = np.unique(indices[indices != -1])
+        if len(hit_ids) == 0:
+            return [[] for _ in range(len(indices))]
         # normalize scores
         logger.debug(f"before similarity: {scores} indices: {indices}")
-        scores[0] = 1.0 - (scores[0] / 2.0)
+        scores = 1.0 - (scores / 2.0)
         logger.debug(f"retrieval from faiss: SIMILARITY {scores} INDICES {indices}")
-        # NOTE: maybe the size is less than k.
         fetched_docs = await self.document_storage.get_documents(
-            metadata_filters=metadata_filters or {}, ids=indices[0]
+            metadata_filters=metadata_filters or {}, ids=hit_ids.tolist()
         )
-        if not fetched_docs:
-            return []
-        result_docs = []
-
-        idx_pos = {}
-        for idx, fetch_doc in enumerate(fetched_docs):
-            idx_pos[fetch_doc["id"]] = idx
-        for i, indice_idx in enumerate(indices[0]):
-            pos = idx_pos.get(indice_idx)
-            if pos is None:
-                continue
-            fetch_doc = fetched_docs[pos]
-            score = scores[0][i]
-            result_docs.append(Result(similarity=score, data=fetch_doc))
-        return result_docs[:k]
-
-    async def delete(self, doc_id: int):
+        docs_by_id = {doc.id: doc for doc in fetched_docs}
+        results = []
+        for row_scores, row_indices in zip(scores, indices):
+            result_docs = []
+            for score, indice_idx in zip(row_scores, row_indices):
+                fetch_doc = docs_by_id.get(indice_idx)
+                if fetch_doc is None:
+                    continue
+                result_docs.append(Result(similarity=score, data=fetch_doc))
+            results.append(result_docs)
+        return results
+
+    async def delete(self, doc_id: str):
         """
-        删除一条文档
+        删除一条文档，同时删除其在 FAISS 中的向量
         """
-        await self.document_storage.connection.execute(
-            "DELETE FROM documents WHERE doc_id = ?", (doc_id,)
-        )
-        await self.document_storage.connection.commit()
+        ids = await self.document_storage.delete_documents_by_doc_id(doc_id)
+        if ids:
+            for id in ids:
+                self.metadata_index.remove(id)
+            await self.embedding_storage.delete(ids)
 
     async def close(self):
         await self.document_storage.close()
+        await self.embedding_storage.close()
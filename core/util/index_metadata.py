@@ -0,0 +1,43 @@
+"""为文档数据库中的 metadata 过滤键添加生成列和索引
+
+用法:
+    python -m core.util.index_metadata <path/to/mem_fact.db> --keys summary_id username
+
+运行中的插件也会为查询次数达到阈值的键在线建立索引，这里用于提前为已知的热点键建立索引。
+"""
+
+import argparse
+import asyncio
+import os
+from ..storage.documents.document_storage import DocumentStorage
+
+
+async def index_metadata(path: str, keys: list[str]) -> None:
+    """为 metadata 键建立索引
+
+    Args:
+        path (str): 数据库路径
+        keys (list[str]): metadata 键
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    storage = DocumentStorage(path, read_pool_size=0)
+    await storage.initialize()
+    try:
+        await storage.create_filter_columns(keys)
+        print(f"{path}: {storage.filter_planner.columns}")
+    finally:
+        await storage.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="为 metadata 过滤键添加生成列和索引")
+    parser.add_argument("paths", nargs="+", help="数据库文件路径")
+    parser.add_argument("--keys", nargs="+", required=True, help="metadata 键")
+    args = parser.parse_args()
+    for path in args.paths:
+        asyncio.run(index_metadata(path, args.keys))
+
+
+if __name__ == "__main__":
+    main()
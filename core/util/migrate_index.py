@@ -0,0 +1,55 @@
+"""将已有的 FAISS 索引迁移到更低的 Matryoshka 维度
+
+用法:
+    python -m core.util.migrate_index <path/to/mem_fact.faiss> --dim 256
+
+目标维度必须是 nomic-embed-text-v1.5 支持的 Matryoshka 维度，且小于当前维度。
+迁移前会先合并预写日志，再将索引、预写日志和元数据分别备份为 <path>.bak、<path>.wal.bak、
+<path>.meta.json.bak，恢复时将三者一起复制回去。迁移后需要以相同的 embedding_dim 启动 ATRIMemoryStarter。
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import faiss
+from ..provider.embedding.matryoshka import check_matryoshka_dim
+from ..storage.embedding.embedding_storage import EmbeddingStorage
+
+
+async def migrate_index(path: str, dim: int, backup: bool = True) -> None:
+    """将索引截断到指定维度
+
+    Args:
+        path (str): 索引路径
+        dim (int): 目标维度
+        backup (bool): 是否备份原索引
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    old_dim = faiss.read_index(path).d
+    check_matryoshka_dim(old_dim, dim)
+    storage = EmbeddingStorage(old_dim, path)
+    if backup:
+        # 打开时会重放并清空预写日志，先合并落盘，使备份与迁移前的数据一致
+        await storage.checkpoint(force=True)
+        for file in (storage.path, storage.wal_path, storage.meta_path):
+            if os.path.exists(file):
+                shutil.copyfile(file, file + ".bak")
+    await storage.migrate_dim(dim)
+    await storage.close()
+    print(f"{path}: {old_dim} -> {dim}, {storage.index.ntotal} vectors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="将 FAISS 索引迁移到更低的维度")
+    parser.add_argument("paths", nargs="+", help="索引文件路径")
+    parser.add_argument("--dim", type=int, required=True, help="目标维度")
+    parser.add_argument("--no-backup", action="store_true", help="不备份原索引")
+    args = parser.parse_args()
+    for path in args.paths:
+        asyncio.run(migrate_index(path, args.dim, backup=not args.no_backup))
+
+
+if __name__ == "__main__":
+    main()
@@ -149,3 +149,4 @@ class ATRIPlugin(Star):
 
     async def terminate(self):
         """可选择实现异步的插件销毁方法，当插件被卸载/停用时会调用。"""
+        await self.memory_layer.close()
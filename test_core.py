@@ -77,7 +77,7 @@ ATRI: 我最喜欢吃白萝卜和鸡蛋！
                 username=atri_user_name,
             )
         # --- test edges ---
-        ret = s.kuzu_graph_store.get_passage_edges(
+        ret = await s.kuzu_graph_store.get_passage_edges(
             filter={
                 "user_id": atri_user_id,
             }
@@ -0,0 +1,197 @@
+import asyncio
+import json
+import os
+import sqlite3
+import pytest
+from core.storage.documents.document_storage import SCHEMA_VERSION, DocumentStorage
+
+
+class TestDocumentStorage:
+    @classmethod
+    def setup_class(cls):
+        cls.db_path = "test_document_storage.db"
+
+    def teardown_method(self):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.db_path + suffix):
+                os.remove(self.db_path + suffix)
+
+    def create_legacy_db(self, rows: list[tuple[str, str]]):
+        """创建没有 doc_id 索引的旧版本数据库"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(
+            "CREATE TABLE documents (id INTEGER PRIMARY KEY AUTOINCREMENT, doc_id TEXT NOT NULL, "
+            "text TEXT NOT NULL, metadata TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP, "
+            "updated_at DATETIME DEFAULT CURRENT_TIMESTAMP)"
+        )
+        conn.executemany(
+            "INSERT INTO documents (doc_id, text, metadata) VALUES (?, ?, '{}')", rows
+        )
+        conn.commit()
+        conn.close()
+
+    def doc_id_index_is_unique(self) -> bool:
+        conn = sqlite3.connect(self.db_path)
+        indexes = {
+            row[1]: row[2] for row in conn.execute("PRAGMA index_list(documents)")
+        }
+        conn.close()
+        return bool(indexes["idx_documents_doc_id"])
+
+    @pytest.mark.asyncio
+    async def test_migrate_doc_id_index(self):
+        self.create_legacy_db([("a", "A"), ("b", "B")])
+        storage = DocumentStorage(self.db_path)
+        await storage.initialize()
+        async with storage.connection.execute("PRAGMA user_version") as cursor:
+            assert (await cursor.fetchone())[0] == SCHEMA_VERSION
+        async with storage.connection.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM documents WHERE doc_id = ?", ("a",)
+        ) as cursor:
+            assert "idx_documents_doc_id" in str(await cursor.fetchall())
+        await storage.close()
+        assert self.doc_id_index_is_unique()
+
+    @pytest.mark.asyncio
+    async def test_migrate_with_duplicate_doc_ids(self):
+        self.create_legacy_db([("a", "A"), ("a", "A2")])
+        storage = DocumentStorage(self.db_path)
+        await storage.initialize()
+        await storage.close()
+        assert not self.doc_id_index_is_unique()
+
+    @pytest.mark.asyncio
+    async def test_get_documents_by_doc_ids(self):
+        storage = DocumentStorage(self.db_path)
+        await storage.initialize()
+        for i in range(600):
+            await storage.connection.execute(
+                "INSERT INTO documents (doc_id, text, metadata) VALUES (?, ?, '{}')",
+                (f"doc_{i}", f"text {i}"),
+            )
+        await storage.connection.commit()
+        docs = await storage.get_documents_by_doc_ids(
+            [f"doc_{i}" for i in range(0, 600, 2)] + ["missing"]
+        )
+        assert len(docs) == 300
+        assert docs["doc_4"].text == "text 4"
+        await storage.close()
+
+    @pytest.mark.asyncio
+    async def test_readers_not_blocked_by_writer(self):
+        storage = DocumentStorage(self.db_path, read_pool_size=2)
+        await storage.initialize()
+        async with storage.connection.execute("PRAGMA journal_mode") as cursor:
+            assert (await cursor.fetchone())[0] == "wal"
+        await storage.connection.execute(
+            "INSERT INTO documents (doc_id, text, metadata) VALUES ('a', 'A', '{}')"
+        )
+        await storage.connection.commit()
+
+        # 写连接持有未提交的事务时，只读连接仍能读到已提交的数据
+        await storage.connection.execute("BEGIN IMMEDIATE")
+        await storage.connection.execute(
+            "INSERT INTO documents (doc_id, text, metadata) VALUES ('b', 'B', '{}')"
+        )
+        docs = await storage.get_documents_by_doc_ids(["a", "b"])
+        assert list(docs) == ["a"]
+        await storage.connection.commit()
+        assert (await storage.get_document_by_doc_id("b")).text == "B"
+        await storage.close()
+
+    @pytest.mark.asyncio
+    async def test_delete_and_update_take_write_lock(self):
+        storage = DocumentStorage(self.db_path)
+        await storage.initialize()
+        await storage.connection.execute(
+            "INSERT INTO documents (doc_id, text, metadata) VALUES ('a', 'A', '{}'), ('b', 'B', '{}')"
+        )
+        await storage.connection.commit()
+
+        # 持有写锁期间，删除与更新都必须等待，不能提交其他写入的事务
+        async with storage._write_lock:
+            delete = asyncio.create_task(storage.delete_documents_by_doc_id("a"))
+            update = asyncio.create_task(storage.update_document_by_doc_id("b", "B2"))
+            await asyncio.sleep(0.1)
+            assert not delete.done() and not update.done()
+            assert (await storage.get_document_by_doc_id("a")) is not None
+        assert len(await delete) == 1
+        await update
+        assert (await storage.get_document_by_doc_id("a")) is None
+        assert (await storage.get_document_by_doc_id("b")).text == "B2"
+        assert await storage.delete_documents_by_doc_id("a") == []
+        await storage.close()
+
+    @pytest.mark.asyncio
+    async def test_filter_planner(self):
+        storage = DocumentStorage(self.db_path, filter_index_threshold=3)
+        await storage.initialize()
+        await storage.insert_documents(
+            [f"doc_{i}" for i in range(10)],
+            [f"text {i}" for i in range(10)],
+            [json.dumps({"summary_id": f"s{i % 2}"}) for i in range(10)],
+        )
+        # 建立索引期间持有写锁，达到阈值的查询不等待索引建好，仍使用 json_extract
+        async with storage._write_lock:
+            for _ in range(3):
+                docs = await asyncio.wait_for(
+                    storage.get_documents({"summary_id": "s1"}), 1
+                )
+                assert len(docs) == 5
+            assert "summary_id" not in storage.filter_planner.columns
+        await asyncio.gather(*storage._tasks)
+        # 索引建好后过滤条件改写到带索引的生成列上
+        assert storage.filter_planner.columns["summary_id"] == "meta_summary_id"
+        async with storage.connection.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM documents WHERE "
+            + storage.filter_planner.where_clause("summary_id"),
+            ("s1",),
+        ) as cursor:
+            assert "idx_documents_meta_summary_id" in str(await cursor.fetchall())
+        assert len(await storage.get_documents({"summary_id": "s1"})) == 5
+        with pytest.raises(ValueError):
+            await storage.create_filter_columns(["bad key"])
+        await storage.close()
+
+        reopened = DocumentStorage(self.db_path)
+        await reopened.initialize()
+        assert reopened.filter_planner.columns["summary_id"] == "meta_summary_id"
+        await reopened.close()
+
+    @pytest.mark.asyncio
+    async def test_fts_tokenizer_rebuild(self):
+        storage = DocumentStorage(self.db_path)
+        await storage.initialize()
+        await storage.insert_documents(
+            ["a", "b"], ["hello world", "goodbye world"], ["{}", "{}"]
+        )
+        # trigram 无法匹配少于 3 个字符的词
+        assert not await storage.search_fts("hi", k=5)
+        assert len(await storage.search_fts("world", k=5)) == 2
+        await storage.close()
+
+        # 更换分词器后重建全文索引
+        reopened = DocumentStorage(self.db_path, fts_tokenizer="unicode61")
+        await reopened.initialize()
+        hits = await reopened.search_fts("hello", k=5)
+        assert [doc.doc_id for doc, _ in hits] == ["a"]
+        await reopened.connection.execute("DELETE FROM documents WHERE doc_id = 'a'")
+        await reopened.connection.commit()
+        assert not await reopened.search_fts("hello", k=5)
+        await reopened.close()
+
+    @pytest.mark.asyncio
+    async def test_document_record(self):
+        storage = DocumentStorage(self.db_path)
+        await storage.initialize()
+        await storage.insert_documents(["a"], ["A"], [json.dumps({"user_id": "atri"})])
+        doc = (await storage.get_documents({"user_id": "atri"}))[0]
+        assert doc.doc_id == "a"
+        assert doc.metadata is doc.metadata
+        assert doc.metadata["user_id"] == "atri"
+        # 兼容 dict 方式的访问
+        assert doc["text"] == "A"
+        assert doc.get("missing") is None
+        with pytest.raises(AttributeError):
+            doc.extra = 1
+        await storage.close()
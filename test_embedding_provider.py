@@ -0,0 +1,225 @@
+import asyncio
+import os
+import threading
+import pytest
+import numpy as np
+from core.provider.embedding import EmbeddingProvider
+from core.provider.embedding.batching import BatchingEmbeddingProvider
+from core.provider.embedding.cache import CachedEmbeddingProvider
+
+
+class FakeEmbeddingProvider(EmbeddingProvider):
+    def __init__(self, dim: int = 8):
+        self.dim = dim
+        self.batches = []
+
+    async def get_embedding(self, text):
+        return (await self.get_embeddings([text]))[0]
+
+    async def get_embeddings(self, texts):
+        self.batches.append(list(texts))
+        ret = []
+        for text in texts:
+            rng = np.random.default_rng(abs(hash(text)) % (2**32))
+            vec = rng.random(self.dim).astype("float32")
+            ret.append(vec / np.linalg.norm(vec))
+        return ret
+
+    async def get_dim(self):
+        return self.dim
+
+
+class FakeNomicProvider(FakeEmbeddingProvider):
+    """代替 NomicEmbeddingProvider 注入注册表，记录预热与关闭次数"""
+
+    fail_warmup = False
+    instances = []
+
+    def __init__(self, model, dimensionality, executor, timeout):
+        super().__init__(dim=dimensionality)
+        self.warmups = 0
+        self.closed = 0
+        self.instances.append(self)
+
+    async def warmup(self):
+        self.warmups += 1
+        await asyncio.sleep(0.05)
+        if self.fail_warmup:
+            raise RuntimeError("warmup failed")
+
+    async def close(self):
+        self.closed += 1
+
+
+class TestEmbeddingProvider:
+    @classmethod
+    def setup_class(cls):
+        cls.cache_path = "test_embedding_cache.db"
+
+    @pytest.mark.asyncio
+    async def test_batching(self):
+        fake = FakeEmbeddingProvider()
+        provider = BatchingEmbeddingProvider(fake, max_batch_size=4, max_wait_ms=5)
+        texts = ["北海道", "小樽", "天狗山", "北海道", "拉面", "螃蟹"]
+        results = await asyncio.gather(*[provider.get_embedding(t) for t in texts])
+        assert len(results) == len(texts)
+        assert np.allclose(results[0], results[3])
+        # 6 个并发请求，批大小为 4，应当合并成 2 次推理
+        assert len(fake.batches) == 2
+        assert await provider.get_dim() == fake.dim
+
+    @pytest.mark.asyncio
+    async def test_cache(self):
+        fake = FakeEmbeddingProvider()
+        provider = CachedEmbeddingProvider(fake, model="fake", db_path=self.cache_path)
+        await provider.initialize()
+        first = await provider.get_embeddings(["北海道", "小樽", "北海道"])
+        again = await provider.get_embedding("小樽")
+        assert np.allclose(first[1], again)
+        assert len(fake.batches) == 1
+        assert provider.stats.memory_hits == 1
+        await provider.close()
+
+        # 新实例从磁盘缓存中读取，不再推理
+        fake = FakeEmbeddingProvider()
+        provider = CachedEmbeddingProvider(fake, model="fake", db_path=self.cache_path)
+        await provider.initialize()
+        again = await provider.get_embedding("北海道")
+        assert np.allclose(first[0], again)
+        assert provider.stats.disk_hits == 1
+        assert not fake.batches
+        await provider.close()
+
+    @pytest.mark.asyncio
+    async def test_cache_write_back(self):
+        fake = FakeEmbeddingProvider()
+        provider = CachedEmbeddingProvider(
+            fake, model="write_back", db_path=self.cache_path, max_memory_items=1
+        )
+        await provider.initialize()
+        async with provider.connection.execute("PRAGMA synchronous") as cursor:
+            assert (await cursor.fetchone())[0] == 1  # NORMAL
+
+        # 磁盘写入被阻塞时，未命中的查询仍然直接返回
+        release = asyncio.Event()
+        disk_put = provider._disk_put
+
+        async def slow_disk_put(vectors):
+            await release.wait()
+            await disk_put(vectors)
+
+        provider._disk_put = slow_disk_put
+        first = await asyncio.wait_for(provider.get_embeddings(["小樽", "天狗山"]), 1)
+        # "小樽" 已被挤出内存 LRU，但仍在待写回队列中
+        again = await provider.get_embedding("小樽")
+        assert np.allclose(first[0], again)
+        assert len(fake.batches) == 1
+        release.set()
+        await provider.close()
+        assert not provider._pending
+
+        fake = FakeEmbeddingProvider()
+        provider = CachedEmbeddingProvider(fake, model="write_back", db_path=self.cache_path)
+        await provider.initialize()
+        await provider.get_embeddings(["小樽", "天狗山"])
+        assert provider.stats.disk_hits == 2
+        assert not fake.batches
+        await provider.close()
+
+    @pytest.mark.asyncio
+    async def test_registry_shares_provider(self, monkeypatch):
+        registry = pytest.importorskip("core.provider.embedding.registry")
+        monkeypatch.setattr(registry, "NomicEmbeddingProvider", FakeNomicProvider)
+        models = registry.EmbeddingModelRegistry()
+        # 并发获取同一配置的模型，只预热一次
+        first, second = await asyncio.gather(
+            models.acquire(dimensionality=64), models.acquire(dimensionality=64)
+        )
+        assert first is second
+        fake = first.provider
+        assert fake.warmups == 1
+        assert await models.acquire(dimensionality=128) is not first
+        assert await models.acquire(dimensionality=64, timeout=5.0) is not first
+
+        await models.release(first)
+        assert fake.closed == 0
+        await models.release(second)
+        assert fake.closed == 1
+        assert (await models.acquire(dimensionality=64)) is not first
+
+    @pytest.mark.asyncio
+    async def test_registry_closes_on_warmup_failure(self, monkeypatch):
+        registry = pytest.importorskip("core.provider.embedding.registry")
+        monkeypatch.setattr(registry, "NomicEmbeddingProvider", FakeNomicProvider)
+        monkeypatch.setattr(FakeNomicProvider, "fail_warmup", True)
+        monkeypatch.setattr(FakeNomicProvider, "instances", [])
+        models = registry.EmbeddingModelRegistry()
+        results = await asyncio.gather(
+            models.acquire(dimensionality=64),
+            models.acquire(dimensionality=64),
+            return_exceptions=True,
+        )
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert not models._entries
+        # 预热失败的提供商只创建一次，并且已经关闭
+        assert len(FakeNomicProvider.instances) == 1
+        assert FakeNomicProvider.instances[0].closed == 1
+
+    @pytest.mark.asyncio
+    async def test_nomic_timeout_releases_slot(self, monkeypatch):
+        nomic_embed = pytest.importorskip("core.provider.embedding.nomic_embed")
+        unblock = threading.Event()
+        calls = []
+
+        def slow_embed(texts, model, task_type, dimensionality):
+            calls.append(list(texts))
+            unblock.wait(5)
+            return [[0.0] * dimensionality for _ in texts]
+
+        monkeypatch.setattr(nomic_embed, "_embed_texts", slow_embed)
+        provider = nomic_embed.NomicEmbeddingProvider(
+            dimensionality=64, executor="thread", max_queue_size=1, timeout=0.2
+        )
+        with pytest.raises(asyncio.TimeoutError):
+            await provider.get_embeddings(["slow"])
+        # 超时的推理仍在执行并占着唯一的名额，新的调用在排队时超时，不会提交推理
+        with pytest.raises(asyncio.TimeoutError):
+            await provider.get_embeddings(["queued"])
+        assert calls == [["slow"]]
+
+        # 推理真正结束后名额被归还
+        unblock.set()
+        for _ in range(50):
+            if provider._queue_slots._value == 1:
+                break
+            await asyncio.sleep(0.01)
+        assert provider._queue_slots._value == 1
+        assert len(await provider.get_embeddings(["fast"])) == 1
+        assert calls[-1] == ["fast"]
+        await provider.close()
+
+    @pytest.mark.asyncio
+    async def test_nomic_inline(self, monkeypatch):
+        nomic_embed = pytest.importorskip("core.provider.embedding.nomic_embed")
+        threads = []
+
+        def fake_embed(texts, model, task_type, dimensionality):
+            threads.append(threading.current_thread())
+            return [[float(i)] * dimensionality for i in range(len(texts))]
+
+        monkeypatch.setattr(nomic_embed, "_embed_texts", fake_embed)
+        provider = nomic_embed.NomicEmbeddingProvider(dimensionality=64, executor="inline")
+        assert provider._executor is None
+        embeddings = await provider.get_embeddings(["a", "b"])
+        assert [e.shape for e in embeddings] == [(64,), (64,)]
+        assert embeddings[1][0] == 1.0
+        # inline 模式直接在事件循环所在的线程中推理，也不占用排队名额
+        assert threads == [threading.current_thread()]
+        assert provider._queue_slots._value == 32
+        await provider.close()
+
+    @classmethod
+    def teardown_class(cls):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(cls.cache_path + suffix):
+                os.remove(cls.cache_path + suffix)
@@ -0,0 +1,223 @@
+import asyncio
+import os
+import time
+import pytest
+import faiss
+import numpy as np
+from core.storage.embedding.embedding_storage import EmbeddingStorage
+from core.util.migrate_index import migrate_index
+
+
+def random_vectors(n: int, dim: int) -> np.ndarray:
+    vectors = np.random.default_rng(0).random((n, dim)).astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class TestEmbeddingStorage:
+    @classmethod
+    def setup_class(cls):
+        cls.dim = 64
+        cls.index_path = "test_embedding_storage.faiss"
+
+    def teardown_method(self):
+        for suffix in ("", ".wal", ".wal.old", ".meta.json", ".tmp"):
+            for path in (self.index_path + suffix, self.index_path + suffix + ".bak"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    @pytest.mark.asyncio
+    async def test_wal_replay(self):
+        vectors = random_vectors(10, self.dim)
+        storage = EmbeddingStorage(self.dim, self.index_path, checkpoint_interval=60)
+        for i, vector in enumerate(vectors):
+            await storage.insert(vector, i + 1)
+        await storage.delete([3])
+        # 还未合并时只有预写日志落盘
+        assert not os.path.exists(self.index_path)
+
+        # 模拟崩溃后重启，从预写日志中恢复
+        recovered = EmbeddingStorage(self.dim, self.index_path)
+        assert recovered.ntotal == 9
+        _, indices = await recovered.search(vectors[4:5].copy(), 1)
+        assert indices[0][0] == 5
+        await recovered.close()
+        assert os.path.getsize(self.index_path + ".wal") == 0
+
+        reopened = EmbeddingStorage(self.dim, self.index_path)
+        assert reopened.ntotal == 9
+        await reopened.close()
+
+    @pytest.mark.asyncio
+    async def test_migrate_index(self):
+        vectors = random_vectors(100, 128)
+        storage = EmbeddingStorage(128, self.index_path, checkpoint_interval=60)
+        await storage.insert_many(vectors[:10], np.arange(1, 11))
+        await storage.save_index()
+        await storage.delete([3])
+        await storage.insert(vectors[98], 99)
+        # 删除和 id 99 只存在于预写日志中，不合并直接迁移
+
+        for dim in (32, 128):
+            with pytest.raises(ValueError):
+                await migrate_index(self.index_path, dim)
+        assert not os.path.exists(self.index_path + ".bak")
+
+        await migrate_index(self.index_path, 64)
+        expected_ids = [1, 2, 4, 5, 6, 7, 8, 9, 10, 99]
+        reopened = EmbeddingStorage(64, self.index_path)
+        assert reopened.index.d == 64
+        ids, migrated = reopened.export_vectors()
+        assert sorted(ids.tolist()) == expected_ids
+        # 与直接以 64 维推理的做法一致: 完整向量 layer_norm，截断后 L2 归一化
+        full = vectors[ids - 1]
+        normed = (full - full.mean(axis=1, keepdims=True)) / np.sqrt(
+            full.var(axis=1, keepdims=True) + 1e-5
+        )
+        expected = normed[:, :64] / np.linalg.norm(normed[:, :64], axis=1, keepdims=True)
+        assert np.allclose(migrated, expected, atol=1e-5)
+        _, indices = await reopened.search(expected[-1:].copy(), 1)
+        assert indices[0][0] == 99
+        await reopened.close()
+
+        # 从备份恢复后得到迁移前的完整数据
+        for suffix in ("", ".wal", ".meta.json"):
+            if os.path.exists(self.index_path + suffix + ".bak"):
+                os.replace(self.index_path + suffix + ".bak", self.index_path + suffix)
+        restored = EmbeddingStorage(128, self.index_path)
+        assert restored.index.d == 128
+        ids, _ = restored.export_vectors()
+        assert sorted(ids.tolist()) == expected_ids
+        await restored.close()
+
+    @pytest.mark.asyncio
+    async def test_checkpoint_threshold(self):
+        vectors = random_vectors(5, self.dim)
+        storage = EmbeddingStorage(
+            self.dim, self.index_path, checkpoint_threshold=2, checkpoint_interval=60
+        )
+        for i, vector in enumerate(vectors):
+            await storage.insert(vector, i + 1)
+        await storage.close()
+        reopened = EmbeddingStorage(self.dim, self.index_path)
+        assert reopened.index.ntotal == 5
+        await reopened.close()
+
+    @pytest.mark.asyncio
+    async def test_promotion(self):
+        vectors = random_vectors(300, self.dim)
+        storage = EmbeddingStorage(
+            self.dim, self.index_path, promote_to="hnsw", promote_threshold=200
+        )
+        for i, vector in enumerate(vectors):
+            await storage.insert(vector, i + 1)
+        # 升级在后台进行，期间的写入会补到新索引上
+        while storage._rebuild_task is not None:
+            await asyncio.sleep(0.01)
+        assert storage.index_type == "hnsw"
+        assert storage.index.ntotal == 300
+        _, indices = await storage.search(vectors[42:43].copy(), 1)
+        assert indices[0][0] == 43
+        await storage.close()
+
+        reopened = EmbeddingStorage(self.dim, self.index_path)
+        assert reopened.index_type == "hnsw"
+        await reopened.close()
+
+    @pytest.mark.asyncio
+    async def test_delete_and_compaction(self):
+        vectors = random_vectors(20, self.dim)
+        storage = EmbeddingStorage(self.dim, self.index_path, compaction_ratio=0.5)
+        for i, vector in enumerate(vectors):
+            await storage.insert(vector, i + 1)
+        await storage.delete([5, 6, 7])
+        # 已删除的向量不再出现在结果中
+        _, indices = await storage.search(vectors[4:5].copy(), 20)
+        assert 5 not in indices[0]
+        assert (indices[0] != -1).sum() == 17
+        await storage.checkpoint()
+
+        # 标记删除在重启后仍然生效
+        reopened = EmbeddingStorage(
+            self.dim, self.index_path, compaction_ratio=0.5
+        )
+        _, indices = await reopened.search(vectors[4:5].copy(), 20)
+        assert 5 not in indices[0]
+
+        await reopened.delete(list(range(8, 16)))
+        while reopened._rebuild_task is not None:
+            await asyncio.sleep(0.01)
+        assert reopened.last_compaction.removed_vectors == 11
+        assert reopened.last_compaction.reclaimed_bytes > 0
+        assert reopened.index.ntotal == 9
+        await reopened.close()
+
+    @pytest.mark.asyncio
+    async def test_mmap(self):
+        vectors = random_vectors(400, self.dim)
+        storage = EmbeddingStorage(self.dim, self.index_path, promote_to=None)
+        for i, vector in enumerate(vectors[:300]):
+            await storage.insert(vector, i + 1)
+        await storage.promote("ivf_flat")
+        await storage.close()
+
+        mapped = EmbeddingStorage(self.dim, self.index_path, mmap=True, checkpoint_interval=60)
+        assert mapped.ntotal == 300
+        # 映射的索引只读，新写入进入增量索引，查询合并两者的结果
+        for i, vector in enumerate(vectors[300:]):
+            await mapped.insert(vector, i + 301)
+        await mapped.delete([1])
+        assert mapped._delta.ntotal == 100
+        _, indices = await mapped.search(vectors[350:351].copy(), 1)
+        assert indices[0][0] == 351
+        _, indices = await mapped.search(vectors[42:43].copy(), 1, ids=np.array([43, 351]))
+        assert indices[0][0] == 43
+        await mapped.checkpoint()
+        assert mapped._delta.ntotal == 0
+        assert mapped.index.ntotal == 400
+        _, indices = await mapped.search(vectors[350:351].copy(), 1)
+        assert indices[0][0] == 351
+        await mapped.close()
+
+        reopened = EmbeddingStorage(self.dim, self.index_path, mmap=True)
+        assert reopened.ntotal == 399
+        assert len(reopened.export_vectors()[0]) == 399
+        await reopened.close()
+
+    @pytest.mark.asyncio
+    async def test_mmap_checkpoint_during_rebuild(self):
+        vectors = random_vectors(300, self.dim)
+        storage = EmbeddingStorage(self.dim, self.index_path, promote_to=None)
+        for i, vector in enumerate(vectors[:200]):
+            await storage.insert(vector, i + 1)
+        await storage.close()
+
+        mapped = EmbeddingStorage(
+            self.dim, self.index_path, mmap=True, checkpoint_interval=60, promote_to=None
+        )
+        merge = mapped._write_merged_checkpoint
+
+        def slow_merge(ids, vectors):
+            time.sleep(0.3)
+            return merge(ids, vectors)
+
+        mapped._write_merged_checkpoint = slow_merge
+        for i, vector in enumerate(vectors[200:260]):
+            await mapped.insert(vector, i + 201)
+        # 检查点在线程中合并时，重建完成并替换索引
+        checkpoint = asyncio.create_task(mapped.checkpoint())
+        await asyncio.sleep(0.05)
+        rebuild = asyncio.create_task(mapped.promote("hnsw"))
+        await asyncio.sleep(0)
+        for i, vector in enumerate(vectors[260:]):
+            await mapped.insert(vector, i + 261)
+        await asyncio.gather(checkpoint, rebuild)
+        assert mapped.index_type == "hnsw"
+        assert mapped.ntotal == 300
+        await mapped.close()
+
+        reopened = EmbeddingStorage(self.dim, self.index_path, mmap=True, promote_to=None)
+        assert reopened.ntotal == 300
+        assert reopened.index_type == "hnsw"
+        _, indices = await reopened.search(vectors[290:291].copy(), 1)
+        assert indices[0][0] == 291
+        await reopened.close()
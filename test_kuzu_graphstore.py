@@ -94,6 +94,42 @@ class TestVecStore:
         assert len(nodes) == 1
         assert nodes[0][0].id == "1"
         assert nodes[0][1].id == "2"
+        # Test get_phase_nodes_by_fact_ids()
+        fact_nodes = self.graph_store.get_phase_nodes_by_fact_ids(
+            ["fact_1", "fact_2", "missing"]
+        )
+        assert set(fact_nodes) == {"fact_1", "fact_2"}
+        assert [(a.id, b.id) for a, b in fact_nodes["fact_2"]] == [("2", "3")]
+        # Test phase_node_degrees()
+        degrees = self.graph_store.phase_node_degrees(["1", "2", "3", "missing"])
+        assert degrees == {"1": 1, "2": 2, "3": 1, "missing": 0}
+        assert self.graph_store.cnt_phase_node_edges("2") == 2
+        # fact_id 索引在重新打开数据库后恢复，并随删除同步
+        self.graph_store = KuzuGraphStore(db_path=self.kuzu_path)
+        assert self.graph_store._fact_index["fact_1"] == [("1", "2")]
+        self.graph_store.delete_phase_edge_by_fact_id("fact_1")
+        assert self.graph_store.get_phase_nodes_by_fact_ids(["fact_1"]) == {}
+        assert len(list(self.graph_store.get_phase_edges())) == 1
+        # Test upsert_phase_nodes(), 同名实体按用户区分
+        ts = int(time.time())
+        ids = self.graph_store.upsert_phase_nodes(
+            [
+                PhaseNode(id="u1_alice", ts=ts, name="Alice", type="user", user_id="user_1"),
+                PhaseNode(id="u1_dave", ts=ts, name="Dave", type="user", user_id="user_1"),
+            ]
+        )
+        assert ids == ["u1_alice", "u1_dave"]
+        ids = self.graph_store.upsert_phase_nodes(
+            [
+                PhaseNode(id="new", ts=ts, name="Alice", type="user", user_id="user_1"),
+                PhaseNode(id="u2_alice", ts=ts, name="Alice", type="user", user_id="user_2"),
+                PhaseNode(id="dup", ts=ts, name="Alice", type="user", user_id="user_2"),
+            ]
+        )
+        assert ids == ["u1_alice", "u2_alice", "u2_alice"]
+        assert self.graph_store.find_phase_node_by_name("Alice", user_id="user_2") == "u2_alice"
+        assert self.graph_store.find_phase_node_by_name("Alice") == "1"
+        assert len(list(self.graph_store.get_phase_nodes(filter={"name": "Alice"}))) == 3
         # Test run_ppr()
         ppr_result = self.graph_store.run_ppr(
             personalization={"1": 1.0},
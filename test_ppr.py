@@ -0,0 +1,272 @@
+import asyncio
+import json
+import os
+import shutil
+import threading
+import time
+from dataclasses import replace
+import networkx as nx
+import numpy as np
+import pytest
+from core.storage.graph.kuzu_impl import *  # noqa
+from core.storage.graph.kuzu_async import AsyncKuzuGraphStore
+from core.storage.graph.ppr import PPRGraph, PPRSnapshot, push_ppr
+
+
+def random_edges(n_nodes: int, n_edges: int, seed: int = 0) -> list[tuple[str, str]]:
+    rng = np.random.default_rng(seed)
+    return [
+        (f"n{a}", f"n{b}")
+        for a, b in rng.integers(0, n_nodes, size=(n_edges, 2))
+        if a != b
+    ]
+
+
+def nx_pagerank(edges, personalization, **kwargs) -> dict[str, float]:
+    G = nx.MultiDiGraph()
+    G.add_edges_from(edges)
+    p = {node: personalization.get(node, 0.0) for node in G.nodes}
+    return nx.pagerank(G, personalization=p, **kwargs)
+
+
+class TestPPR:
+    @classmethod
+    def setup_class(cls):
+        cls.kuzu_path = "test_ppr_graph"
+
+    def teardown_method(self):
+        if os.path.isdir(self.kuzu_path):
+            shutil.rmtree(self.kuzu_path)
+        for suffix in ("", ".wal"):
+            if os.path.isfile(self.kuzu_path + suffix):
+                os.remove(self.kuzu_path + suffix)
+
+    def test_matches_networkx(self):
+        edges = random_edges(200, 1000)
+        # 平行边与没有出边的节点
+        edges += edges[:50] + [("n1", "sink")]
+        personalization = {"n1": 1.0, "n7": 0.5, "sink": 0.2}
+        graph = PPRGraph()
+        for source, target in edges:
+            graph.add_edge(source, target)
+        result = graph.run(personalization, damping_factor=0.5)
+        expected = nx_pagerank(edges, personalization, alpha=0.5)
+        assert result.keys() == expected.keys()
+        for node, score in expected.items():
+            assert result[node] == pytest.approx(score, abs=1e-6)
+        assert list(result.values()) == sorted(result.values(), reverse=True)
+
+    def test_incremental_update(self):
+        edges = random_edges(50, 200, seed=1)
+        graph = PPRGraph()
+        for i, (source, target) in enumerate(edges):
+            graph.add_edge(source, target, fact_id=f"fact_{i}")
+        graph.run({"n1": 1.0})
+        # 查询之后的增删在下一次查询时合并
+        assert graph.remove_fact("fact_0")
+        assert not graph.remove_fact("fact_0")
+        graph.add_edge("n1", "new", fact_id="fact_new")
+        result = graph.run({"n1": 1.0})
+        expected = nx_pagerank(edges[1:] + [("n1", "new")], {"n1": 1.0}, alpha=0.5)
+        for node, score in expected.items():
+            assert result[node] == pytest.approx(score, abs=1e-6)
+
+    def test_push_approximates_exact(self):
+        edges = random_edges(500, 2000, seed=2) + [("n1", "sink")]
+        personalization = {"n1": 1.0, "n7": 0.5}
+        graph = PPRGraph()
+        for source, target in edges:
+            graph.add_edge(source, target)
+        exact = graph.run(personalization)
+        approx = push_ppr(personalization, graph.out_neighbors, epsilon=1e-6)
+        for node, score in approx.items():
+            assert score == pytest.approx(exact[node], abs=1e-3)
+        assert list(approx)[:5] == list(exact)[:5]
+
+        # 推送次数达到上限时返回部分结果
+        touched = []
+        def out_neighbors(ids):
+            touched.extend(ids)
+            return graph.out_neighbors(ids)
+        partial = push_ppr(personalization, out_neighbors, max_pushes=10)
+        assert 0 < len(partial) <= 10
+        assert len(touched) < len(graph.node_ids)
+        assert push_ppr({}, graph.out_neighbors) == {}
+        # FAISS 相似度作为种子分数时结果仍是 float，可以序列化为 JSON
+        seeded = push_ppr(
+            {k: np.float32(v) for k, v in personalization.items()}, graph.out_neighbors
+        )
+        assert all(type(v) is float for v in seeded.values())
+        json.dumps(seeded)
+
+    def test_snapshot_isolated_from_writes(self):
+        edges = random_edges(50, 200, seed=3)
+        graph = PPRGraph()
+        for i, (source, target) in enumerate(edges):
+            graph.add_edge(source, target, fact_id=f"fact_{i}")
+        snapshot = graph.snapshot()
+        before = snapshot.run({"n1": 1.0})
+        # 快照之后的写入(包括新增节点导致矩阵扩容)不影响已有快照
+        graph.add_edge("n1", "brand_new")
+        graph.remove_fact("fact_0")
+        assert graph.run({"n1": 1.0}) != before
+        assert snapshot.run({"n1": 1.0}) == before
+        assert snapshot.out_neighbors(["brand_new"]) == {"brand_new": []}
+
+    def test_kuzu_graph_store(self):
+        store = KuzuGraphStore(db_path=self.kuzu_path)
+        ts = int(time.time())
+        for i in range(4):
+            store.add_phase_node(PhaseNode(id=f"p{i}", ts=ts, name=f"e{i}", type="t"))
+        store.add_passage_node(PassageNode(id="s1", ts=ts, user_id="u"))
+        for i in range(3):
+            store.add_phase_edge(
+                PhaseEdge(
+                    source=f"p{i}", target=f"p{i + 1}", ts=ts,
+                    relation_type="r", user_id="u", fact_id=f"f{i}",
+                )
+            )
+        store.add_passage_edge(
+            PassageEdge(
+                source="p3", target="s1", ts=ts,
+                relation_type="r", user_id="u", summary_id="s1",
+            )
+        )
+        # push 模式在图未加载时按需查询数据库
+        lazy = store.run_ppr({"p0": 1.0}, user_id="u", method="push", epsilon=1e-8)
+        assert "u" not in store._ppr_graphs
+        before = store.run_ppr({"p0": 1.0}, user_id="u")
+        assert set(before) == {"p0", "p1", "p2", "p3", "s1"}
+        for node, score in lazy.items():
+            assert score == pytest.approx(before[node], abs=1e-4)
+        with pytest.raises(ValueError):
+            store.run_ppr({"p0": 1.0}, user_id="u", method="unknown")
+
+        # 写入会同步到已加载的图上，结果与重新从数据库加载一致
+        store.delete_phase_edge_by_fact_id("f1")
+        store.add_phase_edge(
+            PhaseEdge(
+                source="p0", target="p3", ts=ts,
+                relation_type="r", user_id="u", fact_id="f3",
+            )
+        )
+        # 迭代在锁外进行，其他线程此时可以写入
+        lock_free = []
+        run = PPRSnapshot.run
+
+        def try_lock():
+            acquired = store._lock.acquire(blocking=False)
+            if acquired:
+                store._lock.release()
+            lock_free.append(acquired)
+
+        def check_lock(*args, **kwargs):
+            thread = threading.Thread(target=try_lock)
+            thread.start()
+            thread.join()
+            return run(*args, **kwargs)
+
+        PPRSnapshot.run = check_lock
+        try:
+            cached = store.run_ppr({"p0": 1.0}, user_id="u")
+        finally:
+            PPRSnapshot.run = run
+        assert lock_free == [True]
+        reloaded = store._load_ppr_graph("u").run({"p0": 1.0})
+        assert cached == pytest.approx(reloaded)
+        assert cached["p2"] == 0.0
+
+    def test_write_batch(self):
+        store = KuzuGraphStore(db_path=self.kuzu_path)
+        ts = int(time.time())
+        store.run_ppr({"p0": 1.0}, user_id="u")
+        nodes = [
+            PassageNode(id="s1", ts=ts, user_id="u"),
+            PhaseNode(id="p0", ts=ts, name="e0", type="t", user_id="u"),
+            PhaseNode(id="p1", ts=ts, name="e1", type="t", user_id="u"),
+        ]
+        edges = [
+            PhaseEdge(
+                source="p0", target="p1", ts=ts,
+                relation_type="r", user_id="u", fact_id="f0",
+            ),
+            PassageEdge(
+                source="p1", target="s1", ts=ts,
+                relation_type="r", user_id="u", summary_id="s1",
+            ),
+        ]
+        # 写入失败时整个批次回滚，内存中的索引也不变
+        with pytest.raises(RuntimeError):
+            store.write_batch(nodes, edges + [replace(edges[0], ts="bad")])
+        assert list(store.get_phase_nodes()) == []
+        assert store.find_phase_node_by_name("e0", user_id="u") is None
+
+        store.write_batch(nodes, edges)
+        assert store.find_phase_node_by_name("e1", user_id="u") == "p1"
+        assert len(store.get_phase_nodes_by_fact_ids(["f0"])["f0"]) == 1
+        assert len(list(store.get_passage_edges())) == 1
+        assert store.run_ppr({"p0": 1.0}, user_id="u") == pytest.approx(
+            store._load_ppr_graph("u").run({"p0": 1.0})
+        )
+        assert store.run_ppr({"p0": 1.0}, user_id="nobody") == {}
+
+    @pytest.mark.asyncio
+    async def test_async_graph_store(self):
+        store = AsyncKuzuGraphStore(db_path=self.kuzu_path, read_workers=2)
+        ts = int(time.time())
+        nodes = [
+            PhaseNode(id=f"p{i}", ts=ts, name=f"e{i}", type="t", user_id="u")
+            for i in range(20)
+        ]
+        edges = [
+            PhaseEdge(
+                source=f"p{i}", target=f"p{i + 1}", ts=ts,
+                relation_type="r", user_id="u", fact_id=f"f{i}",
+            )
+            for i in range(19)
+        ]
+        await store.write_batch(nodes, edges)
+        assert await store.find_phase_node_by_name("e3", user_id="u") == "p3"
+
+        # 读并发执行，写与读交错时 PPR 图与数据库保持一致
+        results = await asyncio.gather(
+            *[store.run_ppr({"p0": 1.0}, user_id="u") for _ in range(4)],
+            store.delete_phase_edge_by_fact_id("f0"),
+            *[store.phase_node_degrees(["p0", "p1"]) for _ in range(4)],
+        )
+        # 删除前后的结果都是合法的，删除后 p0 不再有边
+        assert all(len(ppr) in (19, 20) for ppr in results[:4])
+        assert await store.phase_node_degrees(["p0"]) == {"p0": 0}
+        assert await store.run_ppr({"p1": 1.0}, user_id="u") == pytest.approx(
+            store.store._load_ppr_graph("u").run({"p1": 1.0})
+        )
+        assert len(await store.get_phase_edges({"user_id": "u"})) == 18
+        await store.close()
+
+    @pytest.mark.asyncio
+    async def test_write_batch_resolves_entities(self):
+        store = AsyncKuzuGraphStore(db_path=self.kuzu_path, read_workers=2)
+        ts = int(time.time())
+
+        def passage(i: int):
+            nodes = [
+                PassageNode(id=f"s{i}", ts=ts, user_id="u1"),
+                PhaseNode(id=f"alice{i}", ts=ts, name="Alice", type="t", user_id="u1"),
+            ]
+            edges = [
+                PassageEdge(
+                    source=f"alice{i}", target=f"s{i}", ts=ts,
+                    relation_type="r", user_id="u1", summary_id=f"s{i}",
+                )
+            ]
+            return nodes, edges
+
+        # 并发写入同一用户的同名实体只产生一个节点，边的端点改写到该节点
+        results = await asyncio.gather(*[store.write_batch(*passage(i)) for i in range(4)])
+        alice = await store.find_phase_node_by_name("Alice", user_id="u1")
+        assert [result[f"alice{i}"] for i, result in enumerate(results)] == [alice] * 4
+        assert len(await store.get_phase_nodes({"name": "Alice"})) == 1
+        edges = await store.get_passage_edges({"user_id": "u1"})
+        assert {edge.source for edge in edges} == {alice}
+        assert len(edges) == 4
+        await store.close()
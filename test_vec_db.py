@@ -0,0 +1,210 @@
+import os
+import sqlite3
+import pytest
+from core.storage.documents.document_storage import DocumentStorage
+from core.storage.embedding.embedding_storage import EmbeddingStorage
+from core.storage.vec_db import VecDB
+from test_embedding_provider import FakeEmbeddingProvider
+
+
+class TestVecDB:
+    @classmethod
+    def setup_class(cls):
+        cls.db_path = "test_vec_db.db"
+        cls.index_path = "test_vec_db.faiss"
+
+    async def create_vec_db(self) -> VecDB:
+        provider = FakeEmbeddingProvider(dim=32)
+        document_storage = DocumentStorage(self.db_path)
+        await document_storage.initialize()
+        embedding_storage = EmbeddingStorage(await provider.get_dim(), self.index_path)
+        vec_db = VecDB(
+            document_storage=document_storage,
+            embedding_storage=embedding_storage,
+            embedding_provider=provider,
+        )
+        await vec_db.initialize()
+        return vec_db
+
+    def teardown_method(self):
+        for path in (self.db_path, self.index_path):
+            for suffix in ("", "-wal", "-shm", ".wal", ".meta.json"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+    @pytest.mark.asyncio
+    async def test_filter_pushdown(self):
+        vec_db = await self.create_vec_db()
+        # 大量其他用户的数据，目标用户的数据不会出现在全局 top-k 中
+        for i in range(200):
+            await vec_db.insert(f"北海道 {i}", {"user_id": "other"})
+        for text in ["我喜欢喝咖啡", "我今天去了北海道", "日本街道好整洁"]:
+            await vec_db.insert(text, {"user_id": "atri", "username": "ATRI"})
+
+        results = await vec_db.retrieve(
+            "北海道 1", k=3, metadata_filters={"user_id": "atri"}
+        )
+        assert len(results) == 3
+        assert all(r.data.metadata["user_id"] == "atri" for r in results)
+        assert not await vec_db.retrieve(
+            "北海道", k=3, metadata_filters={"user_id": "nobody"}
+        )
+        # 未建立索引的键退回到 FAISS 检索后再过滤
+        results = await vec_db.retrieve(
+            "我今天去了北海道",
+            k=1,
+            metadata_filters={"username": "ATRI"},
+        )
+        assert len(results) == 1
+        assert results[0].data.text == "我今天去了北海道"
+        await vec_db.close()
+
+    @pytest.mark.asyncio
+    async def test_metadata_index_built_on_initialize(self):
+        vec_db = await self.create_vec_db()
+        for i in range(5):
+            await vec_db.insert(f"fact {i}", {"user_id": f"user_{i % 2}"})
+        await vec_db.close()
+
+        # 重新打开后索引在 initialize 中构建，检索时不再加载
+        vec_db = await self.create_vec_db()
+        assert vec_db._metadata_index_loaded
+        assert len(vec_db.metadata_index.lookup({"user_id": "user_0"})) == 3
+        vec_db.document_storage.get_metadata_values = None
+        results = await vec_db.retrieve("fact 1", k=5, metadata_filters={"user_id": "user_1"})
+        assert len(results) == 2
+        await vec_db.close()
+
+    @pytest.mark.asyncio
+    async def test_delete(self):
+        vec_db = await self.create_vec_db()
+        for i in range(5):
+            await vec_db.insert(f"fact {i}", {"user_id": "atri"}, id=f"fact_{i}")
+        await vec_db.delete("fact_1")
+        results = await vec_db.retrieve("fact 1", k=5)
+        assert len(results) == 4
+        assert "fact_1" not in [r.data.doc_id for r in results]
+        assert vec_db.embedding_storage.ntotal == 4
+        await vec_db.close()
+
+    @pytest.mark.asyncio
+    async def test_retrieve_many(self):
+        vec_db = await self.create_vec_db()
+        for i in range(10):
+            await vec_db.insert(f"fact {i}", {"user_id": "atri" if i % 2 else "other"})
+        queries = ["fact 1", "fact 3", "fact 4"]
+        batched = await vec_db.retrieve_many(
+            queries, k=2, metadata_filters={"user_id": "atri"}
+        )
+        assert len(batched) == 3
+        for query, results in zip(queries, batched):
+            single = await vec_db.retrieve(
+                query, k=2, metadata_filters={"user_id": "atri"}
+            )
+            assert [r.data.id for r in results] == [r.data.id for r in single]
+        assert batched[0][0].data.text == "fact 1"
+        assert await vec_db.retrieve_many([]) == []
+        await vec_db.close()
+
+    @pytest.mark.asyncio
+    async def test_adaptive_fetch_k(self):
+        vec_db = await self.create_vec_db()
+        for i in range(300):
+            await vec_db.insert(f"北海道 {i}", {"user_id": "other"})
+        for i in range(3):
+            await vec_db.insert(f"咖啡 {i}", {"user_id": "atri", "username": "ATRI"})
+
+        # username 未建立索引，过滤后不足 k 条时扩大 fetch_k 重新检索
+        results = await vec_db.retrieve(
+            "北海道 1", k=3, fetch_k=10, metadata_filters={"username": "ATRI"}
+        )
+        assert len(results) == 3
+        stats = vec_db.filter_stats['{"username": "ATRI"}']
+        assert stats.expansions > 0
+        assert stats.fetched > 10
+        assert stats.results == 3
+
+        # 下一次查询根据选择率直接从更大的 fetch_k 开始
+        assert stats.estimate_fetch_k(3, 10) > 10
+        await vec_db.retrieve(
+            "北海道 2", k=3, fetch_k=10, metadata_filters={"username": "ATRI"}
+        )
+        assert stats.queries == 2
+
+        # 没有匹配的过滤条件在第一次查询后直接从上限开始，不再逐步扩大
+        for _ in range(2):
+            assert not await vec_db.retrieve(
+                "北海道", k=3, fetch_k=10, metadata_filters={"username": "nobody"}
+            )
+        stats = vec_db.filter_stats['{"username": "nobody"}']
+        assert stats.selectivity == 0
+        assert stats.queries == 2
+        first_expansions = stats.expansions
+        await vec_db.retrieve(
+            "北海道", k=3, fetch_k=10, metadata_filters={"username": "nobody"}
+        )
+        assert stats.expansions == first_expansions > 0
+
+        # 统计按最近使用淘汰
+        vec_db.max_filter_stats = 2
+        await vec_db.retrieve("咖啡", k=1, metadata_filters={"username": "x"})
+        assert list(vec_db.filter_stats) == ['{"username": "nobody"}', '{"username": "x"}']
+        await vec_db.close()
+
+    @pytest.mark.asyncio
+    async def test_insert_many(self):
+        vec_db = await self.create_vec_db()
+        ids = await vec_db.insert_many(
+            [f"fact {i}" for i in range(5)],
+            metadatas=[{"user_id": "atri"}] * 5,
+            ids=[f"fact_{i}" for i in range(5)],
+        )
+        assert len(set(ids)) == 5
+        results = await vec_db.retrieve(
+            "fact 3", k=1, metadata_filters={"user_id": "atri"}
+        )
+        assert results[0].data.doc_id == "fact_3"
+        assert results[0].data.id == ids[3]
+
+        # 重复的 doc_id 使整批写入回滚
+        with pytest.raises(sqlite3.IntegrityError):
+            await vec_db.insert_many(["new fact", "dup"], ids=["new", "fact_0"])
+        assert await vec_db.document_storage.get_document_by_doc_id("new") is None
+        assert vec_db.embedding_storage.ntotal == 5
+        await vec_db.close()
+
+    @pytest.mark.asyncio
+    async def test_lexical_and_hybrid(self):
+        vec_db = await self.create_vec_db()
+        texts = ["我今天去了北海道", "北海道的螃蟹很好吃", "我喜欢喝咖啡", "日本街道好整洁"]
+        for text in texts:
+            await vec_db.insert(text, {"user_id": "atri"})
+        await vec_db.insert("北海道下雪了", {"user_id": "other"})
+        provider = vec_db.embedding_provider
+
+        results = await vec_db.retrieve(
+            "北海道", k=5, mode="bm25", metadata_filters={"user_id": "atri"}
+        )
+        assert {r.data.text for r in results} == set(texts[:2])
+
+        # 全文检索的前 k 条都包含完整的查询，跳过嵌入计算
+        embed_calls = len(provider.batches)
+        results = await vec_db.retrieve(
+            "北海道", k=2, mode="hybrid", metadata_filters={"user_id": "atri"}
+        )
+        assert len(provider.batches) == embed_calls
+        assert {r.data.text for r in results} == set(texts[:2])
+
+        # 否则融合全文检索与向量检索的排名
+        results = await vec_db.retrieve("喝咖啡", k=3, mode="hybrid")
+        assert len(provider.batches) == embed_calls + 1
+        assert results[0].data.text == "我喜欢喝咖啡"
+        assert len(results) == 3
+
+        await vec_db.document_storage.update_document_by_doc_id(
+            results[0].data.doc_id, "我喜欢喝红茶"
+        )
+        assert not await vec_db.retrieve("喝咖啡", k=3, mode="bm25")
+        with pytest.raises(ValueError):
+            await vec_db.retrieve("北海道", mode="sparse")
+        await vec_db.close()
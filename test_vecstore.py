@@ -33,6 +33,7 @@ class TestVecStore:
             embedding_storage=self.fact_vec_store,
             embedding_provider=self.embedding_model,
         )
+        await self.fact_vec_db.initialize()
 
     @pytest.mark.asyncio
     async def test_vecstore(self):
@@ -92,7 +93,9 @@ class TestVecStore:
 
     @classmethod
     def teardown_class(cls):
-        if os.path.exists(cls.fact_db_path):
-            os.remove(cls.fact_db_path)
-        if os.path.exists(cls.embedding_db_path):
-            os.remove(cls.embedding_db_path)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(cls.fact_db_path + suffix):
+                os.remove(cls.fact_db_path + suffix)
+        for suffix in ("", ".wal", ".meta.json"):
+            if os.path.exists(cls.embedding_db_path + suffix):
+                os.remove(cls.embedding_db_path + suffix)